@@ -0,0 +1,964 @@
+"""
+Async (ASGI) serving mode for the secure face recognition API
+
+Serves the same routes, request formats and JSON responses as
+face_auth_secure.py, but the HTTP layer runs on an asyncio event loop:
+
+- MySQL is reached through an aiomysql pool, so a request waiting on the
+  database holds a coroutine instead of a thread
+- decode/detect/extract (and gallery rebuilds) run on a bounded thread
+  executor, or on the CV worker processes when FACE_CV_WORKERS is set
+- last_face_login updates go through the shared LoginWriter thread,
+  which uses its own connection from face_auth_secure's pool
+- gallery, template cache, metrics and response bodies are shared with
+  face_auth_secure, so both modes answer identically
+
+Run it with uvicorn instead of `python face_auth_secure.py`:
+
+    uvicorn face_auth_async:app --host 127.0.0.1 --port 5001
+
+With FACE_DB_STANDIN set, the sqlite stand-in is used through a thread
+(development only).
+"""
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import aiomysql
+from flask import jsonify
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import HTMLResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import face_auth_secure as api
+import face_metrics
+from face_auth_secure import log, stage_seconds, PipelineBusy, PayloadTooLarge
+
+# Connections in the aiomysql pool; an idle one costs a socket, not a thread
+ASYNC_DB_POOL_SIZE = int(os.environ.get('FACE_ASYNC_DB_POOL_SIZE', 32))
+# Threads running the CPU-bound face pipeline (the event loop never runs OpenCV)
+ASYNC_CV_THREADS = int(os.environ.get('FACE_ASYNC_CV_THREADS', api.DETECTOR_POOL_SIZE))
+
+class DatabaseUnavailable(Exception):
+    """Raised when no database connection can be obtained"""
+
+class AsyncFaceDB:
+    """aiomysql pool with the three query helpers the routes need
+
+    Runs in autocommit mode: every statement the API issues is a single
+    SELECT or UPDATE, and pooled connections never hold a stale snapshot.
+    """
+
+    def __init__(self, config, size=ASYNC_DB_POOL_SIZE, timeout=api.DB_POOL_TIMEOUT):
+        self.config = config
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._pool = None
+
+    async def start(self):
+        self._pool = await aiomysql.create_pool(
+            host=self.config['host'],
+            port=self.config['port'],
+            db=self.config['database'],
+            user=self.config['user'],
+            password=self.config['password'],
+            minsize=1,
+            maxsize=self.size,
+            autocommit=True,
+            pool_recycle=3600
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+
+    @asynccontextmanager
+    async def _cursor(self, dictionary):
+        if self._pool is None:
+            raise DatabaseUnavailable()
+        try:
+            connection = await asyncio.wait_for(self._pool.acquire(), self.timeout)
+        except Exception as e:
+            log.error(f"[DB ERROR] {e!r}")
+            raise DatabaseUnavailable() from e
+        try:
+            async with connection.cursor(aiomysql.DictCursor if dictionary else aiomysql.Cursor) as cursor:
+                yield cursor
+        finally:
+            self._pool.release(connection)
+
+    async def fetchone(self, query, params=(), dictionary=True):
+        async with self._cursor(dictionary) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchone()
+
+    async def fetchall(self, query, params=(), dictionary=True):
+        async with self._cursor(dictionary) as cursor:
+            await cursor.execute(query, params)
+            return await cursor.fetchall()
+
+    async def execute(self, query, params=()):
+        """Run a write and return the affected row count"""
+        async with self._cursor(False) as cursor:
+            await cursor.execute(query, params)
+            return cursor.rowcount
+
+    def status(self):
+        if self._pool is None:
+            return {'size': self.size, 'connected': False}
+        return {
+            'size': self.size,
+            'open': self._pool.size,
+            'idle': self._pool.freesize,
+            'in_use': self._pool.size - self._pool.freesize
+        }
+
+class StandinFaceDB:
+    """AsyncFaceDB interface over the synchronous stand-in pool, via threads"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        await asyncio.to_thread(self._pool.close_all)
+
+    def _run(self, query, params, dictionary, fetch):
+        with self._pool.connection() as connection:
+            if not connection:
+                raise DatabaseUnavailable()
+            cursor = connection.cursor(dictionary=dictionary)
+            cursor.execute(query, params)
+            if fetch == 'one':
+                result = cursor.fetchone()
+            elif fetch == 'all':
+                result = cursor.fetchall()
+            else:
+                connection.commit()
+                result = cursor.rowcount
+            cursor.close()
+            return result
+
+    async def fetchone(self, query, params=(), dictionary=True):
+        return await asyncio.to_thread(self._run, query, params, dictionary, 'one')
+
+    async def fetchall(self, query, params=(), dictionary=True):
+        return await asyncio.to_thread(self._run, query, params, dictionary, 'all')
+
+    async def execute(self, query, params=()):
+        return await asyncio.to_thread(self._run, query, params, False, None)
+
+    def status(self):
+        return self._pool.status()
+
+db = StandinFaceDB(api.db_pool) if api.DB_STANDIN_PATH else AsyncFaceDB(api.DB_CONFIG)
+cv_executor = ThreadPoolExecutor(max_workers=max(1, ASYNC_CV_THREADS), thread_name_prefix='face-cv')
+gallery_lock = asyncio.Lock()
+
+async def run_cv(fn, *args, **kwargs):
+    """Run CPU-bound work on the CV executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cv_executor, functools.partial(fn, *args, **kwargs))
+
+def _wake(future):
+    if not future.done():
+        future.set_result(True)
+
+@asynccontextmanager
+async def admission(name):
+    """Async counterpart of AdmissionControl.admit: the queued request awaits a future"""
+    control = api.admission_control
+    if not control.enabled:
+        yield
+        return
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    woken = loop.create_future()
+    ticket = control.enter(name, lambda: loop.call_soon_threadsafe(_wake, woken))
+    if ticket is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(woken), control.deadline)
+        except asyncio.TimeoutError:
+            retry_after = control.cancel(name, ticket)
+            if retry_after is not None:
+                raise api.Overloaded(retry_after)
+        except asyncio.CancelledError:
+            # The client went away; hand back a slot that was granted meanwhile
+            if control.cancel(name, ticket, reason=None) is None:
+                control.release(0.0)
+            raise
+    control.admitted(name, time.monotonic() - start)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        control.release(time.monotonic() - start)
+
+def admitted(name):
+    """Route decorator: run the endpoint under admission control with priority `name`"""
+    def decorate(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(request):
+            try:
+                async with admission(name):
+                    return await endpoint(request)
+            except api.Overloaded as e:
+                return flask_response(functools.partial(api.overloaded_response, e.retry_after))
+        return wrapper
+    return decorate
+
+def flask_response(view):
+    """Render a face_auth_secure response (jsonify or a (body, status, headers) tuple)
+
+    Going through Flask's own response machinery keeps the bytes, status
+    codes and headers identical to the threaded server.
+    """
+    with api.app.app_context():
+        response = api.app.make_response(view())
+    headers = {key: value for key, value in response.headers.items() if key.lower() != 'content-length'}
+    return Response(response.get_data(), status_code=response.status_code, headers=headers)
+
+def respond(body, status=200):
+    return flask_response(lambda: (jsonify(body), status))
+
+async def read_body(request):
+    """Read the request body, stopping as soon as it exceeds MAX_PAYLOAD_BYTES"""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > api.MAX_PAYLOAD_BYTES:
+            raise PayloadTooLarge()
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+async def read_face_request(request):
+    """Async counterpart of face_auth_secure.read_face_request"""
+    length = request.headers.get('content-length')
+    if length and length.isdigit() and int(length) > api.MAX_PAYLOAD_BYTES:
+        raise PayloadTooLarge()
+
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if mimetype == 'multipart/form-data':
+        form = await request.form()
+        upload = form.get('image')
+        return form, await upload.read() if hasattr(upload, 'read') else b''
+
+    body = await read_body(request)
+    if mimetype in api.RAW_IMAGE_TYPES:
+        return request.query_params, body
+
+    data = {}
+    if mimetype == 'application/json' or mimetype.endswith('+json'):
+        try:
+            data = json.loads(body) or {}
+        except ValueError:
+            data = {}
+    image_base64 = data.get('image') if isinstance(data, dict) else None
+    if not image_base64:
+        return data, b''
+    with stage_seconds.time(stage='payload_decode'):
+        return data, api.decode_image_payload(image_base64)
+
+async def load_stored_face(user_id):
+    """Async counterpart of face_auth_secure.load_stored_face"""
+    if api.template_cache.revalidation_due():
+        query, params = api.template_cache.revalidation_query()
+        try:
+            api.template_cache.apply_revalidation(await db.fetchall(query, params))
+        except DatabaseUnavailable:
+            pass
+
+    entry = api.template_cache.get(user_id)
+    if entry is not None:
+        return entry, 'ok'
+
+    try:
+        with stage_seconds.time(stage='db_query'):
+            user = await db.fetchone(api.STORED_FACE_QUERY, (user_id,))
+    except DatabaseUnavailable:
+        return None, 'db_error'
+    return api.cache_stored_face(user_id, user)
+
+async def sync_gallery(background=False):
+    """Async counterpart of FaceGallery.sync; one rebuild at a time"""
+    gallery = api.face_gallery
+    if not gallery.sync_due(background=background):
+        return
+    async with gallery_lock:
+        if not gallery.sync_due(background=background):
+            return
+        with stage_seconds.time(stage='gallery_sync'):
+            await asyncio.to_thread(gallery.load_snapshot)
+            fingerprint = tuple(await db.fetchone(gallery.FINGERPRINT_QUERY, dictionary=False))
+            if gallery.needs_reload(fingerprint):
+                catch_up = gallery.catch_up_query()
+                if catch_up is not None:
+                    rows = await db.fetchall(*catch_up)
+                    if await run_cv(gallery.apply_catch_up, rows, fingerprint):
+                        return
+                rows = await db.fetchall(gallery.LOAD_QUERY)
+                await run_cv(gallery.load_rows, rows, fingerprint)
+
+def db_failed():
+    return respond({
+        'success': False,
+        'error': 'Database connection failed'
+    }, 500)
+
+@admitted('register')
+async def register_face(request):
+    """Register user's face - ONE FACE PER USER ONLY"""
+    try:
+        data, image_bytes = await read_face_request(request)
+        user_id = data.get('user_id')
+
+        if not user_id or image_bytes == b'':
+            return respond({
+                'success': False,
+                'error': 'Missing user_id or image'
+            }, 400)
+
+        parsed_id = api.parse_user_id(user_id)
+        if parsed_id is None:
+            return respond({
+                'success': False,
+                'error': f'User ID {user_id} not found'
+            }, 404)
+        user_id = parsed_id
+
+        face_data = await run_cv(api.process_face_image, image_bytes, check_quality=True)
+        if face_data['status'] == 'invalid_image':
+            return respond({
+                'success': False,
+                'error': face_data.get('message', 'Invalid image format')
+            }, 400)
+
+        if face_data['status'] == 'no_face':
+            return respond({
+                'success': False,
+                'error': 'Could not detect a clear face. Ensure: 1. Only one person in frame, 2. Good lighting, 3. Face clearly visible'
+            }, 400)
+
+        if face_data['status'] == 'low_quality':
+            return respond({
+                'success': False,
+                'error': face_data['message']
+            }, 400)
+
+        if face_data['status'] != 'ok':
+            return respond({
+                'success': False,
+                'error': 'Failed to extract face features'
+            }, 400)
+
+        try:
+            with stage_seconds.time(stage='db_query'):
+                user = await db.fetchone(api.REGISTER_USER_QUERY, (user_id,))
+        except DatabaseUnavailable:
+            return db_failed()
+
+        if user is None:
+            return respond({
+                'success': False,
+                'error': f'User ID {user_id} not found'
+            }, 404)
+
+        if user['face_registered']:
+            return respond({
+                'success': False,
+                'error': 'User already has a face registered. Remove existing registration first.'
+            }, 400)
+
+        try:
+            await sync_gallery()
+            duplicate = await run_cv(api.find_duplicate_face, user_id, face_data)
+            if duplicate is None:
+                with stage_seconds.time(stage='db_query'):
+                    owner = await db.fetchone(api.HASH_OWNER_QUERY, (face_data['hash'], user_id))
+                if owner is not None:
+                    duplicate = (owner['id'], 'exact', 1.0)
+        except DatabaseUnavailable:
+            return db_failed()
+        if duplicate is not None:
+            return respond(api.duplicate_face_body(user_id, duplicate), 409)
+
+        try:
+            with stage_seconds.time(stage='db_write'):
+                affected = await db.execute(api.REGISTER_FACE_QUERY, api.registration_params(user_id, face_data))
+        except Exception as e:
+            if not api.face_hash_conflict(e):
+                raise
+            # Another account stored this face after the check above
+            owner = await db.fetchone(api.HASH_OWNER_QUERY, (face_data['hash'], user_id))
+            duplicate = (owner['id'] if owner else None, 'exact', 1.0)
+            return respond(api.duplicate_face_body(user_id, duplicate), 409)
+
+        if affected > 0:
+            return respond(api.registration_succeeded(user_id, user, face_data))
+        return respond({
+            'success': False,
+            'error': 'Failed to update database'
+        }, 500)
+
+    except PipelineBusy:
+        return flask_response(api.pipeline_busy_response)
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        log.exception("[REGISTER ERROR] %s", e)
+        return respond({
+            'success': False,
+            'error': f'Registration failed: {str(e)}'
+        }, 500)
+
+@admitted('verify')
+async def verify_face(request):
+    """Verify face for a specific user - STRICT MATCHING"""
+    try:
+        data, image_bytes = await read_face_request(request)
+        user_id = data.get('user_id')
+
+        if not user_id or image_bytes == b'':
+            return respond({
+                'success': False,
+                'error': 'Missing user_id or image'
+            }, 400)
+
+        user_id = api.parse_user_id(user_id)
+        if user_id is None:
+            return respond(*api.stored_face_unavailable('not_found', 'authenticated'))
+
+        input_face = await run_cv(api.process_face_image, image_bytes, reduce=api.DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
+            return respond({
+                'success': False,
+                'error': input_face.get('message', 'Invalid image format')
+            }, 400)
+
+        if input_face['status'] == 'no_face':
+            return respond({
+                'success': True,
+                'authenticated': False,
+                'message': 'No clear face detected'
+            })
+
+        if input_face['status'] != 'ok':
+            return respond({
+                'success': True,
+                'authenticated': False,
+                'message': 'Failed to process face'
+            })
+
+        stored_face, status = await load_stored_face(user_id)
+        if status == 'db_error':
+            return db_failed()
+
+        if status == 'not_found':
+            return respond({
+                'success': True,
+                'authenticated': False,
+                'message': 'User not found or no face registered'
+            })
+
+        if status == 'invalid':
+            return respond({
+                'success': True,
+                'authenticated': False,
+                'message': 'Invalid face data for user'
+            })
+
+        if status == 'outdated':
+            return respond(api.outdated_template_body('authenticated'))
+
+        result = api.verify_against(user_id, input_face, stored_face)
+
+        if result['authenticated']:
+            # Update last face login (written in the background)
+            api.login_writer.record(user_id)
+
+        return respond(result)
+
+    except PipelineBusy:
+        return flask_response(api.pipeline_busy_response)
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        log.exception("[VERIFY ERROR] %s", e)
+        return respond({
+            'success': False,
+            'error': f'Verification failed: {str(e)}'
+        }, 500)
+
+async def start_stream_session(user_id):
+    """(session, None) or (None, error response) for a new streaming verification"""
+    user_id = api.parse_user_id(user_id)
+    stored_face, status = await load_stored_face(user_id) if user_id is not None else (None, 'not_found')
+    if status != 'ok':
+        body, code = api.stored_face_unavailable(status, 'authenticated')
+        return None, respond(body, code)
+    session = api.stream_sessions.start(user_id, stored_face)
+    if session is None:
+        return None, flask_response(api.stream_sessions_full_response)
+    return session, None
+
+async def push_stream_frame(session, image_bytes):
+    """Run one frame through the session; None once it was already decided"""
+    body = await run_cv(session.push, image_bytes)
+    if body is not None and session.decided:
+        api.stream_sessions.finish(session)
+        if session.authenticated:
+            api.login_writer.record(session.user_id)
+    return body
+
+@admitted('verify')
+async def start_verify_stream(request):
+    """Open a streaming verification session for one user"""
+    try:
+        try:
+            data = json.loads(await read_body(request) or b'{}') or {}
+        except ValueError:
+            data = {}
+        if not isinstance(data, dict) or not data.get('user_id'):
+            data = request.query_params
+        user_id = data.get('user_id')
+        if not user_id:
+            return respond({
+                'success': False,
+                'error': 'Missing user_id'
+            }, 400)
+
+        session, error = await start_stream_session(user_id)
+        if error is not None:
+            return error
+        return respond(api.stream_session_started(session))
+
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        log.exception("[STREAM ERROR] %s", e)
+        return respond({
+            'success': False,
+            'error': f'Verification failed: {str(e)}'
+        }, 500)
+
+@admitted('verify')
+async def verify_stream_frame(request):
+    """Add one frame to a streaming verification session"""
+    try:
+        session = api.stream_sessions.get(request.path_params['session_id'])
+        if session is None:
+            return flask_response(api.unknown_session_response)
+
+        _, image_bytes = await read_face_request(request)
+        if image_bytes == b'':
+            return respond({
+                'success': False,
+                'error': 'No image provided'
+            }, 400)
+
+        body = await push_stream_frame(session, image_bytes)
+        if body is None:
+            return flask_response(api.unknown_session_response)
+        return respond(body)
+
+    except PipelineBusy:
+        return flask_response(api.pipeline_busy_response)
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        log.exception("[STREAM ERROR] %s", e)
+        return respond({
+            'success': False,
+            'error': f'Verification failed: {str(e)}'
+        }, 500)
+
+async def verify_stream_socket(websocket):
+    """Streaming verification over one WebSocket
+
+    The first message is JSON ({"user_id": ...}) and is answered with the
+    session body; every following binary message is one encoded frame and
+    gets that frame's JSON body back. The socket is closed once the
+    session is decided, or with an error body when it cannot start.
+    """
+    await websocket.accept()
+    session = None
+    try:
+        try:
+            data = json.loads(await websocket.receive_text()) or {}
+        except ValueError:
+            data = {}
+        user_id = data.get('user_id') if isinstance(data, dict) else None
+        if not user_id:
+            await websocket.send_json({'success': False, 'error': 'Missing user_id'})
+            await websocket.close(code=1008)
+            return
+
+        session, error = await start_stream_session(user_id)
+        if error is not None:
+            await websocket.send_text(error.body.decode())
+            await websocket.close(code=1013 if error.status_code == 503 else 1000)
+            return
+        await websocket.send_json(api.stream_session_started(session))
+
+        while True:
+            image_bytes = await websocket.receive_bytes()
+            if len(image_bytes) > api.MAX_PAYLOAD_BYTES:
+                await websocket.send_text(flask_response(api.payload_too_large_response).body.decode())
+                await websocket.close(code=1009)
+                break
+            try:
+                async with admission('verify'):
+                    body = await push_stream_frame(session, image_bytes)
+            except api.Overloaded as e:
+                # The frame is dropped; the client keeps streaming
+                response = flask_response(functools.partial(api.overloaded_response, e.retry_after))
+                await websocket.send_text(response.body.decode())
+                continue
+            except PipelineBusy:
+                await websocket.send_text(flask_response(api.pipeline_busy_response).body.decode())
+                continue
+            await websocket.send_json(body or api.UNKNOWN_SESSION_BODY)
+            if body is None or session.decided:
+                await websocket.close()
+                break
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        log.exception("[STREAM ERROR] %s", e)
+        await websocket.close(code=1011)
+    finally:
+        # A client that hangs up mid-stream does not keep its slot until the TTL
+        if session is not None and not session.decided:
+            api.stream_sessions.finish(session)
+
+async def check_face_registered(request):
+    """Check if user has registered face"""
+    try:
+        try:
+            user = await db.fetchone(api.CHECK_FACE_QUERY, (request.path_params['user_id'],))
+        except DatabaseUnavailable:
+            return db_failed()
+
+        if user:
+            return respond(api.registration_status(user))
+        return respond({
+            'success': False,
+            'error': 'User not found'
+        }, 404)
+
+    except Exception as e:
+        return respond({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+async def remove_face(request):
+    """Remove user's face registration"""
+    user_id = request.path_params['user_id']
+    try:
+        try:
+            affected = await db.execute(api.REMOVE_FACE_QUERY, (user_id,))
+        except DatabaseUnavailable:
+            return db_failed()
+
+        if affected > 0:
+            api.face_gallery.remove(user_id)
+            api.template_cache.evict(user_id)
+            return respond({
+                'success': True,
+                'message': 'Face registration removed'
+            })
+        return respond({
+            'success': False,
+            'error': 'User not found or no face registered'
+        }, 404)
+
+    except Exception as e:
+        return respond({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+@admitted('test')
+async def test_face_against_user(request):
+    """Test if a face matches a specific user (for debugging)"""
+    user_id = request.path_params['user_id']
+    try:
+        data, image_bytes = await read_face_request(request)
+
+        if image_bytes == b'':
+            return respond({
+                'success': False,
+                'error': 'No image provided'
+            }, 400)
+
+        input_face = await run_cv(api.process_face_image, image_bytes, reduce=api.DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
+            return respond({
+                'success': False,
+                'error': input_face.get('message', 'Invalid image format')
+            }, 400)
+
+        if input_face['status'] == 'no_face':
+            return respond({
+                'success': True,
+                'match': False,
+                'reason': 'No face detected'
+            })
+
+        if input_face['status'] != 'ok':
+            return respond({
+                'success': True,
+                'match': False,
+                'reason': 'Failed to extract features'
+            })
+
+        stored_face, status = await load_stored_face(user_id)
+        if status == 'db_error':
+            return db_failed()
+
+        if status == 'not_found':
+            return respond({
+                'success': True,
+                'match': False,
+                'reason': 'User has no registered face'
+            })
+
+        if status == 'invalid':
+            return respond({
+                'success': False,
+                'error': 'Invalid face data for user'
+            }, 500)
+
+        if status == 'outdated':
+            return respond(api.outdated_template_body('match'))
+
+        return respond(api.test_against(user_id, input_face, stored_face))
+
+    except PipelineBusy:
+        return flask_response(api.pipeline_busy_response)
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        return respond({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+@admitted('identify')
+async def identify_face(request):
+    """Find which enrolled user a face belongs to (1:N search in one request)"""
+    try:
+        data, image_bytes = await read_face_request(request)
+
+        if image_bytes == b'':
+            return respond({
+                'success': False,
+                'error': 'No image provided'
+            }, 400)
+
+        top_k = api.identify_top_k(data)
+
+        input_face = await run_cv(api.process_face_image, image_bytes, reduce=api.DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
+            return respond({
+                'success': False,
+                'error': input_face.get('message', 'Invalid image format')
+            }, 400)
+
+        if input_face['status'] == 'no_face':
+            return respond({
+                'success': True,
+                'match': False,
+                'reason': 'No face detected'
+            })
+
+        if input_face['status'] != 'ok':
+            return respond({
+                'success': True,
+                'match': False,
+                'reason': 'Failed to extract features'
+            })
+
+        # Make sure the in-memory gallery reflects the database
+        try:
+            await sync_gallery()
+        except DatabaseUnavailable:
+            return db_failed()
+
+        return respond(await run_cv(api.identify_in_gallery, input_face, top_k))
+
+    except PipelineBusy:
+        return flask_response(api.pipeline_busy_response)
+    except PayloadTooLarge:
+        return flask_response(api.payload_too_large_response)
+    except Exception as e:
+        log.exception("[IDENTIFY ERROR] %s", e)
+        return respond({
+            'success': False,
+            'error': str(e)
+        }, 500)
+
+async def probe_health():
+    """Async counterpart of HealthMonitor.probe, through the aiomysql pool"""
+    start = asyncio.get_running_loop().time()
+    db_connected, db_version, error = False, 'unknown', None
+    try:
+        db_version = (await db.fetchone(api.DB_VERSION_QUERY, dictionary=False))[0]
+        db_connected = True
+    except DatabaseUnavailable:
+        error = 'Database connection failed'
+    except Exception as e:
+        error = str(e)
+    return api.health_monitor.update(db_connected, db_version, db.status(), error,
+                                     asyncio.get_running_loop().time() - start)
+
+async def refresh_gallery():
+    """api.GallerySyncer for the async server: sync the gallery off the request path"""
+    if api.face_gallery.shared_name is not None:
+        return
+    api.face_gallery.background_sync = True
+    while True:
+        try:
+            await sync_gallery(background=True)
+        except Exception as e:
+            log.warning("[GALLERY] Background sync failed: %s", e)
+        await asyncio.sleep(api.gallery_syncer.interval)
+
+async def refresh_health():
+    """Keep the health snapshot fresh for as long as the app runs"""
+    while True:
+        await asyncio.sleep(api.health_monitor.interval)
+        try:
+            await probe_health()
+        except Exception as e:
+            log.warning("[HEALTH] Refresh failed: %s", e)
+
+async def health_snapshot():
+    return api.health_monitor.latest() or await probe_health()
+
+async def health_check(request):
+    """Health check endpoint (served from the HealthMonitor snapshot)"""
+    try:
+        return respond(api.health_status(await health_snapshot()))
+
+    except Exception as e:
+        return respond({
+            'status': 'unhealthy',
+            'error': str(e)
+        }, 503)
+
+async def health_live(request):
+    """Liveness: the process is up and serving requests"""
+    return respond(api.liveness_status())
+
+async def health_ready(request):
+    """Readiness: database reachable, detector loaded, snapshot fresh"""
+    body, status = api.readiness_status(await health_snapshot())
+    return respond(body, status)
+
+async def metrics_endpoint(request):
+    """Prometheus scrape endpoint"""
+    return Response(api.render_metrics(), headers={'Content-Type': face_metrics.CONTENT_TYPE})
+
+async def index(request):
+    return HTMLResponse(api.index())
+
+class RequestMetricsMiddleware:
+    """ASGI counterpart of the Flask before/after_request metric hooks"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = asyncio.get_running_loop().time()
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = getattr(scope.get('endpoint'), '__name__', 'unmatched')
+            api.request_seconds.observe(asyncio.get_running_loop().time() - start, endpoint=endpoint)
+            api.requests_total.inc(endpoint=endpoint, status=status['code'])
+
+async def check_template_column():
+    """api.check_template_column over the route pool"""
+    query, params = api.template_column_query()
+    try:
+        row = await db.fetchone(query, params, dictionary=False)
+    except Exception as e:
+        log.warning("[DB] Could not check for users.face_template: %s", e)
+        return
+    api.use_template_column(row[0] > 0)
+
+@asynccontextmanager
+async def lifespan(app):
+    await db.start()
+    await check_template_column()
+    await asyncio.to_thread(api.start_cv_workers)
+    await asyncio.to_thread(api.load_gallery_snapshot)
+    await asyncio.to_thread(api.start_shared_gallery)
+    await probe_health()
+    health_task = asyncio.create_task(refresh_health())
+    gallery_task = asyncio.create_task(refresh_gallery())
+    log.info(f"[ASYNC] Serving with {ASYNC_CV_THREADS} CV threads and a {type(db).__name__}")
+    try:
+        yield
+    finally:
+        health_task.cancel()
+        gallery_task.cancel()
+        # Flush pending last_face_login updates before the pools go away
+        await asyncio.to_thread(api.login_writer.stop)
+        await db.close()
+        cv_executor.shutdown(wait=False, cancel_futures=True)
+
+routes = [
+    Route('/api/face/register', register_face, methods=['POST']),
+    Route('/api/face/verify', verify_face, methods=['POST']),
+    Route('/api/face/verify/stream', start_verify_stream, methods=['POST']),
+    Route('/api/face/verify/stream/{session_id}', verify_stream_frame, methods=['POST']),
+    WebSocketRoute('/api/face/verify/ws', verify_stream_socket),
+    Route('/api/face/check/{user_id:int}', check_face_registered, methods=['GET']),
+    Route('/api/face/remove/{user_id:int}', remove_face, methods=['DELETE']),
+    Route('/api/face/test/{user_id:int}', test_face_against_user, methods=['POST']),
+    Route('/api/face/identify', identify_face, methods=['POST']),
+    Route('/api/health', health_check, methods=['GET']),
+    Route('/api/health/live', health_live, methods=['GET']),
+    Route('/api/health/ready', health_ready, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/', index, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestMetricsMiddleware),
+        Middleware(CORSMiddleware, allow_origins=["http://localhost", "http://127.0.0.1"],
+                   allow_credentials=True, allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='127.0.0.1', port=5001)
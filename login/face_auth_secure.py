@@ -1,17 +1,38 @@
-
 import json
 import base64
 import numpy as np
 import cv2
 import mysql.connector
 from mysql.connector import Error
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
 import os
 import hashlib
-from datetime import datetime
-import traceback
+import atexit
+import functools
+import heapq
+import math
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import secrets
+import signal
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import face_metrics
+from face_index import IVFIndex
+import face_shm_gallery
+import face_snapshot
 warnings.filterwarnings('ignore')
 
 print("=" * 70)
@@ -28,121 +49,696 @@ DB_CONFIG = {
     'password': ''
 }
 
+# Optional sqlite stand-in for the users table (see face_standin_db.py)
+DB_STANDIN_PATH = os.environ.get('FACE_DB_STANDIN')
+
+# Connection pool settings
+DB_POOL_SIZE = int(os.environ.get('FACE_DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('FACE_DB_POOL_TIMEOUT', 5))
+DB_POOL_PING_AFTER = float(os.environ.get('FACE_DB_POOL_PING_AFTER', 30))
+
+# Largest accepted request body (JSON, multipart or raw image); larger uploads get a 413
+MAX_PAYLOAD_BYTES = int(os.environ.get('FACE_MAX_PAYLOAD_BYTES', 8 * 1024 * 1024))
+
+# Decode verify/test/identify uploads as grayscale at 1/2, 1/4 or 1/8 size (0 = full colour).
+# JPEGs are then decoded at the reduced size directly; registration always decodes full size.
+# This trades accuracy for speed: templates are enrolled from full-size faces, and a probe face
+# upscaled from fewer pixels matches its own template less closely. On 640x480 synthetic probes
+# the mean genuine similarity drops from 0.95 to 0.93 (1/2), 0.90 (1/4) and 0.85 (1/8), while
+# impostors average 0.81-0.87, so from 1/4 on genuine and impostor scores overlap around
+# VERIFY_THRESHOLD. Decoding the reduced image in colour does not win this back; the loss comes
+# from the resolution. On 1920x1080 probes 1/2 costs 0.01 and 1/4 costs 0.03, so it suits
+# high-resolution uploads; check VERIFY_THRESHOLD against real captures before enabling it.
+DECODE_REDUCED = int(os.environ.get('FACE_DECODE_REDUCED', 0))
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+if DECODE_REDUCED and DECODE_REDUCED not in REDUCED_DECODE_FLAGS:
+    print("⚠️ FACE_DECODE_REDUCED must be 2, 4 or 8; decoding at full size")
+    DECODE_REDUCED = 0
+elif DECODE_REDUCED:
+    print(f"⚠️ FACE_DECODE_REDUCED={DECODE_REDUCED}: probes are matched at 1/{DECODE_REDUCED} size, "
+          "which lowers genuine similarity scores")
+
+# Request-path log level (DEBUG shows every pipeline step)
+LOG_LEVEL = os.environ.get('FACE_LOG_LEVEL', 'INFO').upper()
+
+log = logging.getLogger('face_api')
+
+def start_log_queue(level=LOG_LEVEL):
+    """Send face_api log records through a queue drained by a background thread
+
+    Request threads only enqueue the record; writing to stdout happens on
+    the listener thread, so a slow terminal or pipe never stalls a login.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(level)
+    log.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+log_listener = start_log_queue()
+
+# Prometheus metrics served on /metrics
+metrics = face_metrics.MetricsRegistry()
+request_seconds = metrics.histogram('face_request_seconds', 'Request latency by endpoint', ('endpoint',))
+requests_total = metrics.counter('face_requests_total', 'Requests by endpoint and HTTP status', ('endpoint', 'status'))
+stage_seconds = metrics.histogram('face_stage_seconds', 'Latency of each face pipeline stage', ('stage',))
+pipeline_results = metrics.counter('face_pipeline_results_total', 'Face pipeline outcomes', ('status',))
+decisions_total = metrics.counter('face_decisions_total', 'Match decisions by endpoint', ('endpoint', 'decision'))
+similarity_scores = metrics.histogram('face_similarity', 'Similarity of the probe to the compared face',
+                                      ('endpoint',), face_metrics.SIMILARITY_BUCKETS)
+component_state = metrics.gauge('face_component_state', 'Pool, cache and gallery state at scrape time',
+                                ('component', 'field'))
+admission_wait = metrics.histogram('face_admission_wait_seconds', 'Time admitted requests spent queued',
+                                   ('priority',))
+admission_rejected = metrics.counter('face_admission_rejected_total', 'Requests turned away with a 429',
+                                     ('priority', 'reason'))
+
 # Initialize Flask app
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_PAYLOAD_BYTES
 CORS(app, supports_credentials=True, origins=["http://localhost", "http://127.0.0.1"])
 
-# Haar cascade path
-CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-if not os.path.exists(CASCADE_PATH):
-    print("⚠️ Haar cascade not found at default location")
-    CASCADE_PATH = None
+# Face detector backends: frontal-face cascades with their detectMultiScale parameters.
+# min_size is the smallest window searched in the (downscaled) detection frame, 0 = the
+# cascade's own window. Compare them with `python -m face_bench.detectors --images ...`
+DETECTOR_BACKENDS = {
+    'haar_default': {'cascade': 'haarcascade_frontalface_default.xml',
+                     'scale_factor': 1.1, 'min_neighbors': 5, 'min_size': 0},
+    'haar_alt': {'cascade': 'haarcascade_frontalface_alt.xml',
+                 'scale_factor': 1.1, 'min_neighbors': 4, 'min_size': 0},
+    'haar_alt2': {'cascade': 'haarcascade_frontalface_alt2.xml',
+                  'scale_factor': 1.1, 'min_neighbors': 4, 'min_size': 0},
+    'haar_alt_tree': {'cascade': 'haarcascade_frontalface_alt_tree.xml',
+                      'scale_factor': 1.1, 'min_neighbors': 2, 'min_size': 0},
+    # LBP cascades come with OpenCV source/system packages, not with the pip wheels
+    'lbp_improved': {'cascade': 'lbpcascade_frontalface_improved.xml',
+                     'scale_factor': 1.1, 'min_neighbors': 4, 'min_size': 0},
+    'lbp_frontal': {'cascade': 'lbpcascade_frontalface.xml',
+                    'scale_factor': 1.1, 'min_neighbors': 4, 'min_size': 0},
+}
+DETECTOR_BACKEND = os.environ.get('FACE_DETECTOR', 'haar_default')
+# Where cascade files are looked up, in order (FACE_DETECTOR_CASCADE_DIRS is os.pathsep-separated)
+CASCADE_DIRS = [d for d in os.environ.get('FACE_DETECTOR_CASCADE_DIRS', '').split(os.pathsep) if d] + [
+    cv2.data.haarcascades,
+    '/usr/share/opencv4/lbpcascades',
+    '/usr/share/opencv/lbpcascades',
+]
+
+def detector_backend(name, **overrides):
+    """Settings of a DETECTOR_BACKENDS entry with its cascade resolved to a path (None if missing)
+
+    FACE_DETECTOR_SCALE_FACTOR, FACE_DETECTOR_MIN_NEIGHBORS and FACE_DETECTOR_MIN_SIZE
+    override the configured backend's parameters; `overrides` win over both.
+    """
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown face detector {name!r} (choose from {', '.join(DETECTOR_BACKENDS)})")
+    backend = dict(DETECTOR_BACKENDS[name], name=name)
+    if name == DETECTOR_BACKEND:
+        for key, env, cast in (('scale_factor', 'FACE_DETECTOR_SCALE_FACTOR', float),
+                               ('min_neighbors', 'FACE_DETECTOR_MIN_NEIGHBORS', int),
+                               ('min_size', 'FACE_DETECTOR_MIN_SIZE', int)):
+            if os.environ.get(env):
+                backend[key] = cast(os.environ[env])
+    backend.update(overrides)
+    candidates = [backend['cascade']] if os.path.isabs(backend['cascade']) else \
+        [os.path.join(directory, backend['cascade']) for directory in CASCADE_DIRS]
+    backend['path'] = next((path for path in candidates if os.path.exists(path)), None)
+    return backend
+
+# Optional worker processes for decode -> detect -> extract (0 = run on request threads)
+CV_WORKERS = int(os.environ.get('FACE_CV_WORKERS', 0))
+CV_SLOTS_PER_WORKER = int(os.environ.get('FACE_CV_SLOTS_PER_WORKER', 2))
+CV_SLOT_BYTES = int(os.environ.get('FACE_CV_SLOT_BYTES', 4 * 1024 * 1024))
+CV_QUEUE_TIMEOUT = float(os.environ.get('FACE_CV_QUEUE_TIMEOUT', 2))
+
+# Number of preloaded cascades; detection blocks for a free one when all are busy
+DETECTOR_POOL_SIZE = int(os.environ.get('FACE_DETECTOR_POOL_SIZE', min(8, os.cpu_count() or 4)))
+DETECTOR_ACQUIRE_TIMEOUT = float(os.environ.get('FACE_DETECTOR_ACQUIRE_TIMEOUT', 10))
+
+# Admission control for the face-processing endpoints (0 = admit everything at once):
+# at most ADMISSION_LIMIT run concurrently, the rest queue by priority for at most
+# ADMISSION_DEADLINE seconds; requests that would wait longer get a 429 right away
+ADMISSION_LIMIT = int(os.environ.get('FACE_ADMISSION_LIMIT', DETECTOR_POOL_SIZE))
+ADMISSION_DEADLINE = float(os.environ.get('FACE_ADMISSION_DEADLINE', 2))
+ADMISSION_MAX_QUEUE = int(os.environ.get('FACE_ADMISSION_MAX_QUEUE', 64))
+# Lower runs first: logins before enrolment, the debug test route last
+ADMISSION_PRIORITIES = {'verify': 0, 'identify': 0, 'register': 1, 'test': 2}
+
+# Detection works on a copy whose longer side is at most this many pixels (0 = full resolution)
+DETECT_MAX_DIM = int(os.environ.get('FACE_DETECT_MAX_DIM', 640))
+# Smallest face worth finding, in full-resolution pixels (validate_face_quality rejects smaller)
+DETECT_MIN_FACE = 100
+
+# Feature layout produced by extract_face_signature: 8x8 grid x (mean, std, median) + 7 geometry values
+GRID_SIZE = 8
+GEOMETRY_FEATURES = 7
+FEATURE_DIM = GRID_SIZE * GRID_SIZE * 3 + GEOMETRY_FEATURES
+
+# 1:N identification settings. Distinct faces score 0.87-0.96 against each other, so the
+# threshold alone cannot tell the owner from a look-alike: the best match must also beat the
+# runner-up by IDENTIFY_MARGIN. On 120 enrolled synthetic faces these defaults returned no
+# wrong account and accepted no unenrolled face (exact hash matches skip both checks)
+IDENTIFY_THRESHOLD = float(os.environ.get('FACE_IDENTIFY_THRESHOLD', 0.94))
+IDENTIFY_MARGIN = float(os.environ.get('FACE_IDENTIFY_MARGIN', 0.03))
+IDENTIFY_TOP_K = 5
+IDENTIFY_MAX_TOP_K = 50
+# Registration always refuses a face whose hash is enrolled on another account. Set this to
+# also refuse faces at least this similar to one; off (0) by default, since distinct synthetic
+# faces already score 0.87-0.90 and any uncalibrated cut-off locks out real users
+DUPLICATE_THRESHOLD = float(os.environ.get('FACE_DUPLICATE_THRESHOLD', 0))
+# The gallery fingerprint includes MAX(users.updated_at), which every last_face_login write
+# moves; GallerySyncer re-syncs every GALLERY_SYNC_INTERVAL seconds off the request threads
+GALLERY_SYNC_INTERVAL = float(os.environ.get('FACE_GALLERY_SYNC_INTERVAL', 30))
+# Share one gallery between server processes under this shared-memory name ('' = per process);
+# see face_shm_gallery.py. The owner process checks for changes every GALLERY_SHM_POLL seconds
+GALLERY_SHM_NAME = os.environ.get('FACE_GALLERY_SHM', '')
+GALLERY_SHM_POLL = float(os.environ.get('FACE_GALLERY_SHM_POLL', 0.25))
+# Map the gallery from snapshots exported to this directory at boot and catch up on the rows
+# changed since ('' = always load from the database); see face_snapshot.py
+GALLERY_SNAPSHOT_DIR = os.environ.get('FACE_GALLERY_SNAPSHOT', '')
+GALLERY_SNAPSHOT_MAX_AGE = float(os.environ.get('FACE_GALLERY_SNAPSHOT_MAX_AGE', 3600))
+# Gallery catch-up and template cache revalidation re-read rows this many seconds
+# before their watermark (updated_at is set before commit)
+GALLERY_CATCH_UP_MARGIN = 5
+
+# Approximate (IVF) identification search, see face_index.py. Galleries smaller than
+# ANN_MIN_GALLERY are searched exhaustively; ANN_NPROBE trades recall for latency
+ANN_MIN_GALLERY = int(os.environ.get('FACE_ANN_MIN_GALLERY', 10000))
+ANN_NLIST = int(os.environ.get('FACE_ANN_NLIST', 0))  # 0 = about 2 * sqrt(gallery size)
+ANN_NPROBE = int(os.environ.get('FACE_ANN_NPROBE', 16))
+# Retrain the clusters once the gallery has grown by this factor since training
+ANN_RETRAIN_GROWTH = float(os.environ.get('FACE_ANN_RETRAIN_GROWTH', 2.0))
+
+# Per-user template cache used by verify/test
+TEMPLATE_CACHE_SIZE = int(os.environ.get('FACE_TEMPLATE_CACHE_SIZE', 10000))
+TEMPLATE_CACHE_REVALIDATE = float(os.environ.get('FACE_TEMPLATE_CACHE_REVALIDATE', 5))
+
+# Pipeline results for recently seen upload bytes (0 entries disables); see ProbeCache
+PROBE_CACHE_SIZE = int(os.environ.get('FACE_PROBE_CACHE_SIZE', 256))
+PROBE_CACHE_TTL = float(os.environ.get('FACE_PROBE_CACHE_TTL', 10))
+
+# Feature-similarity threshold for 1:1 verification (an exact hash match always passes)
+VERIFY_THRESHOLD = 0.60
+
+# last_face_login updates are written behind: see LoginWriter
+LOGIN_WRITE_BATCH = int(os.environ.get('FACE_LOGIN_WRITE_BATCH', 500))
+LOGIN_WRITE_INTERVAL = float(os.environ.get('FACE_LOGIN_WRITE_INTERVAL', 1.0))
+
+# Health endpoints serve a snapshot refreshed this often (seconds); see HealthMonitor
+HEALTH_REFRESH_INTERVAL = float(os.environ.get('FACE_HEALTH_REFRESH_INTERVAL', 10))
+
+# Streaming (multi-frame) verification sessions, see VerifySession
+STREAM_MAX_FRAMES = int(os.environ.get('FACE_STREAM_MAX_FRAMES', 10))
+# Full Haar detection on every Nth frame; the frames in between track the last face
+STREAM_KEYFRAME_INTERVAL = int(os.environ.get('FACE_STREAM_KEYFRAME_INTERVAL', 5))
+# The session's confidence is the mean of its best N frame similarities
+STREAM_FUSE_FRAMES = int(os.environ.get('FACE_STREAM_FUSE_FRAMES', 3))
+STREAM_SESSION_TTL = float(os.environ.get('FACE_STREAM_SESSION_TTL', 30))
+STREAM_MAX_SESSIONS = int(os.environ.get('FACE_STREAM_MAX_SESSIONS', 1000))
+# Tracking matches the previous face, shrunk to this many pixels, near its last position
+TRACK_PATCH_SIZE = 48
+TRACK_MIN_SCORE = 0.6
 
 def get_db_connection():
     """Create database connection"""
+    if DB_STANDIN_PATH:
+        import face_standin_db
+        try:
+            return face_standin_db.connect(DB_STANDIN_PATH)
+        except face_standin_db.Error as e:
+            log.error(f"[DB ERROR] {e}")
+            return None
     try:
         connection = mysql.connector.connect(**DB_CONFIG)
         return connection
     except Error as e:
-        print(f"[DB ERROR] {e}")
+        log.error(f"[DB ERROR] {e}")
         return None
 
-def base64_to_image(base64_string):
-    """Convert base64 string to OpenCV image"""
+class DBConnectionPool:
+    """Bounded pool of reusable database connections
+
+    At most `size` connections are checked out at once; callers wait up to
+    `timeout` seconds for one to come back. Idle connections that have not
+    been used for `ping_after` seconds are pinged before being handed out.
+    """
+
+    def __init__(self, connect, size, timeout, ping_after):
+        self._connect = connect
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.stats = {
+            'checkouts': 0,
+            'created': 0,
+            'reused': 0,
+            'timeouts': 0,
+            'connect_failures': 0,
+            'discarded': 0,
+            'in_use': 0,
+            'peak_in_use': 0,
+            'wait_ms_total': 0.0
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _healthy(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a connection, or None if the pool is exhausted or the DB is down"""
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('timeouts')
+            log.warning(f"[DB POOL] Timed out after {self.timeout}s waiting for a connection")
+            return None
+
+        connection = None
+        while connection is None:
+            try:
+                candidate, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if time.monotonic() - last_used < self.ping_after or self._healthy(candidate):
+                connection = candidate
+                self._count('reused')
+            else:
+                self._close_quietly(candidate)
+                self._count('discarded')
+
+        if connection is None:
+            connection = self._connect()
+            if connection is None:
+                self._count('connect_failures')
+                self._slots.release()
+                return None
+            self._count('created')
+
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['in_use'] += 1
+            self.stats['peak_in_use'] = max(self.stats['peak_in_use'], self.stats['in_use'])
+            self.stats['wait_ms_total'] += (time.perf_counter() - start) * 1000
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool (or close it if it is broken)"""
+        if not discard:
+            try:
+                # End any open transaction so the next borrower sees fresh data
+                connection.rollback()
+            except Exception:
+                discard = True
+
+        if discard:
+            self._close_quietly(connection)
+            self._count('discarded')
+        else:
+            self._idle.put((connection, time.monotonic()))
+
+        self._count('in_use', -1)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for a with-block; yields None if none is available"""
+        connection = self.acquire()
+        failed = False
+        try:
+            yield connection
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if connection is not None:
+                self.release(connection, discard=failed)
+
+    def close_all(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(connection)
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['size'] = self.size
+        stats['idle'] = self._idle.qsize()
+        stats['wait_ms_total'] = round(stats['wait_ms_total'], 1)
+        return stats
+
+db_pool = DBConnectionPool(get_db_connection, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+
+def decode_image_payload(base64_string):
+    """Strip an optional data URL prefix and decode the base64 image bytes"""
     try:
         if 'base64,' in base64_string:
             base64_string = base64_string.split('base64,')[1]
         
-        img_data = base64.b64decode(base64_string)
+        return base64.b64decode(base64_string)
+    except Exception as e:
+        log.error(f"[IMAGE ERROR] {e}")
+        return None
+
+def bytes_to_image(img_data, reduce=1):
+    """Decode encoded image bytes (JPEG/PNG) to an OpenCV image
+
+    With reduce set to 2, 4 or 8 the image is decoded as grayscale at that
+    fraction of its size instead of full-size BGR.
+    """
+    try:
         nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        return img
+        return cv2.imdecode(nparr, REDUCED_DECODE_FLAGS.get(reduce, cv2.IMREAD_COLOR))
     except Exception as e:
-        print(f"[IMAGE ERROR] {e}")
+        log.error(f"[IMAGE ERROR] {e}")
+        return None
+
+def base64_to_image(base64_string):
+    """Convert base64 string to OpenCV image"""
+    img_data = decode_image_payload(base64_string)
+    if img_data is None:
         return None
+    return bytes_to_image(img_data)
 
-def detect_face(img):
-    """Detect a single face in image"""
+# Request bodies that are the encoded image itself rather than JSON
+RAW_IMAGE_TYPES = ('application/octet-stream', 'image/jpeg', 'image/png')
+
+def read_face_request():
+    """Return (fields, image_bytes) for a face upload in any supported encoding
+
+    - application/json: {"image": "<base64 data URL>", ...other fields}
+    - multipart/form-data: an "image" file part plus form fields
+    - application/octet-stream, image/jpeg, image/png: the encoded image as
+      the body, other fields in the query string
+
+    image_bytes is b'' when no image was sent and None when it is not valid
+    base64. Raises PayloadTooLarge for bodies over MAX_PAYLOAD_BYTES.
+    """
     try:
-        if CASCADE_PATH is None:
-            return None
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        cascade = cv2.CascadeClassifier(CASCADE_PATH)
-        
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('image')
+            return request.form, upload.read() if upload else b''
+
+        if request.mimetype in RAW_IMAGE_TYPES:
+            # Read straight from the stream; Flask keeps no second copy of the body
+            return request.args, request.get_data(cache=False)
+
+        data = request.get_json(silent=True) or {}
+        image_base64 = data.get('image')
+        if not image_base64:
+            return data, b''
+        with stage_seconds.time(stage='payload_decode'):
+            return data, decode_image_payload(image_base64)
+    except RequestEntityTooLarge:
+        raise PayloadTooLarge()
+
+class CascadePool:
+    """Cascades of one detector backend parsed once at startup and lent out to one thread at a time
+
+    cv2.CascadeClassifier is not safe to share between threads, so each
+    request thread borrows its own preloaded instance instead of re-reading
+    the XML from disk. `backend` is a detector_backend() dict; its
+    detectMultiScale parameters travel with the pool.
+    """
+
+    def __init__(self, backend, size):
+        self.backend = backend
+        self.path = backend['path']
+        self.size = max(1, size)
+        self.loaded = False
+        self.load_ms = None
+        self.error = None
+        self.window = (24, 24)
+        self._idle = queue.LifoQueue()
+
+    def _load_one(self, xml):
+        cascade = cv2.CascadeClassifier()
+        storage = cv2.FileStorage(xml, cv2.FILE_STORAGE_READ | cv2.FILE_STORAGE_MEMORY)
+        try:
+            ok = cascade.read(storage.getFirstTopLevelNode())
+        finally:
+            storage.release()
+
+        # Old-format cascades can only be loaded by file name
+        if not ok or cascade.empty():
+            cascade = cv2.CascadeClassifier(self.path)
         if cascade.empty():
+            raise RuntimeError(f"Could not load cascade {self.path}")
+
+        # Validate on a blank frame so a broken cascade fails at boot, not on a login
+        cascade.detectMultiScale(np.zeros((128, 128), dtype=np.uint8))
+        return cascade
+
+    def load(self):
+        """Parse and validate every cascade in the pool"""
+        if self.path is None:
+            self.error = f"Cascade {self.backend['cascade']} not found"
+            return False
+
+        start = time.perf_counter()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                xml = f.read()
+            for _ in range(self.size):
+                cascade = self._load_one(xml)
+                self._idle.put(cascade)
+            self.window = tuple(int(v) for v in cascade.getOriginalWindowSize())
+        except Exception as e:
+            self.error = str(e)
+            log.error(f"[DETECTOR ERROR] {e}")
+            return False
+
+        self.load_ms = round((time.perf_counter() - start) * 1000, 1)
+        self.loaded = True
+        log.info(f"[DETECTOR] Loaded {self.size} x {os.path.basename(self.path)} in {self.load_ms} ms")
+        return True
+
+    @contextmanager
+    def acquire(self, timeout=DETECTOR_ACQUIRE_TIMEOUT):
+        """Borrow a cascade; yields None if the pool is not loaded or stays busy"""
+        if not self.loaded:
+            yield None
+            return
+
+        try:
+            cascade = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            log.warning("[DETECTOR] Timed out waiting for a free cascade")
+            yield None
+            return
+
+        try:
+            yield cascade
+        finally:
+            self._idle.put(cascade)
+
+    def status(self):
+        return {
+            'loaded': self.loaded,
+            'backend': self.backend['name'],
+            'cascade': os.path.basename(self.path) if self.path else None,
+            'pool_size': self.size,
+            'idle': self._idle.qsize(),
+            'load_ms': self.load_ms,
+            'window': list(self.window),
+            'error': self.error
+        }
+
+face_detector = CascadePool(detector_backend(DETECTOR_BACKEND), DETECTOR_POOL_SIZE)
+# CV worker processes load their own single cascade in _cv_worker_init
+if multiprocessing.parent_process() is None:
+    face_detector.load()
+
+def detection_scale(img_shape, max_dim=DETECT_MAX_DIM, min_face=DETECT_MIN_FACE, detector=None):
+    """Factor by which detect_face shrinks a frame before running the cascade"""
+    detector = detector or face_detector
+    longest = max(img_shape[:2])
+    if not max_dim or longest <= max_dim:
+        return 1.0
+    # Never shrink so far that a min_face face falls below the cascade window
+    return min(1.0, max(max_dim / longest, max(detector.window) / min_face))
+
+def detect_face(img, max_dim=DETECT_MAX_DIM, min_face=DETECT_MIN_FACE, detector=None, context=None):
+    """Detect a single face in image
+
+    Large frames are searched on a copy whose longer side is at most max_dim
+    pixels; the rect is mapped back to full-resolution coordinates so
+    extraction and quality checks still see the original frame. min_face is
+    the smallest face to look for, in pixels of `img`. `detector` is a
+    CascadePool (default: the configured face_detector). With a
+    PipelineContext for `img`, its gray frame and buffers are used.
+    """
+    detector = detector or face_detector
+    params = detector.backend
+    try:
+        if context is not None:
+            gray = context.gray
+        else:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        img_h, img_w = gray.shape[:2]
+        
+        scale = detection_scale(gray.shape, max_dim, min_face, detector)
+        if scale < 1.0:
+            # Same size cv2.resize picks for fx/fy, so a context buffer is written in place
+            dst = None if context is None else context.buffer(
+                'detect', (round(img_h * scale), round(img_w * scale)))
+            gray = cv2.resize(gray, None, dst=dst, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
+        # Faces smaller than min_face fail the quality check anyway, and
+        # none can be larger than the frame
+        min_side = max(int(round(min_face * scale)), max(detector.window), params['min_size'])
+        max_side = min(gray.shape[:2])
+        
+        with detector.acquire() as cascade:
+            if cascade is None:
+                return None
+            
+            faces = cascade.detectMultiScale(
+                gray,
+                scaleFactor=params['scale_factor'],
+                minNeighbors=params['min_neighbors'],
+                minSize=(min_side, min_side),  # Larger min size for better quality
+                maxSize=(max_side, max_side),
+                flags=cv2.CASCADE_SCALE_IMAGE
+            )
+        
+        if len(faces) != 1:
             return None
-        
-        faces = cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(100, 100),  # Larger min size for better quality
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-        
-        if len(faces) == 1:
+        if scale == 1.0:
             return faces[0]  # Return first (and only) face
-        return None
+        
+        # Map the rect back to full-resolution coordinates
+        x, y, w, h = (int(round(v / scale)) for v in faces[0])
+        x, y = min(x, img_w - 1), min(y, img_h - 1)
+        return np.array([x, y, min(w, img_w - x), min(h, img_h - y)], dtype=np.int32)
         
     except Exception as e:
-        print(f"[FACE DETECT ERROR] {e}")
+        log.error(f"[FACE DETECT ERROR] {e}")
         return None
 
-def extract_face_signature(img, face_rect):
+FACE_SIZE = 128
+# Smallest face crop extract_face_signature accepts, in full-resolution pixels
+MIN_FACE_CROP = 50
+
+def normalize_face(img, face_rect, min_size=MIN_FACE_CROP, context=None):
+    """Crop, resize, grayscale, equalize and scale a face to [0, 1] float32
+
+    With a PipelineContext every step writes into its buffers; the result
+    is then the context's 'face' buffer, valid until the context is reused.
+    """
+    x, y, w, h = face_rect
+    
+    # Extract and normalize face region
+    face_region = img[y:y+h, x:x+w]
+    if face_region.size == 0 or w < min_size or h < min_size:
+        return None
+    
+    def buffer(name, shape, dtype=np.uint8):
+        return None if context is None else context.buffer(name, shape, dtype)
+    
+    # Resize to standard size. The colour crop is resized before the gray
+    # conversion: converting first rounds differently and would change the
+    # features and hashes of every enrolled face
+    face_resized = cv2.resize(face_region, (FACE_SIZE, FACE_SIZE),
+                              dst=buffer('face_resized', (FACE_SIZE, FACE_SIZE) + face_region.shape[2:]))
+    
+    # Convert to grayscale
+    if len(face_resized.shape) == 3:
+        face_gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY,
+                                 dst=buffer('face_gray', (FACE_SIZE, FACE_SIZE)))
+    else:
+        face_gray = face_resized
+    
+    # Apply histogram equalization for better contrast
+    face_eq = cv2.equalizeHist(face_gray, dst=buffer('face_eq', (FACE_SIZE, FACE_SIZE)))
+    
+    # Normalize
+    if context is None:
+        return face_eq.astype(np.float32) / 255.0
+    return np.divide(face_eq, np.float32(255.0), dtype=np.float32,
+                     out=context.buffer('face', (FACE_SIZE, FACE_SIZE), np.float32))
+
+def grid_statistics(faces):
+    """Mean, std and median of every grid cell for a stack of normalized faces
+
+    Takes (N, H, W) float32 and returns (N, GRID_SIZE * GRID_SIZE * 3) float32
+    in the same cell order (row-major, mean/std/median per cell) as the
+    original per-cell loop. Each cell is reshaped into one contiguous row so
+    NumPy reduces all cells in a single call per statistic.
+    """
+    n, height, width = faces.shape
+    cell_h = height // GRID_SIZE
+    cell_w = width // GRID_SIZE
+    cells = (faces[:, :cell_h * GRID_SIZE, :cell_w * GRID_SIZE]
+             .reshape(n, GRID_SIZE, cell_h, GRID_SIZE, cell_w)
+             .transpose(0, 1, 3, 2, 4)
+             .reshape(n, GRID_SIZE, GRID_SIZE, cell_h * cell_w))
+    stats = np.stack([
+        cells.mean(axis=-1),
+        cells.std(axis=-1),
+        np.median(cells, axis=-1)
+    ], axis=-1)
+    return stats.reshape(n, -1)
+
+def geometry_features(img_shape, face_rect):
+    """Face position and size relative to the frame (7 values)"""
+    x, y, w, h = face_rect
+    img_h, img_w = img_shape[:2]
+    return [
+        float(x / img_w),
+        float(y / img_h),
+        float((x + w/2) / img_w),  # Center X
+        float((y + h/2) / img_h),  # Center Y
+        float(w / img_w),
+        float(h / img_h),
+        float(w / h)  # Aspect ratio
+    ]
+
+def extract_face_signature(img, face_rect, min_size=MIN_FACE_CROP, context=None):
     """Extract unique face signature"""
     try:
         x, y, w, h = face_rect
         
-        # Extract and normalize face region
-        face_region = img[y:y+h, x:x+w]
-        if face_region.size == 0 or w < 50 or h < 50:
+        face_normalized = normalize_face(img, face_rect, min_size, context)
+        if face_normalized is None:
             return None
         
-        # Resize to standard size
-        face_resized = cv2.resize(face_region, (128, 128))
-        
-        # Convert to grayscale
-        if len(face_resized.shape) == 3:
-            face_gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
-        else:
-            face_gray = face_resized
-        
-        # Apply histogram equalization for better contrast
-        face_eq = cv2.equalizeHist(face_gray)
-        
-        # Normalize
-        face_normalized = face_eq.astype(np.float32) / 255.0
-        
         # Extract LBP-like features (more robust)
-        features = []
-        grid_size = 8
-        cell_h = face_normalized.shape[0] // grid_size
-        cell_w = face_normalized.shape[1] // grid_size
-        
-        for i in range(grid_size):
-            for j in range(grid_size):
-                cell = face_normalized[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w]
-                if cell.size > 0:
-                    # Extract statistical features
-                    features.append(float(cell.mean()))
-                    features.append(float(cell.std()))
-                    features.append(float(np.median(cell)))
+        features = grid_statistics(face_normalized[None]).ravel().tolist()
         
         # Add face geometry features
-        img_h, img_w = img.shape[:2]
-        features.append(float(x / img_w))
-        features.append(float(y / img_h))
-        features.append(float((x + w/2) / img_w))  # Center X
-        features.append(float((y + h/2) / img_h))  # Center Y
-        features.append(float(w / img_w))
-        features.append(float(h / img_h))
-        features.append(float(w / h))  # Aspect ratio
-        
-        # Create unique hash from normalized face
-        face_bytes = face_normalized.tobytes()
-        face_hash = hashlib.sha256(face_bytes).hexdigest()
+        features.extend(geometry_features(img.shape, face_rect))
+        
+        # Create unique hash from normalized face (hashed in place, it is contiguous)
+        face_hash = hashlib.sha256(face_normalized).hexdigest()
         
         return {
             'features': features,  # All Python floats
@@ -153,9 +749,104 @@ def extract_face_signature(img, face_rect):
         }
         
     except Exception as e:
-        print(f"[SIGNATURE ERROR] {e}")
+        log.error(f"[SIGNATURE ERROR] {e}")
         return None
 
+def extract_face_signatures(images, face_rects):
+    """Batch version of extract_face_signature
+
+    Returns (features, hashes): an (N, FEATURE_DIM) float32 array and a list
+    of N face hashes. Faces that cannot be extracted get a NaN row and a None
+    hash.
+    """
+    count = len(images)
+    features = np.full((count, FEATURE_DIM), np.nan, dtype=np.float32)
+    hashes = [None] * count
+
+    normalized, rows = [], []
+    for i, (img, face_rect) in enumerate(zip(images, face_rects)):
+        try:
+            face_normalized = normalize_face(img, face_rect)
+        except Exception as e:
+            log.error(f"[SIGNATURE ERROR] {e}")
+            continue
+        if face_normalized is None:
+            continue
+        normalized.append(face_normalized)
+        rows.append(i)
+        hashes[i] = hashlib.sha256(face_normalized.tobytes()).hexdigest()
+        features[i, -GEOMETRY_FEATURES:] = geometry_features(img.shape, face_rect)
+
+    if rows:
+        features[rows, :-GEOMETRY_FEATURES] = grid_statistics(np.stack(normalized))
+
+    return features, hashes
+
+# Binary face template stored in users.face_template:
+# magic, format version, feature schema version, feature count, raw SHA-256 face hash,
+# followed by little-endian float32 features (the 40-byte header keeps them 4-byte aligned)
+TEMPLATE_MAGIC = b'FRSM'
+TEMPLATE_FORMAT_VERSION = 1
+FEATURE_SCHEMA_VERSION = 1
+TEMPLATE_HEADER = struct.Struct('<4sBBH32s')
+TEMPLATE_DTYPE = np.dtype('<f4')
+
+# Bump FEATURE_SCHEMA_VERSION with any change to the extract_face_signature layout
+# (grid size, statistics, geometry features). Templates of another schema are never
+# compared; `python face_migrate.py schema` rewrites or re-extracts them.
+# JSON signatures from before the binary format carry no schema and use schema 1.
+LEGACY_FEATURE_SCHEMA = 1
+# {old schema: fn(features) -> features in the current layout}, for changes that can be
+# applied to stored features without the original photo
+FEATURE_MIGRATIONS = {}
+
+def template_compatible(schema, features):
+    """True if a stored template can be compared with freshly extracted features"""
+    return schema == FEATURE_SCHEMA_VERSION and len(features) == FEATURE_DIM
+
+def pack_face_template(features, face_hash, schema=FEATURE_SCHEMA_VERSION):
+    """Serialize a signature into the binary template format"""
+    features = np.asarray(features, dtype=TEMPLATE_DTYPE)
+    digest = bytes.fromhex(face_hash) if face_hash else bytes(32)
+    header = TEMPLATE_HEADER.pack(TEMPLATE_MAGIC, TEMPLATE_FORMAT_VERSION, schema, len(features), digest)
+    return header + features.tobytes()
+
+def unpack_face_template(blob):
+    """Parse a binary template; features are a zero-copy view into `blob`"""
+    if len(blob) < TEMPLATE_HEADER.size:
+        raise ValueError('Face template too short')
+
+    magic, version, schema, count, digest = TEMPLATE_HEADER.unpack_from(blob)
+    if magic != TEMPLATE_MAGIC:
+        raise ValueError('Not a face template')
+    if version != TEMPLATE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported face template version {version}')
+    if len(blob) != TEMPLATE_HEADER.size + count * TEMPLATE_DTYPE.itemsize:
+        raise ValueError('Face template length does not match its header')
+
+    features = np.frombuffer(blob, dtype=TEMPLATE_DTYPE, count=count, offset=TEMPLATE_HEADER.size)
+    return {
+        'features': features,
+        'hash': digest.hex() if any(digest) else '',
+        'schema': schema,
+        'version': version
+    }
+
+def decode_stored_face(face_template, face_encoding, face_hash=None):
+    """Return (features, hash, schema) for a stored face, preferring the binary template
+
+    Rows that have not been migrated yet still carry the signature as a JSON
+    list in face_encoding; those are parsed the old way.
+    """
+    if face_template:
+        template = unpack_face_template(face_template)
+        return template['features'], template['hash'] or face_hash or '', template['schema']
+
+    stored_data = json.loads(face_encoding)
+    features = np.asarray(stored_data['signature'], dtype=np.float32)
+    schema = stored_data.get('feature_schema', LEGACY_FEATURE_SCHEMA)
+    return features, stored_data.get('hash') or face_hash or '', schema
+
 def calculate_similarity(features1, features2):
     """Calculate similarity between two feature vectors"""
     try:
@@ -163,14 +854,15 @@ def calculate_similarity(features1, features2):
         f1 = np.array(features1, dtype=np.float64)
         f2 = np.array(features2, dtype=np.float64)
         
-        # Ensure same length
-        min_len = min(len(f1), len(f2))
+        # Signatures of different layouts are not comparable; truncating one
+        # would produce a meaningless score
+        if len(f1) != len(f2):
+            log.warning(f"[SIMILARITY] Refusing to compare {len(f1)} and {len(f2)} features")
+            return 0.0
+        min_len = len(f1)
         if min_len < 10:  # Not enough features
             return 0.0
         
-        f1 = f1[:min_len]
-        f2 = f2[:min_len]
-        
         # Calculate weighted Euclidean distance (lower = more similar)
         # Weight geometric features more heavily
         weights = np.ones(min_len)
@@ -190,7 +882,7 @@ def calculate_similarity(features1, features2):
         return float(similarity)
         
     except Exception as e:
-        print(f"[SIMILARITY ERROR] {e}")
+        log.error(f"[SIMILARITY ERROR] {e}")
         return 0.0
 
 def validate_face_quality(img, face_rect):
@@ -222,327 +914,2331 @@ def validate_face_quality(img, face_rect):
     except Exception as e:
         return False, f"Quality check error: {e}"
 
+class PipelineContext:
+    """One pipeline run's frame, gray frame and face rect, plus reusable work buffers
+
+    run_face_pipeline carries the context through decode, detect, quality
+    check and extract, so the gray frame is converted once and the
+    detection copy and 128x128 face stages are written into buffers kept
+    from earlier runs instead of freshly allocated ones. Buffers are
+    reallocated only when the frame size changes. A context is used by one
+    thread at a time (see ContextPool) and nothing in it outlives the run.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self.start(None)
+
+    def start(self, img):
+        self.img = img
+        self.rect = None
+        self._gray = None
+
+    def buffer(self, name, shape, dtype=np.uint8):
+        """The work buffer `name`, (re)allocated to shape/dtype"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    @property
+    def gray(self):
+        """The frame as grayscale, converted on first use"""
+        if self._gray is None:
+            if self.img.ndim == 2:
+                self._gray = self.img
+            else:
+                self._gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY,
+                                          dst=self.buffer('gray', self.img.shape[:2]))
+        return self._gray
+
+    def nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+class ContextPool:
+    """Pipeline contexts lent to one thread at a time
+
+    Request threads may be short-lived (threaded=True starts one per
+    request), so contexts are pooled rather than thread-local; at most
+    `max_idle` are kept between requests.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max(1, max_idle)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    @contextmanager
+    def acquire(self):
+        try:
+            context = self._idle.get_nowait()
+            self._count('reused')
+        except queue.Empty:
+            context = PipelineContext()
+            self._count('created')
+        try:
+            yield context
+        finally:
+            context.start(None)
+            if self._idle.qsize() < self.max_idle:
+                self._idle.put(context)
+
+    def status(self):
+        idle = list(self._idle.queue)
+        with self._lock:
+            stats = dict(self.stats)
+        return dict(stats, idle=len(idle), buffer_bytes=sum(context.nbytes() for context in idle))
+
+pipeline_contexts = ContextPool(DETECTOR_POOL_SIZE)
+
+def run_face_pipeline(image_bytes, check_quality=False, reduce=1, track=None):
+    """Decode, detect, optionally quality-check and extract one uploaded face
+
+    Returns a dict whose 'status' is 'ok', 'invalid_image', 'no_face',
+    'low_quality' or 'extract_failed'. On 'ok' it also carries every
+    extract_face_signature field plus 'image_shape'. 'timings' holds the
+    seconds spent in each stage that ran.
+
+    With reduce > 1 the image is decoded as reduced-size grayscale (see
+    DECODE_REDUCED); 'image_shape' and 'rect' are still reported in
+    full-resolution pixels. Quality checks need the full-size frame, so
+    check_quality always decodes at full size.
+
+    track is for stream frames (see VerifySession): {} on a keyframe, or
+    the previous frame's 'track' result to follow the face with track_face
+    instead of detecting it again. Stream results carry 'tracked' and,
+    once a face was found, a new 'track' (rect in decoded pixels plus the
+    shrunk face patch) for the next frame.
+    """
+    if check_quality or reduce not in REDUCED_DECODE_FLAGS:
+        reduce = 1
+    with pipeline_contexts.acquire() as context:
+        return _run_face_pipeline(context, image_bytes, check_quality, reduce, track)
+
+def _run_face_pipeline(context, image_bytes, check_quality, reduce, track=None):
+    timings = {}
+    start = time.perf_counter()
+    img = bytes_to_image(image_bytes, reduce)
+    timings['image_decode'] = time.perf_counter() - start
+    if img is None:
+        return {'status': 'invalid_image', 'timings': timings}
+    context.start(img)
+
+    result = {'image_shape': [img.shape[0] * reduce, img.shape[1] * reduce] + list(img.shape[2:]),
+              'timings': timings}
+    
+    # Follow the face from the previous stream frame while the match holds
+    face_rect = None
+    if track:
+        start = time.perf_counter()
+        face_rect, score = track_face(context.gray, track['patch'], track['rect'])
+        timings['track'] = time.perf_counter() - start
+        if score < TRACK_MIN_SCORE:
+            face_rect = None
+    if track is not None:
+        result['tracked'] = face_rect is not None
+
+    # Detect exactly ONE face
+    if face_rect is None:
+        start = time.perf_counter()
+        face_rect = detect_face(img, min_face=DETECT_MIN_FACE / reduce, context=context)
+        timings['detect'] = time.perf_counter() - start
+    if face_rect is None:
+        result['status'] = 'no_face'
+        return result
+    context.rect = face_rect
+    result['rect'] = [int(v) * reduce for v in face_rect]
+    if track is not None:
+        result['track'] = {'rect': face_rect, 'patch': shrink_face_patch(context.gray, face_rect)}
+    
+    if check_quality:
+        quality_ok, quality_msg = validate_face_quality(img, face_rect)
+        if not quality_ok:
+            result['status'] = 'low_quality'
+            result['message'] = quality_msg
+            return result
+    
+    start = time.perf_counter()
+    face_data = extract_face_signature(img, face_rect, MIN_FACE_CROP / reduce, context)
+    timings['extract'] = time.perf_counter() - start
+    if face_data is None:
+        result['status'] = 'extract_failed'
+        return result
+    
+    face_data['rect'] = result['rect']
+    result.update(face_data)
+    result['status'] = 'ok'
+    return result
+
+class PipelineBusy(Exception):
+    """Raised when no CV worker slot frees up within CV_QUEUE_TIMEOUT"""
+
+class PayloadTooLarge(Exception):
+    """Raised when a request body is larger than MAX_PAYLOAD_BYTES"""
+
+# Shared memory attached by each CV worker process
+_worker_state = {}
+
+def _cv_worker_init(input_name, output_name, slot_bytes):
+    """Attach a CV worker process to the shared slots and load one cascade"""
+    _worker_state['input'] = shared_memory.SharedMemory(name=input_name)
+    _worker_state['output'] = shared_memory.SharedMemory(name=output_name)
+    _worker_state['slot_bytes'] = slot_bytes
+    if not face_detector.loaded:
+        face_detector.size = 1
+        face_detector.load()
+
+def _cv_worker_ping(hold):
+    # Holding each task briefly forces the executor to start every worker
+    time.sleep(hold)
+    return os.getpid()
+
+def _cv_worker_run(slot, length, check_quality, reduce=1, track=None):
+    """Run the pipeline on the image in `slot` and write features back into it"""
+    start = slot * _worker_state['slot_bytes']
+    image_bytes = _worker_state['input'].buf[start:start + length]
+    try:
+        result = run_face_pipeline(image_bytes, check_quality, reduce, track)
+    finally:
+        image_bytes.release()
+
+    if result['status'] == 'ok' and result['feature_count'] <= FEATURE_DIM:
+        output = np.ndarray((result['feature_count'],), dtype=np.float32,
+                            buffer=_worker_state['output'].buf, offset=slot * FEATURE_DIM * 4)
+        output[:] = result.pop('features')
+        del output
+    return result
+
+class CVWorkerPool:
+    """Runs run_face_pipeline in worker processes instead of request threads
+
+    Every in-flight request owns one slot in two shared memory segments: the
+    encoded image is copied into its input slot and the worker writes the
+    float32 features into the matching output slot, so only small status
+    dicts cross the process boundary. The slot count bounds the queue;
+    a request that cannot get a slot within `queue_timeout` seconds gets
+    PipelineBusy instead of piling up behind the others.
+    """
+
+    def __init__(self, workers, slots_per_worker=CV_SLOTS_PER_WORKER,
+                 slot_bytes=CV_SLOT_BYTES, queue_timeout=CV_QUEUE_TIMEOUT):
+        self.workers = workers
+        self.slots = max(1, workers * slots_per_worker)
+        self.slot_bytes = slot_bytes
+        self.queue_timeout = queue_timeout
+        self._input = shared_memory.SharedMemory(create=True, size=self.slots * slot_bytes)
+        self._output = shared_memory.SharedMemory(create=True, size=self.slots * FEATURE_DIM * 4)
+        self._free = queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_cv_worker_init,
+            initargs=(self._input.name, self._output.name, slot_bytes)
+        )
+        self._lock = threading.Lock()
+        self.stats = {'processed': 0, 'rejected_busy': 0, 'rejected_too_large': 0}
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def warm_up(self):
+        """Start every worker now instead of on the first logins"""
+        start = time.perf_counter()
+        futures = [self._executor.submit(_cv_worker_ping, 0.2) for _ in range(self.workers)]
+        pids = {future.result() for future in futures}
+        log.info(f"[CV WORKERS] {len(pids)} worker processes ready in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def run(self, image_bytes, check_quality=False, reduce=1, track=None):
+        length = len(image_bytes)
+        if length > self.slot_bytes:
+            self._count('rejected_too_large')
+            return {'status': 'invalid_image', 'message': 'Image too large'}
+
+        try:
+            slot = self._free.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            self._count('rejected_busy')
+            raise PipelineBusy()
+
+        try:
+            start = slot * self.slot_bytes
+            self._input.buf[start:start + length] = image_bytes
+            result = self._executor.submit(_cv_worker_run, slot, length, check_quality, reduce, track).result()
+            if result['status'] == 'ok' and 'features' not in result:
+                features = np.ndarray((result['feature_count'],), dtype=np.float32,
+                                      buffer=self._output.buf, offset=slot * FEATURE_DIM * 4)
+                result['features'] = features.tolist()
+                del features
+            self._count('processed')
+            return result
+        finally:
+            self._free.put(slot)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for segment in (self._input, self._output):
+            segment.close()
+            segment.unlink()
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats.update({
+            'workers': self.workers,
+            'slots': self.slots,
+            'free_slots': self._free.qsize(),
+            'slot_bytes': self.slot_bytes
+        })
+        return stats
+
+cv_workers = None
+
+def start_cv_workers(workers=CV_WORKERS):
+    """Start the CV worker pool (no-op when workers is 0)"""
+    global cv_workers
+    if workers > 0 and cv_workers is None:
+        cv_workers = CVWorkerPool(workers)
+        cv_workers.warm_up()
+        atexit.register(cv_workers.close)
+    return cv_workers
+
+class ProbeCache:
+    """Short-lived LRU cache of pipeline results keyed by the uploaded bytes
+
+    The login page posts the same captured frame to /api/face/test/<id>
+    once per candidate user, and users re-click capture; identical bytes
+    within PROBE_CACHE_TTL seconds reuse the first result instead of
+    decoding, detecting and extracting again. The key is a digest of the
+    raw bytes plus the pipeline options, so a registration (quality
+    checked, full size) never reuses a reduced verify decode. Tracked
+    stream frames depend on the previous frame and are never cached.
+    """
+
+    def __init__(self, max_entries=PROBE_CACHE_SIZE, ttl=PROBE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.ttl > 0
+
+    @staticmethod
+    def key(image_bytes, check_quality, reduce, stream=False):
+        return hashlib.blake2b(image_bytes, digest_size=16).digest(), bool(check_quality), reduce, stream
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                self.stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return dict(entry[1])
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['max_entries'] = self.max_entries
+        stats['ttl_s'] = self.ttl
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+probe_cache = ProbeCache()
+
+def process_face_image(image_bytes, check_quality=False, reduce=1, track=None):
+    """Run the face pipeline on uploaded image bytes, on a worker if enabled
+
+    Results for bytes seen within PROBE_CACHE_TTL come from probe_cache;
+    callers get their own copy of the result dict but must not modify its
+    'features' or 'rect' in place.
+    """
+    if image_bytes is None:
+        result = {'status': 'invalid_image'}
+        pipeline_results.inc(status=result['status'])
+        return result
+
+    key = None
+    if probe_cache.enabled and not track:
+        key = ProbeCache.key(image_bytes, check_quality, reduce, track is not None)
+    if key is not None:
+        result = probe_cache.get(key)
+        if result is not None:
+            return result
+
+    if cv_workers is not None:
+        result = cv_workers.run(image_bytes, check_quality, reduce, track)
+    else:
+        result = run_face_pipeline(image_bytes, check_quality, reduce, track)
+
+    for stage, seconds in result.pop('timings', {}).items():
+        stage_seconds.observe(seconds, stage=stage)
+    pipeline_results.inc(status=result['status'])
+    if key is not None:
+        probe_cache.put(key, dict(result))
+    return result
+
+def record_decision(endpoint, matched, similarity):
+    decisions_total.inc(endpoint=endpoint, decision='accept' if matched else 'reject')
+    similarity_scores.observe(similarity, endpoint=endpoint)
+
+def pipeline_busy_response():
+    return jsonify({
+        'success': False,
+        'error': 'Face processing is busy. Please try again.'
+    }), 503, {'Retry-After': '1'}
+
+class Overloaded(Exception):
+    """Raised when admission control turns a request away; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Overloaded, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+class AdmissionControl:
+    """Bounded, prioritized admission to the face-processing endpoints
+
+    At most `limit` requests do face work at once, however many threads
+    the server starts; the others wait in a priority queue (lower
+    ADMISSION_PRIORITIES value first, FIFO within one) for a slot to be
+    handed over. A request that finds max_queue requests waiting, or whose
+    expected wait (requests ahead of it times the recent slot hold time,
+    spread over `limit`) already exceeds `deadline`, is refused at once,
+    and one still queued at the deadline gives up; both become a 429 with
+    Retry-After. Overload therefore costs some callers a fast retry
+    instead of slowing every login down.
+
+    enter/cancel/release are shared by admit() (request threads) and the
+    async server, which waits on a future instead of an Event.
+    """
+
+    def __init__(self, limit=ADMISSION_LIMIT, deadline=ADMISSION_DEADLINE, max_queue=ADMISSION_MAX_QUEUE):
+        self.limit = limit
+        self.deadline = deadline
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []    # heap of [priority, seq, wake, state]
+        self._waiting = 0   # queue entries still in state 'waiting'
+        self._seq = 0
+        # Moving average of how long an admitted request holds its slot
+        self.hold_time = 0.05
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'timed_out': 0}
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def _expected_wait(self, priority):
+        ahead = sum(1 for entry in self._queue if entry[3] == 'waiting' and entry[0] <= priority)
+        return (ahead + 1) * self.hold_time / self.limit
+
+    def _refuse(self, name, reason, wait):
+        """Count a refusal (reason None: the caller went away); returns the Retry-After seconds"""
+        if reason is not None:
+            self.stats['rejected' if reason == 'full' else 'timed_out'] += 1
+            admission_rejected.inc(priority=name, reason=reason)
+        return max(1, math.ceil(wait))
+
+    def enter(self, name, wake):
+        """None if admitted right away, else a queue ticket; raises Overloaded
+
+        `wake()` is called (under the lock, so it must not block) when a
+        queued ticket is handed a slot.
+        """
+        priority = ADMISSION_PRIORITIES[name]
+        with self._lock:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                self.stats['admitted'] += 1
+                return None
+            wait = self._expected_wait(priority)
+            if self._waiting >= self.max_queue or wait > self.deadline:
+                raise Overloaded(self._refuse(name, 'full', wait))
+            self._seq += 1
+            ticket = [priority, self._seq, wake, 'waiting']
+            heapq.heappush(self._queue, ticket)
+            self._waiting += 1
+            self.stats['queued'] += 1
+            return ticket
+
+    def cancel(self, name, ticket, reason='deadline'):
+        """Withdraw a queued ticket; returns the Retry-After seconds
+
+        Returns None if the ticket was handed a slot meanwhile; the caller
+        then owns that slot and must release() it.
+        """
+        with self._lock:
+            if ticket[3] != 'waiting':
+                return None
+            ticket[3] = 'cancelled'
+            self._waiting -= 1
+            # Cancelled entries are skipped and dropped by release()
+            return self._refuse(name, reason, self._expected_wait(ticket[0]))
+
+    def admitted(self, name, waited):
+        admission_wait.observe(waited, priority=name)
+
+    def release(self, held):
+        """Give a slot back, handing it straight to the first queued ticket"""
+        with self._lock:
+            self.hold_time += 0.1 * (held - self.hold_time)
+            while self._queue:
+                ticket = heapq.heappop(self._queue)
+                if ticket[3] == 'waiting':
+                    ticket[3] = 'admitted'
+                    self._waiting -= 1
+                    self.stats['admitted'] += 1
+                    ticket[2]()
+                    return
+            self._active -= 1
+
+    @contextmanager
+    def admit(self, name):
+        """Hold a slot for the block; raises Overloaded instead of waiting past the deadline"""
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        woken = threading.Event()
+        ticket = self.enter(name, woken.set)
+        if ticket is not None and not woken.wait(self.deadline):
+            retry_after = self.cancel(name, ticket)
+            if retry_after is not None:
+                raise Overloaded(retry_after)
+        self.admitted(name, time.monotonic() - start)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats, active=self._active, waiting=self._waiting)
+        stats.update({'limit': self.limit, 'max_queue': self.max_queue, 'deadline_s': self.deadline,
+                      'hold_ms': round(self.hold_time * 1000, 1)})
+        return stats
+
+admission_control = AdmissionControl()
+
+def overloaded_response(retry_after):
+    return jsonify({
+        'success': False,
+        'error': 'Face processing is overloaded. Please try again.',
+        'retry_after': retry_after
+    }), 429, {'Retry-After': str(retry_after)}
+
+def admitted(name):
+    """Route decorator: run the view under admission_control with priority `name`"""
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                with admission_control.admit(name):
+                    return view(*args, **kwargs)
+            except Overloaded as e:
+                return overloaded_response(e.retry_after)
+        return wrapper
+    return decorate
+
+def payload_too_large_response():
+    return jsonify({
+        'success': False,
+        'error': f'Image upload is larger than {MAX_PAYLOAD_BYTES // (1024 * 1024)} MB'
+    }), 413
+
+def similarity_weights(length):
+    """Per-feature weights used by calculate_similarity (geometry counts double)"""
+    weights = np.ones(length, dtype=np.float32)
+    if length >= GEOMETRY_FEATURES:
+        weights[-GEOMETRY_FEATURES:] = 2.0
+    return weights
+
+def _as_datetime(value):
+    """updated_at as a datetime (MySQL returns datetimes, the sqlite stand-in strings)"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+class FaceGallery:
+    """In-memory matrix of every enrolled face signature for 1:N identification
+
+    Readers take a reference to the current snapshot without locking; writers
+    build a new snapshot and swap it in, so a search never sees a half-applied
+    update.
+
+    After start_shared() the gallery lives in shared memory instead: the
+    owner process applies every change and publishes it, reader processes
+    map the owner's latest generation and forward their own register/remove
+    changes to it (see face_shm_gallery.py).
+
+    With a snapshot directory (FACE_GALLERY_SNAPSHOT), load_snapshot() maps
+    the last exported gallery instead of loading every row, and sync()
+    catches up on the rows changed since its watermark (see face_snapshot.py).
+
+    Once background_sync is set (GallerySyncer), request threads only sync a
+    gallery that was never loaded; the periodic checks run on the syncer.
+    """
+
+    def __init__(self, dim=FEATURE_DIM):
+        self.dim = dim
+        self._weights = similarity_weights(dim)
+        self._lock = threading.Lock()
+        self._snapshot = self._build([], np.empty((0, dim), dtype=np.float32), {}, {}, set())
+        self.ann_min_gallery = ANN_MIN_GALLERY
+        self.nprobe = ANN_NPROBE
+        self._loaded = False
+        self._fingerprint = None
+        self._last_sync = 0.0
+        self.background_sync = False
+        # Catch-up state: newest updated_at applied, and registered rows that failed to decode
+        self._watermark = None
+        self._invalid = set()
+        self.snapshot_dir = GALLERY_SNAPSHOT_DIR
+        self._exported_at = 0.0
+        self._exporting = threading.Lock()
+        # Shared-memory mode (start_shared): role is 'owner' or 'reader'
+        self.shared_name = None
+        self._role = None
+        self._control = None
+        self._owner_lock = None
+        self._generation = 0
+        self._dirty = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._last_takeover = 0.0
+
+    @staticmethod
+    def _build(user_ids, matrix, hashes, users, stale, index=None):
+        return {
+            'user_ids': list(user_ids),
+            'matrix': matrix,
+            'hashes': dict(hashes),    # face_hash -> user_id
+            'users': dict(users),      # user_id -> public profile
+            'stale': frozenset(stale), # user_ids whose template has an outdated feature schema
+            'index': index,            # IVFIndex over matrix rows, None below ann_min_gallery
+            'segment': None,           # shared-memory segment backing a reader snapshot
+        }
+
+    @staticmethod
+    def _id_list(user_ids):
+        """A private list copy of a snapshot's user ids (a list, or an array when mapped)"""
+        return user_ids.tolist() if isinstance(user_ids, np.ndarray) else list(user_ids)
+
+    def start_shared(self, name):
+        """Share this gallery with the other server processes under `name`"""
+        self.shared_name = name
+        self._control = face_shm_gallery.GalleryControl(name)
+        self._owner_lock = face_shm_gallery.OwnerLock(name)
+        if self._owner_lock.try_acquire():
+            self._become_owner()
+        else:
+            self._role = 'reader'
+            self._last_takeover = time.monotonic()
+            self._current()
+            log.info("[GALLERY] Reading shared gallery %s (generation %d)", name, self._generation)
+
+    def _become_owner(self):
+        self._role = 'owner'
+        thread = threading.Thread(target=self._own, name='face-gallery-owner', daemon=True)
+        thread.start()
+        atexit.register(self._stop_owner, thread)
+        log.info("[GALLERY] Owning shared gallery %s (pid %d)", self.shared_name, os.getpid())
+
+    def _current(self):
+        """The snapshot to read; readers first pick up a newer shared generation"""
+        if self._role == 'reader':
+            generation = self._control.generation
+            if generation != self._generation and generation:
+                self._attach(generation)
+            # The owner's lock is released when it exits; a reader takes its place
+            if time.monotonic() - self._last_takeover >= GALLERY_SYNC_INTERVAL:
+                self._last_takeover = time.monotonic()
+                if self._owner_lock.try_acquire():
+                    self._become_owner()
+        return self._snapshot
+
+    def _attach(self, generation):
+        with self._lock:
+            if generation == self._generation:
+                return
+            try:
+                snapshot = face_shm_gallery.read_segment(
+                    face_shm_gallery.segment_name(self.shared_name, generation), self._weights)
+            except FileNotFoundError:
+                # Already replaced by a newer generation; the next access attaches that one
+                return
+            self._snapshot = snapshot
+            self._generation = generation
+            self._loaded = True
+
+    def _forward(self, user_id):
+        """True if a change must go through the owner instead of this process"""
+        if self._role is None or (self._role == 'owner' and self._snapshot['segment'] is None):
+            return False
+        self._control.request_refresh(user_id)
+        return True
+
+    def _changed(self):
+        if self._role == 'owner':
+            self._dirty = True
+            self._wake.set()
+
+    def _own(self):
+        """Owner thread: apply forwarded changes, follow the database and publish"""
+        tail = self._control.ring_head
+        # A gallery mapped from a snapshot only needs catching up; a reader's is replaced
+        pending, full_reload = set(), self._snapshot['segment'] is not None or not self._loaded
+        self._dirty = self._loaded
+        while not self._stop.is_set():
+            changed, tail = self._control.changed_since(tail)
+            if changed is None:
+                full_reload = True
+            else:
+                pending.update(changed)
+            try:
+                if full_reload or pending or self.sync_due():
+                    with db_pool.connection() as connection:
+                        if connection:
+                            if full_reload:
+                                self.sync(connection, force=True)
+                            else:
+                                if pending:
+                                    self.refresh_users(connection, pending)
+                                self.sync(connection)
+                            pending, full_reload = set(), False
+                if self._dirty:
+                    self._publish()
+            except Exception as e:
+                log.warning("[GALLERY] Shared gallery update failed: %s", e)
+            self._wake.wait(GALLERY_SHM_POLL)
+            self._wake.clear()
+
+    def _publish(self):
+        """Write the current snapshot to a new data segment and make it current"""
+        start = time.perf_counter()
+        with self._lock:
+            snapshot = self._snapshot
+            self._dirty = False
+        previous = self._control.generation
+        generation = previous + 1
+        size = face_shm_gallery.write_segment(
+            face_shm_gallery.segment_name(self.shared_name, generation), *self._storage_arrays(snapshot))
+        self._control.publish(generation, os.getpid())
+        self._generation = generation
+        # Also removes the last segment of an owner that died without cleaning up
+        face_shm_gallery.unlink_segment(face_shm_gallery.segment_name(self.shared_name, previous))
+        log.debug("[GALLERY] Published generation %d (%d faces, %d bytes) in %.1f ms",
+                  generation, len(snapshot['user_ids']), size, (time.perf_counter() - start) * 1000)
+
+    @staticmethod
+    def _storage_arrays(snapshot):
+        """face_shm_gallery.gallery_arrays() for a snapshot"""
+        user_ids = [int(user_id) for user_id in snapshot['user_ids']]
+        row_hashes = {user_id: face_hash for face_hash, user_id in snapshot['hashes'].items()}
+        return face_shm_gallery.gallery_arrays(
+            user_ids, snapshot['matrix'],
+            [row_hashes.get(user_id, '') for user_id in user_ids],
+            [snapshot['users'].get(user_id) or {'id': user_id} for user_id in user_ids],
+            snapshot['stale'], snapshot['index'])
+
+    def _stop_owner(self, thread):
+        self._stop.set()
+        self._wake.set()
+        thread.join(5)
+        if self._role == 'owner' and self._generation:
+            face_shm_gallery.unlink_segment(face_shm_gallery.segment_name(self.shared_name, self._generation))
+
+    def _train_index(self, matrix, previous=None):
+        """Index for a reloaded matrix; reuses the previous clusters unless the size moved a lot"""
+        if len(matrix) < max(1, self.ann_min_gallery):
+            return None
+        if previous is not None and \
+                previous.trained_on / ANN_RETRAIN_GROWTH < len(matrix) < previous.trained_on * ANN_RETRAIN_GROWTH:
+            return previous.reindex(matrix)
+        start = time.perf_counter()
+        index = IVFIndex.train(matrix, self._weights, nlist=ANN_NLIST or None)
+        log.info("[GALLERY] Trained %d-list index on %d faces in %.2fs",
+                 index.nlist, len(matrix), time.perf_counter() - start)
+        return index
+
+    def _index_after_add(self, index, matrix, added=1):
+        """Keep the index in step with the last `added` rows appended to matrix"""
+        if index is None or len(matrix) >= ANN_RETRAIN_GROWTH * index.trained_on:
+            return self._train_index(matrix)
+        return index.add_many(len(matrix) - added, matrix[-added:])
+
+    @staticmethod
+    def _swap_remove(user_ids, matrix, index, row):
+        """Drop one row by moving the last row into its place (keeps index rows valid)"""
+        last = len(user_ids) - 1
+        if row != last:
+            matrix = matrix.copy()
+            matrix[row] = matrix[last]
+            user_ids[row] = user_ids[last]
+        user_ids.pop()
+        if index is not None:
+            index = index.remove(row)
+        return user_ids, matrix[:last], index
+
+    def __len__(self):
+        return len(self._current()['user_ids'])
+
+    def hash_owner(self, face_hash):
+        """User id enrolled with exactly this face hash, or None"""
+        return self._current()['hashes'].get(face_hash) if face_hash else None
+
+    def status(self):
+        snapshot = self._current()
+        index = snapshot['index']
+        status = {'size': len(snapshot['user_ids']), 'stale': len(snapshot['stale']),
+                  'invalid': len(self._invalid), 'loaded': int(self._loaded),
+                  'background_sync': int(self.background_sync),
+                  'indexed': 0, 'nprobe': self.nprobe}
+        if index is not None:
+            status.update(index.status())
+            status['indexed'] = 1
+        if self._role is not None:
+            status.update({'shared_owner': int(self._role == 'owner'), 'shared_generation': self._generation})
+        return status
+
+    LOAD_QUERY = """
+        SELECT id, email, first_name, last_name, face_template, face_encoding, face_hash, updated_at
+        FROM users
+        WHERE face_registered = 1
+    """
+    CATCH_UP_QUERY = """
+        SELECT id, email, first_name, last_name, face_template, face_encoding, face_hash,
+               face_registered, updated_at
+        FROM users
+        WHERE updated_at >= %s
+    """
+    # Before users.face_template exists (see check_template_column)
+    LOAD_QUERY_JSON = """
+        SELECT id, email, first_name, last_name, NULL AS face_template, face_encoding, face_hash, updated_at
+        FROM users
+        WHERE face_registered = 1
+    """
+    CATCH_UP_QUERY_JSON = """
+        SELECT id, email, first_name, last_name, NULL AS face_template, face_encoding, face_hash,
+               face_registered, updated_at
+        FROM users
+        WHERE updated_at >= %s
+    """
+    FINGERPRINT_QUERY = """
+        SELECT COUNT(*), MAX(updated_at) FROM users WHERE face_registered = 1
+    """
+
+    def load_all(self, connection, fingerprint=None):
+        """Rebuild the gallery from every user with a registered face"""
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(self.LOAD_QUERY)
+        rows = cursor.fetchall()
+        cursor.close()
+        self.load_rows(rows, fingerprint)
+
+    @staticmethod
+    def _parse_row(row):
+        """(user_id, features, hash, profile) for a LOAD_QUERY row; features is None if outdated
+
+        Returns None for a row whose template cannot be decoded.
+        """
+        try:
+            features, stored_hash, schema = decode_stored_face(
+                row['face_template'], row['face_encoding'], row['face_hash'])
+        except Exception:
+            return None
+
+        user_id = int(row['id'])
+        # Outdated layouts cannot be compared; they wait for `face_migrate.py schema`
+        if not template_compatible(schema, features):
+            return user_id, None, None, None
+        profile = {
+            'id': user_id,
+            'email': row['email'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name']
+        }
+        return user_id, features, stored_hash, profile
+
+    def load_rows(self, rows, fingerprint=None):
+        """Rebuild the gallery from LOAD_QUERY rows (dicts)"""
+        if self._role == 'reader':
+            return
+        user_ids, vectors, hashes, users, stale, invalid = [], [], {}, {}, set(), set()
+        watermark = None
+        for row in rows:
+            updated_at = _as_datetime(row.get('updated_at'))
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+            parsed = self._parse_row(row)
+            if parsed is None:
+                invalid.add(int(row['id']))
+                continue
+            user_id, features, stored_hash, profile = parsed
+            if features is None:
+                stale.add(user_id)
+                continue
+
+            users[user_id] = profile
+            if stored_hash:
+                hashes[stored_hash] = user_id
+            user_ids.append(user_id)
+            vectors.append(features)
+
+        matrix = np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+        index = self._train_index(matrix, self._snapshot['index'])
+        with self._lock:
+            self._snapshot = self._build(user_ids, matrix, hashes, users, stale, index)
+            self._loaded = True
+            self._watermark = watermark
+            self._invalid = invalid
+            if fingerprint is not None:
+                self._fingerprint = fingerprint
+        self._changed()
+
+        log.info(f"[GALLERY] Loaded {len(self)} enrolled faces"
+                 + (f" ({len(stale)} outdated templates skipped)" if stale else ""))
+        self._maybe_export(force=True)
+
+    def load_snapshot(self):
+        """Map the newest exported snapshot; True if the gallery was loaded from it
+
+        Does nothing without a snapshot directory, once loaded, or in a
+        shared-memory reader (which maps the owner's gallery instead).
+        """
+        if not self.snapshot_dir or self._loaded or self._role == 'reader':
+            return False
+        start = time.perf_counter()
+        try:
+            loaded = face_snapshot.load(self.snapshot_dir, self._weights, self.dim, FEATURE_SCHEMA_VERSION)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("[GALLERY] Cannot read snapshot in %s: %s", self.snapshot_dir, e)
+            return False
+        if loaded is None:
+            log.info("[GALLERY] No usable snapshot in %s", self.snapshot_dir)
+            return False
+
+        fields, meta = loaded
+        fields['segment'] = None
+        with self._lock:
+            if self._loaded:
+                return False
+            self._snapshot = fields
+            self._loaded = True
+            self._watermark = _as_datetime(meta['watermark'])
+            self._invalid = set(meta['invalid'])
+            # Unknown: the first sync() compares the database against the snapshot
+            self._fingerprint = None
+            self._exported_at = meta['created']
+        self._changed()
+        log.info("[GALLERY] Mapped snapshot %s (%d faces, watermark %s) in %.1f ms", meta['version'],
+                 meta['count'], meta['watermark'], (time.perf_counter() - start) * 1000)
+        return True
+
+    def export_snapshot(self, directory=None):
+        """Write the current gallery to the snapshot directory; returns the version path"""
+        directory = directory or self.snapshot_dir
+        with self._lock:
+            snapshot, watermark, invalid = self._snapshot, self._watermark, set(self._invalid)
+        start = time.perf_counter()
+        arrays, counts = self._storage_arrays(snapshot)
+        path = face_snapshot.export(directory, arrays, counts, FEATURE_SCHEMA_VERSION, watermark, invalid)
+        if path is not None:
+            self._exported_at = time.time()
+            log.info("[GALLERY] Exported %d faces to %s in %.2fs",
+                     counts['count'], path, time.perf_counter() - start)
+        return path
+
+    def _maybe_export(self, force=False):
+        """Export in the background after a full load, or once the last export is too old"""
+        if not self.snapshot_dir or self._role == 'reader':
+            return
+        if not force and time.time() - self._exported_at < GALLERY_SNAPSHOT_MAX_AGE:
+            return
+        if not self._exporting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.export_snapshot()
+            except Exception as e:
+                log.warning("[GALLERY] Snapshot export failed: %s", e)
+            finally:
+                self._exporting.release()
+        threading.Thread(target=run, name='face-gallery-export', daemon=True).start()
+
+    def catch_up_query(self):
+        """(query, params) for the rows changed since the watermark, or None without one"""
+        if self._watermark is None:
+            return None
+        since = self._watermark - timedelta(seconds=GALLERY_CATCH_UP_MARGIN)
+        return self.CATCH_UP_QUERY, (since.strftime('%Y-%m-%d %H:%M:%S'),)
+
+    def apply_catch_up(self, rows, fingerprint):
+        """Apply CATCH_UP_QUERY rows; False if the result does not add up to `fingerprint`
+
+        Rows whose face did not change (e.g. only last_face_login moved) are
+        skipped. On False the caller falls back to a full reload.
+        """
+        changed = 0
+        watermark = self._watermark
+        for row in rows:
+            updated_at = _as_datetime(row['updated_at'])
+            if updated_at is not None and updated_at > watermark:
+                watermark = updated_at
+            user_id = int(row['id'])
+            snapshot = self._snapshot
+            known = user_id in snapshot['stale'] or snapshot['users'].get(user_id) is not None
+
+            if not row['face_registered']:
+                self._invalid.discard(user_id)
+                if known:
+                    self.remove(user_id)
+                    changed += 1
+                continue
+
+            parsed = self._parse_row(row)
+            if parsed is None:
+                if known:
+                    self.remove(user_id)
+                    changed += 1
+                self._invalid.add(user_id)
+                continue
+            self._invalid.discard(user_id)
+
+            _, features, stored_hash, profile = parsed
+            if features is None:
+                if user_id not in snapshot['stale']:
+                    self._mark_stale(user_id)
+                    changed += 1
+            elif not stored_hash or snapshot['hashes'].get(stored_hash) != user_id \
+                    or snapshot['users'].get(user_id) != profile:
+                self.upsert(user_id, features, stored_hash, profile)
+                changed += 1
+
+        snapshot = self._snapshot
+        if len(snapshot['user_ids']) + len(snapshot['stale']) + len(self._invalid) != fingerprint[0]:
+            log.info("[GALLERY] Catch-up does not match the database (%d rows), reloading", fingerprint[0])
+            return False
+        self._watermark = watermark
+        self._fingerprint = tuple(fingerprint)
+        if changed:
+            log.info("[GALLERY] Caught up on %d changed faces", changed)
+        self._maybe_export()
+        return True
+
+    def _mark_stale(self, user_id):
+        """Drop a user whose template now has an outdated schema and count them as stale"""
+        self.remove(user_id)
+        with self._lock:
+            current = self._snapshot
+            self._snapshot = dict(current, stale=current['stale'] | {int(user_id)})
+        self._changed()
+
+    def refresh_users(self, connection, user_ids):
+        """Reload a few users from the database (the owner applying forwarded changes)"""
+        user_ids = sorted(int(user_id) for user_id in user_ids)
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(self.LOAD_QUERY + " AND id IN ({})".format(', '.join(['%s'] * len(user_ids))),
+                       tuple(user_ids))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        found = set()
+        for row in rows:
+            parsed = self._parse_row(row)
+            if parsed is None or parsed[1] is None:
+                continue
+            user_id, features, stored_hash, profile = parsed
+            self.upsert(user_id, features, stored_hash, profile)
+            found.add(user_id)
+        for user_id in set(user_ids) - found:
+            self.remove(user_id)
+
+    def sync_due(self, force=False, background=False):
+        """True if a sync should query the database now (`background`: the syncer asking)"""
+        if self._role == 'reader':
+            # Readers follow the owner's generations instead of the database
+            self._current()
+            return False
+        if force or not self._loaded:
+            return True
+        if self.background_sync:
+            return background
+        return time.monotonic() - self._last_sync >= GALLERY_SYNC_INTERVAL
+
+    def needs_reload(self, fingerprint, force=False):
+        """Record a FINGERPRINT_QUERY result; True if the gallery must be reloaded"""
+        self._last_sync = time.monotonic()
+        return force or not self._loaded or tuple(fingerprint) != self._fingerprint
+
+    def sync(self, connection, force=False, background=False):
+        """Reload the gallery if the enrolled set changed outside this process
+
+        A gallery with a watermark only reads the rows changed since then.
+        """
+        if not self.sync_due(force, background):
+            return
+        self.load_snapshot()
+
+        cursor = connection.cursor()
+        cursor.execute(self.FINGERPRINT_QUERY)
+        fingerprint = tuple(cursor.fetchone())
+        cursor.close()
+
+        if self.needs_reload(fingerprint, force):
+            catch_up = None if force else self.catch_up_query()
+            if catch_up is not None:
+                cursor = connection.cursor(dictionary=True)
+                cursor.execute(*catch_up)
+                rows = cursor.fetchall()
+                cursor.close()
+                if self.apply_catch_up(rows, fingerprint):
+                    return
+            self.load_all(connection, fingerprint)
+
+    def upsert(self, user_id, features, face_hash, profile):
+        """Add or replace one user's signature after registration"""
+        self.upsert_many([(user_id, features, face_hash, profile)])
+
+    def upsert_many(self, entries):
+        """Add or replace (user_id, features, face_hash, profile) entries in one new snapshot
+
+        The matrix and maps are copied once for the whole batch, which keeps
+        a bulk import linear in the gallery size.
+        """
+        entries = {int(user_id): (features, face_hash, profile)
+                   for user_id, features, face_hash, profile in entries}
+        for features, _, _ in entries.values():
+            if len(features) != self.dim:
+                raise ValueError(f'Expected {self.dim} features, got {len(features)}')
+        # Forwarding depends only on this process's role, so it applies to all or none
+        if not entries or all([self._forward(user_id) for user_id in entries]):
+            return
+        with self._lock:
+            current = self._snapshot
+            user_ids = self._id_list(current['user_ids'])
+            matrix = current['matrix']
+            hashes = {h: uid for h, uid in current['hashes'].items() if uid not in entries}
+            users = dict(current['users'].items())
+            stale = current['stale'] - set(entries)
+            index = current['index']
+
+            for user_id in entries:
+                if current['users'].get(user_id) is not None:
+                    user_ids, matrix, index = self._swap_remove(user_ids, matrix, index, user_ids.index(user_id))
+
+            user_ids.extend(entries)
+            vectors = np.asarray([features for features, _, _ in entries.values()], dtype=np.float32)
+            matrix = np.vstack([matrix, vectors])
+            index = self._index_after_add(index, matrix, len(entries))
+
+            for user_id, (_, face_hash, profile) in entries.items():
+                if face_hash:
+                    hashes[face_hash] = user_id
+                users[user_id] = profile
+            self._snapshot = self._build(user_ids, matrix, hashes, users, stale, index)
+        self._changed()
+
+    def remove(self, user_id):
+        """Drop one user's signature after their registration is removed"""
+        user_id = int(user_id)
+        if self._forward(user_id):
+            return
+        with self._lock:
+            current = self._snapshot
+            user_ids = self._id_list(current['user_ids'])
+            matrix = current['matrix']
+            index = current['index']
+            if user_id in user_ids:
+                user_ids, matrix, index = self._swap_remove(user_ids, matrix, index, user_ids.index(user_id))
+            stale = current['stale'] - {user_id}
+            hashes = {h: uid for h, uid in current['hashes'].items() if uid != user_id}
+            users = {uid: u for uid, u in current['users'].items() if uid != user_id}
+            self._snapshot = self._build(user_ids, matrix, hashes, users, stale, index)
+        self._changed()
+
+    def search(self, features, face_hash, top_k=IDENTIFY_TOP_K, nprobe=None):
+        """Score a probe against the enrolled faces and return the best top_k
+
+        Only current-schema templates are searched. With an index, only the
+        rows in the `nprobe` nearest lists are scored (exactly); without one,
+        or when nprobe covers every list, all rows are.
+        """
+        snapshot = self._current()
+        scores = {}
+
+        if len(snapshot['user_ids']) and len(features) == self.dim:
+            probe = np.asarray(features, dtype=np.float32)
+            index = snapshot['index']
+            nprobe = self.nprobe if nprobe is None else nprobe
+            rows = None
+            if index is not None and nprobe < index.nlist:
+                rows = index.candidates(probe, nprobe)
+                if len(rows) < top_k:
+                    rows = None
+            candidates = snapshot['matrix'] if rows is None else snapshot['matrix'][rows]
+
+            weighted_diff = (candidates - probe) * self._weights
+            distances = np.sqrt(np.einsum('ij,ij->i', weighted_diff, weighted_diff))
+            similarities = np.maximum(0.0, 1.0 - distances / 5.0)
+
+            k = min(top_k, len(similarities))
+            best = np.argpartition(-similarities, k - 1)[:k]
+            for position in best:
+                row = position if rows is None else rows[position]
+                scores[int(snapshot['user_ids'][row])] = float(similarities[position])
+
+        # An exact hash match always wins, just like in verify_face
+        hash_user = snapshot['hashes'].get(face_hash)
+        if hash_user is not None:
+            scores[hash_user] = 1.0
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            {
+                'user_id': user_id,
+                'similarity': similarity,
+                'hash_match': user_id == hash_user,
+                'user': snapshot['users'].get(user_id)
+            }
+            for user_id, similarity in ranked
+        ]
+
+face_gallery = FaceGallery()
+
+def load_gallery_snapshot():
+    """Map the snapshot in FACE_GALLERY_SNAPSHOT at boot (no-op when unset)
+
+    Call before start_shared_gallery(), so that the owner only catches up.
+    """
+    face_gallery.load_snapshot()
+
+def start_shared_gallery(name=GALLERY_SHM_NAME):
+    """Join the shared-memory gallery named by FACE_GALLERY_SHM (no-op when unset)
+
+    Call once per server process after it has forked: `python
+    face_auth_secure.py` and the async lifespan do; gunicorn deployments
+    call it from a post_fork hook.
+    """
+    if name and face_gallery.shared_name is None:
+        face_gallery.start_shared(name)
+
+class GallerySyncer:
+    """Keeps face_gallery in step with the database from a background thread
+
+    Every GALLERY_SYNC_INTERVAL seconds one pooled connection runs
+    FaceGallery.sync, so a catch-up or full reload no longer lands on an
+    identify or register request. The threaded server syncs on its own
+    thread (start()); the async server drives the same sync from a task.
+    """
+
+    def __init__(self, interval=GALLERY_SYNC_INTERVAL):
+        self.interval = max(0.1, interval)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sync(self):
+        try:
+            with db_pool.connection() as connection:
+                if connection:
+                    face_gallery.sync(connection, background=True)
+        except Exception as e:
+            log.warning("[GALLERY] Background sync failed: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sync()
+
+    def start(self):
+        """Sync once, then keep syncing on a background thread
+
+        Call once per server process after start_shared_gallery(): `python
+        face_auth_secure.py` does; gunicorn deployments call it from the
+        post_fork hook.
+        """
+        if face_gallery.shared_name is not None:
+            # The shared gallery's owner thread already follows the database
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='face-gallery-sync', daemon=True)
+        face_gallery.background_sync = True
+        self.sync()
+        self._thread.start()
+        atexit.register(self._stop.set)
+
+gallery_syncer = GallerySyncer()
+
+class TemplateCache:
+    """LRU cache of parsed face templates keyed by user id
+
+    register_face/remove_face write through to it. Changes made elsewhere
+    (PHP, manual SQL) are caught by revalidate(), which at most every
+    TEMPLATE_CACHE_REVALIDATE seconds asks the database which users changed
+    since the last check (less GALLERY_CATCH_UP_MARGIN, for rows committed late)
+    and drops entries whose face hash no longer matches.
+    """
+
+    def __init__(self, max_entries=TEMPLATE_CACHE_SIZE, revalidate_interval=TEMPLATE_CACHE_REVALIDATE):
+        self.max_entries = max(1, max_entries)
+        self.revalidate_interval = revalidate_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._last_revalidate = 0.0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(int(user_id))
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(int(user_id))
+            self.stats['hits'] += 1
+            return entry
+
+    def put(self, user_id, features, face_hash, user):
+        """Store a template; features are kept as a read-only float32 array"""
+        features = np.asarray(features, dtype=np.float32)
+        if features.flags.writeable:
+            features = features.copy()
+            features.setflags(write=False)
+        entry = {'features': features, 'hash': face_hash or '', 'user': user}
+        with self._lock:
+            self._entries[int(user_id)] = entry
+            self._entries.move_to_end(int(user_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+        return entry
+
+    def evict(self, user_id):
+        with self._lock:
+            if self._entries.pop(int(user_id), None) is not None:
+                self.stats['invalidations'] += 1
+
+    def revalidation_due(self):
+        return time.monotonic() - self._last_revalidate >= self.revalidate_interval
+
+    def revalidation_query(self):
+        """(query, params) for the rows revalidate() needs; marks the check as done"""
+        self._last_revalidate = time.monotonic()
+        if self._watermark is None:
+            return "SELECT NULL AS id, MAX(updated_at) AS updated_at FROM users", ()
+        since = self._watermark - timedelta(seconds=GALLERY_CATCH_UP_MARGIN)
+        return """
+            SELECT id, face_hash, face_registered, updated_at
+            FROM users
+            WHERE updated_at >= %s
+        """, (since.strftime('%Y-%m-%d %H:%M:%S'),)
+
+    def revalidate(self, connection):
+        """Drop entries for users whose face row changed since the last check"""
+        query, params = self.revalidation_query()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        cursor.close()
+        self.apply_revalidation(rows)
+
+    def apply_revalidation(self, rows):
+        """Evict entries for the changed rows returned by revalidation_query()"""
+        if self._watermark is None:
+            self._watermark = _as_datetime(rows[0]['updated_at']) if rows else None
+            return
+
+        for row in rows:
+            with self._lock:
+                entry = self._entries.get(int(row['id']))
+            if entry is not None and (not row['face_registered'] or (row['face_hash'] or '') != entry['hash']):
+                self.evict(row['id'])
+            updated_at = _as_datetime(row['updated_at'])
+            if updated_at is not None and updated_at > self._watermark:
+                self._watermark = updated_at
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['max_entries'] = self.max_entries
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+template_cache = TemplateCache()
+
+STORED_FACE_QUERY = """
+    SELECT id, email, first_name, last_name, face_template, face_encoding, face_hash 
+    FROM users 
+    WHERE id = %s AND face_registered = 1
+"""
+STORED_FACE_QUERY_JSON = """
+    SELECT id, email, first_name, last_name, NULL AS face_template, face_encoding, face_hash 
+    FROM users 
+    WHERE id = %s AND face_registered = 1
+"""
+
+def load_stored_face(user_id):
+    """Return (template, status) for a user's registered face
+
+    status is 'ok', 'db_error', 'not_found', 'invalid' or 'outdated' (the
+    template has an older feature schema and must be re-enrolled or
+    migrated before it can be compared). Cache hits do not
+    touch the database unless a revalidation is due.
+    """
+    if template_cache.revalidation_due():
+        with db_pool.connection() as connection:
+            if connection:
+                template_cache.revalidate(connection)
+
+    entry = template_cache.get(user_id)
+    if entry is not None:
+        return entry, 'ok'
+
+    with db_pool.connection() as connection:
+        if not connection:
+            return None, 'db_error'
+
+        with stage_seconds.time(stage='db_query'):
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute(STORED_FACE_QUERY, (user_id,))
+            user = cursor.fetchone()
+            cursor.close()
+
+    return cache_stored_face(user_id, user)
+
+def cache_stored_face(user_id, user):
+    """Parse a STORED_FACE_QUERY row into the template cache; returns (template, status)"""
+    if not user or not (user['face_template'] or user['face_encoding']):
+        return None, 'not_found'
+
+    try:
+        stored_features, stored_hash, schema = decode_stored_face(
+            user['face_template'], user['face_encoding'], user['face_hash'])
+    except Exception:
+        return None, 'invalid'
+    if not template_compatible(schema, stored_features):
+        return None, 'outdated'
+
+    profile = {
+        'id': user['id'],
+        'email': user['email'],
+        'first_name': user['first_name'],
+        'last_name': user['last_name']
+    }
+    return template_cache.put(user_id, stored_features, stored_hash, profile), 'ok'
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unmatched'
+    if 'request_start' in g:
+        request_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+REGISTER_USER_QUERY = "SELECT id, email, first_name, last_name, face_registered FROM users WHERE id = %s"
+
+REGISTER_FACE_QUERY = """
+UPDATE users 
+SET face_template = %s, face_encoding = %s, face_registered = 1, face_hash = %s 
+WHERE id = %s
+"""
+REGISTER_FACE_QUERY_JSON = """
+UPDATE users 
+SET face_encoding = %s, face_registered = 1, face_hash = %s 
+WHERE id = %s
+"""
+
+# Served by idx_users_face_hash (python face_migrate.py hash-index)
+HASH_OWNER_QUERY = """
+SELECT id FROM users
+WHERE face_hash = %s AND face_registered = 1 AND id <> %s
+LIMIT 1
+"""
+
+def face_hash_conflict(error):
+    """True when a write was refused by the UNIQUE idx_users_face_hash
+
+    That is how a registration learns that another account stored the same
+    face after its HASH_OWNER_QUERY check. Covers mysql.connector, aiomysql
+    and the sqlite stand-in, whose IntegrityError classes share only a name.
+    """
+    return type(error).__name__ == 'IntegrityError' and 'face_hash' in str(error)
+
+def find_duplicate_face(user_id, face_data, gallery=None):
+    """Another account already enrolled with this face, from the (synced) gallery
+
+    An exact hash match is a dict lookup; when DUPLICATE_THRESHOLD is set
+    the gallery is also searched for a near duplicate at that similarity.
+    Returns (owner_id, kind, similarity) or None.
+    """
+    user_id = int(user_id)
+    gallery = face_gallery if gallery is None else gallery
+    owner = gallery.hash_owner(face_data['hash'])
+    if owner is not None and owner != user_id:
+        return owner, 'exact', 1.0
+    if DUPLICATE_THRESHOLD <= 0:
+        return None
+
+    with stage_seconds.time(stage='duplicate_scan'):
+        candidates = gallery.search(face_data['features'], None, top_k=2)
+    for candidate in candidates:
+        if candidate['user_id'] != user_id and candidate['similarity'] >= DUPLICATE_THRESHOLD:
+            return candidate['user_id'], 'near', candidate['similarity']
+    return None
+
+def duplicate_face_body(user_id, duplicate):
+    """409 body for a face that is enrolled on another account (owner not disclosed)"""
+    owner, kind, similarity = duplicate
+    decisions_total.inc(endpoint='register', decision=f'duplicate_{kind}')
+    log.warning("[REGISTER] Rejected user %s: %s duplicate of user %s (similarity %.3f)",
+                user_id, kind, owner, similarity)
+    return {
+        'success': False,
+        'error': 'This face is already registered to another account.',
+        'duplicate': kind
+    }
+
+def registration_params(user_id, face_data):
+    """REGISTER_FACE_QUERY parameters for a freshly extracted face
+
+    The signature goes into the binary template; face_encoding only keeps
+    the registration metadata. Without the face_template column the
+    signature is stored in face_encoding the pre-template way.
+    """
+    face_info = {
+        'hash': face_data['hash'],
+        'registered_at': datetime.now().isoformat(),
+        'rect': face_data['rect'],
+        'image_size': face_data['image_shape'],
+        'feature_count': face_data['feature_count'],
+        'feature_schema': FEATURE_SCHEMA_VERSION
+    }
+    if not template_column:
+        face_info['signature'] = [float(value) for value in face_data['features']]
+        return json.dumps(face_info), face_data['hash'], user_id
+
+    face_info['template_version'] = TEMPLATE_FORMAT_VERSION
+    face_template = pack_face_template(face_data['features'], face_data['hash'])
+    return face_template, json.dumps(face_info), face_data['hash'], user_id
+
+def registration_succeeded(user_id, user, face_data):
+    """Publish a stored registration to the gallery and cache; returns the response body"""
+    profile = {
+        'id': int(user['id']),
+        'email': user['email'],
+        'first_name': user['first_name'],
+        'last_name': user['last_name']
+    }
+    face_gallery.upsert(user_id, face_data['features'], face_data['hash'], profile)
+    template_cache.put(user_id, face_data['features'], face_data['hash'], profile)
+    log.info("[REGISTER] ✓ Face registered for user %s", user_id)
+    log.debug("[REGISTER] Hash: %s...", face_data['hash'][:16])
+    
+    return {
+        'success': True,
+        'message': 'Face registered successfully! This face is now linked to your account only.',
+        'face_hash': face_data['hash'][:16] + '...',
+        'features': face_data['feature_count'],
+        'user_id': user_id,
+        'user_email': user['email'],
+        'security_note': 'Only this specific face will work for your account.'
+    }
+
 @app.route('/api/face/register', methods=['POST'])
+@admitted('register')
 def register_face():
     """Register user's face - ONE FACE PER USER ONLY"""
     try:
-        print(f"\n{'='*50}")
-        print("📝 FACE REGISTRATION REQUEST")
-        print(f"{'='*50}")
+        log.debug("=" * 50)
+        log.debug("📝 FACE REGISTRATION REQUEST")
+        log.debug("=" * 50)
         
-        data = request.json
+        data, image_bytes = read_face_request()
         user_id = data.get('user_id')
-        image_base64 = data.get('image')
         
-        if not user_id or not image_base64:
+        if not user_id or image_bytes == b'':
             return jsonify({
                 'success': False,
                 'error': 'Missing user_id or image'
             }), 400
         
-        # Convert base64 to image
-        img = base64_to_image(image_base64)
-        if img is None:
+        parsed_id = parse_user_id(user_id)
+        if parsed_id is None:
             return jsonify({
                 'success': False,
-                'error': 'Invalid image format'
+                'error': f'User ID {user_id} not found'
+            }), 404
+        user_id = parsed_id
+        
+        # Decode, detect exactly ONE face, validate quality and extract its signature
+        face_data = process_face_image(image_bytes, check_quality=True)
+        if face_data['status'] == 'invalid_image':
+            return jsonify({
+                'success': False,
+                'error': face_data.get('message', 'Invalid image format')
             }), 400
         
-        print(f"[REGISTER] Image: {img.shape}, User: {user_id}")
+        log.debug("[REGISTER] Image: %s, User: %s", tuple(face_data['image_shape']), user_id)
         
-        # Detect exactly ONE face
-        face_rect = detect_face(img)
-        if face_rect is None:
+        if face_data['status'] == 'no_face':
             return jsonify({
                 'success': False,
                 'error': 'Could not detect a clear face. Ensure: 1. Only one person in frame, 2. Good lighting, 3. Face clearly visible'
             }), 400
         
-        # Validate face quality
-        quality_ok, quality_msg = validate_face_quality(img, face_rect)
-        if not quality_ok:
+        if face_data['status'] == 'low_quality':
             return jsonify({
                 'success': False,
-                'error': quality_msg
+                'error': face_data['message']
             }), 400
         
-        # Extract face signature
-        face_data = extract_face_signature(img, face_rect)
-        if face_data is None:
+        if face_data['status'] != 'ok':
             return jsonify({
                 'success': False,
                 'error': 'Failed to extract face features'
             }), 400
         
-        print(f"[REGISTER] Face signature: {face_data['feature_count']} features")
-        print(f"[REGISTER] Face hash: {face_data['hash'][:16]}...")
+        log.debug("[REGISTER] Face signature: %s features", face_data['feature_count'])
+        log.debug("[REGISTER] Face hash: %s...", face_data['hash'][:16])
         
         # Check if user already has a face registered
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({
-                'success': False,
-                'error': 'Database connection failed'
-            }), 500
-        
-        cursor = connection.cursor(dictionary=True)
-        
-        # Get user info
-        cursor.execute("SELECT id, email, face_registered FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        
-        if user is None:
+        with db_pool.connection() as connection:
+            if not connection:
+                return jsonify({
+                    'success': False,
+                    'error': 'Database connection failed'
+                }), 500
+            
+            cursor = connection.cursor(dictionary=True)
+            
+            # Get user info
+            with stage_seconds.time(stage='db_query'):
+                cursor.execute(REGISTER_USER_QUERY, (user_id,))
+                user = cursor.fetchone()
+            
+            if user is None:
+                cursor.close()
+                return jsonify({
+                    'success': False,
+                    'error': f'User ID {user_id} not found'
+                }), 404
+            
+            if user['face_registered']:
+                cursor.close()
+                return jsonify({
+                    'success': False,
+                    'error': 'User already has a face registered. Remove existing registration first.'
+                }), 400
+            
+            # One face per user also means one user per face
+            with stage_seconds.time(stage='gallery_sync'):
+                face_gallery.sync(connection)
+            duplicate = find_duplicate_face(user_id, face_data)
+            if duplicate is None:
+                # Catches enrolments by other workers the gallery has not synced yet
+                with stage_seconds.time(stage='db_query'):
+                    cursor.execute(HASH_OWNER_QUERY, (face_data['hash'], user_id))
+                    owner = cursor.fetchone()
+                if owner is not None:
+                    duplicate = (owner['id'], 'exact', 1.0)
+            if duplicate is not None:
+                cursor.close()
+                return jsonify(duplicate_face_body(user_id, duplicate)), 409
+            
+            # Store in database
+            with stage_seconds.time(stage='db_write'):
+                try:
+                    cursor.execute(REGISTER_FACE_QUERY, registration_params(user_id, face_data))
+                    connection.commit()
+                except Exception as e:
+                    if not face_hash_conflict(e):
+                        raise
+                    # Another account stored this face after the check above
+                    connection.rollback()
+                    cursor.execute(HASH_OWNER_QUERY, (face_data['hash'], user_id))
+                    owner = cursor.fetchone()
+                    cursor.close()
+                    duplicate = (owner['id'] if owner else None, 'exact', 1.0)
+                    return jsonify(duplicate_face_body(user_id, duplicate)), 409
+            
+            affected = cursor.rowcount
             cursor.close()
-            connection.close()
-            return jsonify({
-                'success': False,
-                'error': f'User ID {user_id} not found'
-            }), 404
         
-        if user['face_registered']:
-            cursor.close()
-            connection.close()
+        if affected > 0:
+            return jsonify(registration_succeeded(user_id, user, face_data))
+        else:
             return jsonify({
                 'success': False,
-                'error': 'User already has a face registered. Remove existing registration first.'
-            }), 400
-        
-        # Prepare face data for storage
-        face_info = {
-            'signature': face_data['features'],
-            'hash': face_data['hash'],
-            'registered_at': datetime.now().isoformat(),
-            'rect': face_data['rect'],
-            'image_size': img.shape,
-            'feature_count': face_data['feature_count']
+                'error': 'Failed to update database'
+            }), 500
+            
+    except PipelineBusy:
+        return pipeline_busy_response()
+    except PayloadTooLarge:
+        return payload_too_large_response()
+    except Exception as e:
+        log.exception("[REGISTER ERROR] %s", e)
+        return jsonify({
+            'success': False,
+            'error': f'Registration failed: {str(e)}'
+        }), 500
+
+FACE_LOGIN_QUERY = """
+UPDATE users 
+SET last_face_login = %s 
+WHERE id = %s
+"""
+
+class LoginWriter:
+    """Write-behind queue for last_face_login updates
+
+    A successful login only records (user_id, time) here and returns; a
+    background thread flushes the pending updates every FACE_LOGIN_WRITE_INTERVAL
+    seconds, or as soon as FACE_LOGIN_WRITE_BATCH users are pending, with
+    executemany in one transaction per batch. Logins of the same user
+    between flushes coalesce into a single UPDATE carrying the latest
+    time. A failed flush puts its updates back for the next attempt, and
+    stop() (registered with atexit) flushes whatever is left.
+
+    Times are taken when the login happens, in the server's local time,
+    which is what NOW() stored before on a server sharing the database's
+    time zone.
+    """
+
+    def __init__(self, batch_size=LOGIN_WRITE_BATCH, interval=LOGIN_WRITE_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.stats = {'recorded': 0, 'coalesced': 0, 'written': 0, 'batches': 0, 'failures': 0}
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name='face-login-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def record(self, user_id):
+        """Queue a last_face_login update; never touches the database"""
+        if self._thread is None:
+            self.start()
+        login_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self.stats['recorded'] += 1
+            if int(user_id) in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[int(user_id)] = login_time
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every pending update now; returns the number written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        start = time.perf_counter()
+        updates = [(login_time, user_id) for user_id, login_time in pending.items()]
+        written = 0
+        with db_pool.connection() as connection:
+            try:
+                if not connection:
+                    raise RuntimeError('Database connection failed')
+                cursor = connection.cursor()
+                for offset in range(0, len(updates), self.batch_size):
+                    cursor.executemany(FACE_LOGIN_QUERY, updates[offset:offset + self.batch_size])
+                    connection.commit()
+                    written += len(updates[offset:offset + self.batch_size])
+                    with self._lock:
+                        self.stats['batches'] += 1
+                cursor.close()
+            except Exception as e:
+                if connection:
+                    connection.rollback()
+                self._requeue(updates[written:])
+                log.warning("[LOGIN WRITER] Flush failed, %d updates kept for retry: %s",
+                            len(updates) - written, e)
+
+        with self._lock:
+            self.stats['written'] += written
+            if written < len(updates):
+                self.stats['failures'] += 1
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+        stage_seconds.observe(self.last_flush_ms / 1000, stage='login_flush')
+        return written
+
+    def _requeue(self, updates):
+        """Put unwritten updates back unless a newer login arrived meanwhile"""
+        with self._lock:
+            for login_time, user_id in updates:
+                if login_time > self._pending.get(user_id, ''):
+                    self._pending[user_id] = login_time
+
+    def stop(self, timeout=10):
+        """Stop the writer thread and flush what is left"""
+        thread = self._thread
+        if thread is not None:
+            self._stopping = True
+            self._wake.set()
+            thread.join(timeout)
+            self._thread = None
+        return self.flush()
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+        stats.update({
+            'batch_size': self.batch_size,
+            'interval_s': self.interval,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        })
+        return stats
+
+login_writer = LoginWriter()
+
+def outdated_template_body(decision_field):
+    """Body for a stored template whose feature schema no longer matches the extractor"""
+    return {
+        'success': True,
+        decision_field: False,
+        'reenroll_required': True,
+        'message': 'Registered face was saved in an older format. Please register your face again.'
+    }
+
+def verify_against(user_id, input_face, stored_face):
+    """Strict 1:1 decision for verify_face; returns the response body"""
+    user = stored_face['user']
+    stored_features = stored_face['features']
+    stored_hash = stored_face['hash']
+    
+    # STRICT VERIFICATION: Compare ONLY with the specified user's face
+    log.debug("[VERIFY] Comparing with user %s's registered face...", user_id)
+    
+    # Method 1: Hash comparison (exact match)
+    hash_match = input_face['hash'] == stored_hash
+    if hash_match:
+        similarity = 1.0
+        log.debug("[VERIFY] ✓ Exact hash match!")
+    else:
+        # Method 2: Feature similarity
+        with stage_seconds.time(stage='similarity'):
+            similarity = calculate_similarity(input_face['features'], stored_features)
+        log.debug("[VERIFY] Feature similarity: %.3f", similarity)
+    
+    # STRICT thresholds
+    if hash_match:
+        THRESHOLD = 0.99  # Hash match is perfect
+    else:
+        THRESHOLD = VERIFY_THRESHOLD  # Very high threshold for features
+    
+    log.info("[VERIFY] User %s, similarity: %.3f, threshold: %s", user_id, similarity, THRESHOLD)
+    record_decision('verify', similarity >= THRESHOLD, similarity)
+    
+    if similarity >= THRESHOLD:
+        return {
+            'success': True,
+            'authenticated': True,
+            'user': {
+                'id': user['id'],
+                'email': user['email'],
+                'first_name': user['first_name'],
+                'last_name': user['last_name']
+            },
+            'similarity': float(similarity),
+            'hash_match': hash_match,
+            'method': 'hash' if hash_match else 'features',
+            'message': 'Face verified successfully!',
+            'security': 'Strict user-specific verification passed'
+        }
+    else:
+        return {
+            'success': True,
+            'authenticated': False,
+            'message': 'Face does not match the registered face for this account.',
+            'similarity': float(similarity),
+            'threshold': THRESHOLD,
+            'security': 'Face rejected - not matching user account'
         }
-        
-        face_json = json.dumps(face_info)
-        
-        # Store in database
-        update_query = """
-        UPDATE users 
-        SET face_encoding = %s, face_registered = 1, face_hash = %s 
-        WHERE id = %s
-        """
-        cursor.execute(update_query, (face_json, face_data['hash'], user_id))
-        connection.commit()
-        
-        affected = cursor.rowcount
-        cursor.close()
-        connection.close()
-        
-        if affected > 0:
-            print(f"[REGISTER] ✓ Face registered for user {user_id}")
-            print(f"[REGISTER] Hash: {face_data['hash'][:16]}...")
-            
-            return jsonify({
-                'success': True,
-                'message': 'Face registered successfully! This face is now linked to your account only.',
-                'face_hash': face_data['hash'][:16] + '...',
-                'features': face_data['feature_count'],
-                'user_id': user_id,
-                'user_email': user['email'],
-                'security_note': 'Only this specific face will work for your account.'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': 'Failed to update database'
-            }), 500
-            
-    except Exception as e:
-        print(f"[REGISTER ERROR] {str(e)}")
-        traceback.print_exc()
-        return jsonify({
-            'success': False,
-            'error': f'Registration failed: {str(e)}'
-        }), 500
 
 @app.route('/api/face/verify', methods=['POST'])
+@admitted('verify')
 def verify_face():
     """Verify face for a specific user - STRICT MATCHING"""
     try:
-        print(f"\n{'='*50}")
-        print("🔍 FACE VERIFICATION REQUEST")
-        print(f"{'='*50}")
+        log.debug("=" * 50)
+        log.debug("🔍 FACE VERIFICATION REQUEST")
+        log.debug("=" * 50)
         
-        data = request.json
+        data, image_bytes = read_face_request()
         user_id = data.get('user_id')  # User ID is REQUIRED for verification
-        image_base64 = data.get('image')
         
-        if not user_id or not image_base64:
+        if not user_id or image_bytes == b'':
             return jsonify({
                 'success': False,
                 'error': 'Missing user_id or image'
             }), 400
         
-        # Convert base64 to image
-        img = base64_to_image(image_base64)
-        if img is None:
+        user_id = parse_user_id(user_id)
+        if user_id is None:
+            body, code = stored_face_unavailable('not_found', 'authenticated')
+            return jsonify(body), code
+        
+        # Decode, detect and extract the face
+        input_face = process_face_image(image_bytes, reduce=DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
             return jsonify({
                 'success': False,
-                'error': 'Invalid image format'
+                'error': input_face.get('message', 'Invalid image format')
             }), 400
         
-        print(f"[VERIFY] Image: {img.shape}, User: {user_id}")
+        log.debug("[VERIFY] Image: %s, User: %s", tuple(input_face['image_shape']), user_id)
         
-        # Detect face
-        face_rect = detect_face(img)
-        if face_rect is None:
+        if input_face['status'] == 'no_face':
             return jsonify({
                 'success': True,
                 'authenticated': False,
                 'message': 'No clear face detected'
             })
         
-        # Extract face signature
-        input_face = extract_face_signature(img, face_rect)
-        if input_face is None:
+        if input_face['status'] != 'ok':
             return jsonify({
                 'success': True,
                 'authenticated': False,
                 'message': 'Failed to process face'
             })
         
-        print(f"[VERIFY] Input features: {input_face['feature_count']}")
-        print(f"[VERIFY] Input hash: {input_face['hash'][:16]}...")
+        log.debug("[VERIFY] Input features: %s", input_face['feature_count'])
+        log.debug("[VERIFY] Input hash: %s...", input_face['hash'][:16])
         
         # Get ONLY the specified user's face data
-        connection = get_db_connection()
-        if not connection:
+        stored_face, status = load_stored_face(user_id)
+        if status == 'db_error':
             return jsonify({
                 'success': False,
                 'error': 'Database connection failed'
             }), 500
         
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT id, email, first_name, last_name, face_encoding, face_hash 
-            FROM users 
-            WHERE id = %s AND face_registered = 1
-        """, (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
-        
-        if not user:
+        if status == 'not_found':
             return jsonify({
                 'success': True,
                 'authenticated': False,
                 'message': 'User not found or no face registered'
             })
         
-        # Parse stored face data
-        try:
-            stored_data = json.loads(user['face_encoding'])
-            stored_features = stored_data['signature']
-            stored_hash = stored_data.get('hash', '')
-        except:
+        if status == 'invalid':
             return jsonify({
                 'success': True,
                 'authenticated': False,
                 'message': 'Invalid face data for user'
             })
         
-        # STRICT VERIFICATION: Compare ONLY with the specified user's face
-        print(f"[VERIFY] Comparing with user {user_id}'s registered face...")
+        if status == 'outdated':
+            return jsonify(outdated_template_body('authenticated'))
         
-        # Method 1: Hash comparison (exact match)
-        hash_match = input_face['hash'] == stored_hash
-        if hash_match:
-            similarity = 1.0
-            print(f"[VERIFY] ✓ Exact hash match!")
-        else:
-            # Method 2: Feature similarity
-            similarity = calculate_similarity(input_face['features'], stored_features)
-            print(f"[VERIFY] Feature similarity: {similarity:.3f}")
-        
-        # STRICT thresholds
-        if hash_match:
-            THRESHOLD = 0.99  # Hash match is perfect
-        else:
-            THRESHOLD = 0.60  # Very high threshold for features
+        result = verify_against(user_id, input_face, stored_face)
         
-        print(f"[VERIFY] Threshold: {THRESHOLD}")
-        print(f"[VERIFY] Similarity: {similarity:.3f}")
+        if result['authenticated']:
+            # Update last face login (written in the background)
+            login_writer.record(user_id)
         
-        if similarity >= THRESHOLD:
-            # Update last face login
-            connection = get_db_connection()
-            if connection:
-                cursor = connection.cursor()
-                cursor.execute("""
-                    UPDATE users 
-                    SET last_face_login = NOW() 
-                    WHERE id = %s
-                """, (user_id,))
-                connection.commit()
-                cursor.close()
-                connection.close()
+        return jsonify(result)
             
-            return jsonify({
-                'success': True,
-                'authenticated': True,
-                'user': {
-                    'id': user['id'],
-                    'email': user['email'],
-                    'first_name': user['first_name'],
-                    'last_name': user['last_name']
-                },
-                'similarity': float(similarity),
-                'hash_match': hash_match,
-                'method': 'hash' if hash_match else 'features',
-                'message': 'Face verified successfully!',
-                'security': 'Strict user-specific verification passed'
-            })
+    except PipelineBusy:
+        return pipeline_busy_response()
+    except PayloadTooLarge:
+        return payload_too_large_response()
+    except Exception as e:
+        log.exception("[VERIFY ERROR] %s", e)
+        return jsonify({
+            'success': False,
+            'error': f'Verification failed: {str(e)}'
+        }), 500
+
+def track_face(gray, previous_patch, rect):
+    """Find a face again near its last position; returns (rect, score)
+
+    previous_patch is the face from the last frame, already shrunk by
+    shrink_face_patch. The search window (the old rect grown by half its
+    size on each side) is shrunk by the same factor and matched with
+    normalized cross-correlation, which costs a small fraction of a full
+    detectMultiScale pass. The rect keeps its size.
+    """
+    x, y, w, h = (int(v) for v in rect)
+    img_h, img_w = gray.shape[:2]
+    x0, y0 = max(0, x - w // 2), max(0, y - h // 2)
+    x1, y1 = min(img_w, x + w + w // 2), min(img_h, y + h + h // 2)
+    scale = previous_patch.shape[1] / w
+    window = cv2.resize(gray[y0:y1, x0:x1], None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if window.shape[0] < previous_patch.shape[0] or window.shape[1] < previous_patch.shape[1]:
+        return None, 0.0
+
+    scores = cv2.matchTemplate(window, previous_patch, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+    nx = min(max(0, x0 + int(round(dx / scale))), img_w - w)
+    ny = min(max(0, y0 + int(round(dy / scale))), img_h - h)
+    return np.array([nx, ny, w, h], dtype=np.int32), float(score)
+
+def shrink_face_patch(gray, rect):
+    x, y, w, h = (int(v) for v in rect)
+    scale = TRACK_PATCH_SIZE / max(w, h)
+    size = (max(8, int(round(w * scale))), max(8, int(round(h * scale))))
+    return cv2.resize(gray[y:y+h, x:x+w], size, interpolation=cv2.INTER_AREA)
+
+class VerifySession:
+    """One streaming verification: frames of one user pushed one at a time
+
+    The stored template is loaded once when the session starts. Every
+    frame goes through process_face_image like /api/face/verify; the face
+    is found with full detection on keyframes (the first frame, every STREAM_KEYFRAME_INTERVAL
+    frames, and whenever tracking loses it) and tracked in between. Each
+    frame's similarity is kept and the session accepts as soon as the mean
+    of its best STREAM_FUSE_FRAMES scores reaches VERIFY_THRESHOLD (or a
+    frame matches the stored hash exactly), so one blurred or turned-away
+    frame no longer costs a whole new attempt. It rejects after
+    STREAM_MAX_FRAMES frames.
+    """
+
+    def __init__(self, session_id, user_id, stored_face, ttl=STREAM_SESSION_TTL):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.stored_face = stored_face
+        self.expires = time.monotonic() + ttl
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.scores = []
+        self.detections = 0
+        self.decided = False
+        self.authenticated = False
+        self._track = None
+        self._since_keyframe = 0
+
+    def expired(self, now=None):
+        return (now or time.monotonic()) >= self.expires
+
+    def confidence(self):
+        best = sorted(self.scores, reverse=True)[:max(1, STREAM_FUSE_FRAMES)]
+        return float(np.mean(best)) if best else 0.0
+
+    def push(self, image_bytes):
+        """add_frame under the session lock; None once the session is decided"""
+        with self.lock:
+            if self.decided:
+                return None
+            return self.add_frame(image_bytes)
+
+    def add_frame(self, image_bytes):
+        """Process one frame; returns the response body
+
+        Raises PipelineBusy (without counting the frame) when no CV worker
+        slot frees up.
+        """
+        keyframe = self._track is None or self._since_keyframe >= STREAM_KEYFRAME_INTERVAL
+        face = process_face_image(image_bytes or None, reduce=DECODE_REDUCED,
+                                  track={} if keyframe else self._track)
+        self.frames += 1
+        body = {'success': True, 'session_id': self.session_id, 'frame': self.frames}
+        if 'tracked' not in face:
+            body['frame_status'] = face['status']
+            return self._decide(body, hash_match=False)
+
+        body['tracked'] = face['tracked']
+        if face['tracked']:
+            self._since_keyframe += 1
         else:
+            self.detections += 1
+            self._since_keyframe = 1
+        self._track = face.get('track')
+        if face['status'] != 'ok':
+            body['frame_status'] = face['status']
+            return self._decide(body, hash_match=False)
+
+        hash_match = face['hash'] == self.stored_face['hash']
+        with stage_seconds.time(stage='similarity'):
+            similarity = 1.0 if hash_match else calculate_similarity(face['features'], self.stored_face['features'])
+        self.scores.append(similarity)
+        body['frame_status'] = 'ok'
+        body['similarity'] = float(similarity)
+        return self._decide(body, hash_match)
+
+    def _decide(self, body, hash_match):
+        confidence = 1.0 if hash_match else self.confidence()
+        self.authenticated = confidence >= VERIFY_THRESHOLD
+        self.decided = self.authenticated or self.frames >= STREAM_MAX_FRAMES
+        body.update({
+            'confidence': confidence,
+            'threshold': VERIFY_THRESHOLD,
+            'decided': self.decided,
+            'authenticated': self.authenticated,
+            'frames_left': max(0, STREAM_MAX_FRAMES - self.frames),
+            'detections': self.detections
+        })
+        if self.decided:
+            record_decision('verify_stream', self.authenticated, confidence)
+            log.info("[STREAM] User %s, %s after %d frames (%d detections), confidence: %.3f",
+                     self.user_id, 'accepted' if self.authenticated else 'rejected',
+                     self.frames, self.detections, confidence)
+        if self.authenticated:
+            user = self.stored_face['user']
+            body['user'] = {key: user[key] for key in ('id', 'email', 'first_name', 'last_name')}
+            body['message'] = 'Face verified successfully!'
+        elif self.decided:
+            body['message'] = 'Face does not match the registered face for this account.'
+        return body
+
+class StreamSessions:
+    """Open VerifySessions by id, dropped once decided or STREAM_SESSION_TTL old"""
+
+    def __init__(self, max_sessions=STREAM_MAX_SESSIONS, ttl=STREAM_SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.stats = {'started': 0, 'accepted': 0, 'rejected': 0, 'abandoned': 0, 'expired': 0, 'refused': 0}
+
+    def _prune(self, now):
+        for session_id in [sid for sid, session in self._sessions.items() if session.expired(now)]:
+            del self._sessions[session_id]
+            self.stats['expired'] += 1
+
+    def start(self, user_id, stored_face):
+        """A new session, or None when STREAM_MAX_SESSIONS are already open"""
+        with self._lock:
+            self._prune(time.monotonic())
+            if len(self._sessions) >= self.max_sessions:
+                self.stats['refused'] += 1
+                return None
+            session = VerifySession(secrets.token_urlsafe(16), user_id, stored_face, self.ttl)
+            self._sessions[session.session_id] = session
+            self.stats['started'] += 1
+            return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.expired():
+                del self._sessions[session_id]
+                self.stats['expired'] += 1
+                return None
+            return session
+
+    def finish(self, session):
+        with self._lock:
+            if self._sessions.pop(session.session_id, None) is not None:
+                outcome = 'accepted' if session.authenticated else 'rejected' if session.decided else 'abandoned'
+                self.stats[outcome] += 1
+
+    def status(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open'] = len(self._sessions)
+        stats['max_sessions'] = self.max_sessions
+        return stats
+
+stream_sessions = StreamSessions()
+
+def parse_user_id(value):
+    """A request's user_id as an int, or None when it cannot name a user row"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isascii() and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+def stored_face_unavailable(status, decision_field):
+    """(body, http status) when load_stored_face did not return a usable template"""
+    if status == 'db_error':
+        return {'success': False, 'error': 'Database connection failed'}, 500
+    if status == 'outdated':
+        return outdated_template_body(decision_field), 200
+    message = 'Invalid face data for user' if status == 'invalid' else 'User not found or no face registered'
+    return {'success': True, decision_field: False, 'message': message}, 200
+
+def stream_session_started(session):
+    return {
+        'success': True,
+        'session_id': session.session_id,
+        'max_frames': STREAM_MAX_FRAMES,
+        'expires_in': STREAM_SESSION_TTL,
+        'threshold': VERIFY_THRESHOLD
+    }
+
+def stream_sessions_full_response():
+    return jsonify({
+        'success': False,
+        'error': 'Too many verification sessions in progress, try again shortly'
+    }), 503, {'Retry-After': '1'}
+
+UNKNOWN_SESSION_BODY = {
+    'success': False,
+    'error': 'Unknown or expired verification session'
+}
+
+def unknown_session_response():
+    return jsonify(UNKNOWN_SESSION_BODY), 404
+
+@app.route('/api/face/verify/stream', methods=['POST'])
+@admitted('verify')
+def start_verify_stream():
+    """Open a streaming verification session for one user
+
+    The client then posts frames to /api/face/verify/stream/<session_id>
+    (over the same keep-alive connection) until a response says decided.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form or request.args
+        user_id = data.get('user_id')
+        if not user_id:
             return jsonify({
-                'success': True,
-                'authenticated': False,
-                'message': 'Face does not match the registered face for this account.',
-                'similarity': float(similarity),
-                'threshold': THRESHOLD,
-                'security': 'Face rejected - not matching user account'
-            })
-            
+                'success': False,
+                'error': 'Missing user_id'
+            }), 400
+
+        user_id = parse_user_id(user_id)
+        stored_face, status = load_stored_face(user_id) if user_id is not None else (None, 'not_found')
+        if status != 'ok':
+            body, code = stored_face_unavailable(status, 'authenticated')
+            return jsonify(body), code
+
+        session = stream_sessions.start(user_id, stored_face)
+        if session is None:
+            return stream_sessions_full_response()
+        return jsonify(stream_session_started(session))
+
+    except Exception as e:
+        log.exception("[STREAM ERROR] %s", e)
+        return jsonify({
+            'success': False,
+            'error': f'Verification failed: {str(e)}'
+        }), 500
+
+@app.route('/api/face/verify/stream/<session_id>', methods=['POST'])
+@admitted('verify')
+def verify_stream_frame(session_id):
+    """Add one frame to a streaming verification session"""
+    try:
+        session = stream_sessions.get(session_id)
+        if session is None:
+            return unknown_session_response()
+
+        _, image_bytes = read_face_request()
+        if image_bytes == b'':
+            return jsonify({
+                'success': False,
+                'error': 'No image provided'
+            }), 400
+
+        body = session.push(image_bytes)
+        if body is None:
+            return unknown_session_response()
+        if session.decided:
+            stream_sessions.finish(session)
+            if session.authenticated:
+                login_writer.record(session.user_id)
+        return jsonify(body)
+
+    except PipelineBusy:
+        return pipeline_busy_response()
+    except PayloadTooLarge:
+        return payload_too_large_response()
     except Exception as e:
-        print(f"[VERIFY ERROR] {str(e)}")
-        traceback.print_exc()
+        log.exception("[STREAM ERROR] %s", e)
         return jsonify({
             'success': False,
             'error': f'Verification failed: {str(e)}'
         }), 500
 
+CHECK_FACE_QUERY = """
+SELECT id, email, face_registered, last_face_login, face_hash 
+FROM users 
+WHERE id = %s
+"""
+
+def registration_status(user):
+    return {
+        'success': True,
+        'registered': bool(user['face_registered']),
+        'email': user['email'],
+        'face_hash': user['face_hash'][:16] + '...' if user['face_hash'] else None,
+        'last_face_login': user['last_face_login']
+    }
+
 @app.route('/api/face/check/<int:user_id>', methods=['GET'])
 def check_face_registered(user_id):
     """Check if user has registered face"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({
-                'success': False,
-                'error': 'Database connection failed'
-            }), 500
-        
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT id, email, face_registered, last_face_login, face_hash 
-            FROM users 
-            WHERE id = %s
-        """, (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        with db_pool.connection() as connection:
+            if not connection:
+                return jsonify({
+                    'success': False,
+                    'error': 'Database connection failed'
+                }), 500
+            
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute(CHECK_FACE_QUERY, (user_id,))
+            user = cursor.fetchone()
+            cursor.close()
         
         if user:
-            return jsonify({
-                'success': True,
-                'registered': bool(user['face_registered']),
-                'email': user['email'],
-                'face_hash': user['face_hash'][:16] + '...' if user['face_hash'] else None,
-                'last_face_login': user['last_face_login']
-            })
+            return jsonify(registration_status(user))
         else:
             return jsonify({
                 'success': False,
@@ -555,29 +3251,91 @@ def check_face_registered(user_id):
             'error': str(e)
         }), 500
 
+REMOVE_FACE_QUERY = """
+UPDATE users 
+SET face_template = NULL, face_encoding = NULL, face_registered = 0, face_hash = NULL 
+WHERE id = %s
+"""
+REMOVE_FACE_QUERY_JSON = """
+UPDATE users 
+SET face_encoding = NULL, face_registered = 0, face_hash = NULL 
+WHERE id = %s
+"""
+
+# users.face_template is added by `python face_migrate.py templates`, which should run
+# before this version is deployed. A server started without the column notices it at
+# boot (check_template_column) and keeps storing signatures as JSON in face_encoding,
+# as legacy rows do; restart it once the migration has run.
+template_column = True
+
+FACE_QUERIES = {
+    True: (STORED_FACE_QUERY, REGISTER_FACE_QUERY, REMOVE_FACE_QUERY,
+           FaceGallery.LOAD_QUERY, FaceGallery.CATCH_UP_QUERY),
+    False: (STORED_FACE_QUERY_JSON, REGISTER_FACE_QUERY_JSON, REMOVE_FACE_QUERY_JSON,
+            FaceGallery.LOAD_QUERY_JSON, FaceGallery.CATCH_UP_QUERY_JSON)
+}
+
+def template_column_query():
+    """(query, params) counting the users.face_template column (1 or 0)"""
+    if DB_STANDIN_PATH:
+        return "SELECT COUNT(*) FROM pragma_table_info('users') WHERE name = %s", ('face_template',)
+    return """
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'users' AND column_name = %s
+    """, ('face_template',)
+
+def use_template_column(present):
+    """Point the face queries at users.face_template, or at their JSON-only variants"""
+    global template_column, STORED_FACE_QUERY, REGISTER_FACE_QUERY, REMOVE_FACE_QUERY
+    template_column = bool(present)
+    (STORED_FACE_QUERY, REGISTER_FACE_QUERY, REMOVE_FACE_QUERY,
+     face_gallery.LOAD_QUERY, face_gallery.CATCH_UP_QUERY) = FACE_QUERIES[template_column]
+    if not template_column:
+        log.warning("[DB] users.face_template is missing; storing JSON signatures until "
+                    "`python face_migrate.py templates` has run and the server restarts")
+
+def check_template_column():
+    """Detect users.face_template at boot; keeps the current queries if the database is down
+
+    `python face_auth_secure.py`, the async lifespan and the command line
+    tools call it; gunicorn deployments call it from a post_fork hook
+    before load_gallery_snapshot().
+    """
+    with db_pool.connection() as connection:
+        if not connection:
+            return template_column
+        try:
+            query, params = template_column_query()
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            present = cursor.fetchone()[0] > 0
+            cursor.close()
+        except Exception as e:
+            log.warning("[DB] Could not check for users.face_template: %s", e)
+            return template_column
+    use_template_column(present)
+    return present
+
 @app.route('/api/face/remove/<int:user_id>', methods=['DELETE'])
 def remove_face(user_id):
     """Remove user's face registration"""
     try:
-        connection = get_db_connection()
-        if not connection:
-            return jsonify({
-                'success': False,
-                'error': 'Database connection failed'
-            }), 500
-        
-        cursor = connection.cursor()
-        cursor.execute("""
-            UPDATE users 
-            SET face_encoding = NULL, face_registered = 0, face_hash = NULL 
-            WHERE id = %s
-        """, (user_id,))
-        connection.commit()
-        affected = cursor.rowcount
-        cursor.close()
-        connection.close()
+        with db_pool.connection() as connection:
+            if not connection:
+                return jsonify({
+                    'success': False,
+                    'error': 'Database connection failed'
+                }), 500
+            
+            cursor = connection.cursor()
+            cursor.execute(REMOVE_FACE_QUERY, (user_id,))
+            connection.commit()
+            affected = cursor.rowcount
+            cursor.close()
         
         if affected > 0:
+            face_gallery.remove(user_id)
+            template_cache.evict(user_id)
             return jsonify({
                 'success': True,
                 'message': 'Face registration removed'
@@ -594,36 +3352,55 @@ def remove_face(user_id):
             'error': str(e)
         }), 500
 
+def test_against(user_id, input_face, stored_face):
+    """1:1 comparison for test_face_against_user; returns the response body"""
+    stored_hash = stored_face['hash']
+    
+    # Compare
+    hash_match = input_face['hash'] == stored_hash
+    with stage_seconds.time(stage='similarity'):
+        similarity = calculate_similarity(input_face['features'], stored_face['features'])
+    record_decision('test', similarity >= 0.85 or hash_match, similarity)
+    
+    return {
+        'success': True,
+        'user_id': user_id,
+        'hash_match': hash_match,
+        'similarity': float(similarity),
+        'input_hash': input_face['hash'][:16] + '...',
+        'stored_hash': stored_hash[:16] + '...' if stored_hash else 'None',
+        'match': similarity >= 0.85 or hash_match,
+        'threshold': 0.85
+    }
+
 @app.route('/api/face/test/<int:user_id>', methods=['POST'])
+@admitted('test')
 def test_face_against_user(user_id):
     """Test if a face matches a specific user (for debugging)"""
     try:
-        data = request.json
-        image_base64 = data.get('image')
+        data, image_bytes = read_face_request()
         
-        if not image_base64:
+        if image_bytes == b'':
             return jsonify({
                 'success': False,
                 'error': 'No image provided'
             }), 400
         
-        img = base64_to_image(image_base64)
-        if img is None:
+        input_face = process_face_image(image_bytes, reduce=DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
             return jsonify({
                 'success': False,
-                'error': 'Invalid image format'
+                'error': input_face.get('message', 'Invalid image format')
             }), 400
         
-        face_rect = detect_face(img)
-        if face_rect is None:
+        if input_face['status'] == 'no_face':
             return jsonify({
                 'success': True,
                 'match': False,
                 'reason': 'No face detected'
             })
         
-        input_face = extract_face_signature(img, face_rect)
-        if input_face is None:
+        if input_face['status'] != 'ok':
             return jsonify({
                 'success': True,
                 'match': False,
@@ -631,94 +3408,298 @@ def test_face_against_user(user_id):
             })
         
         # Get user's face
-        connection = get_db_connection()
-        if not connection:
+        stored_face, status = load_stored_face(user_id)
+        if status == 'db_error':
             return jsonify({
                 'success': False,
                 'error': 'Database connection failed'
             }), 500
         
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT face_encoding, face_hash FROM users WHERE id = %s
-        """, (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        connection.close()
-        
-        if not user or not user['face_encoding']:
+        if status == 'not_found':
             return jsonify({
                 'success': True,
                 'match': False,
                 'reason': 'User has no registered face'
             })
         
-        stored_data = json.loads(user['face_encoding'])
-        stored_hash = stored_data.get('hash', '')
+        if status == 'invalid':
+            return jsonify({
+                'success': False,
+                'error': 'Invalid face data for user'
+            }), 500
         
-        # Compare
-        hash_match = input_face['hash'] == stored_hash
-        similarity = calculate_similarity(input_face['features'], stored_data['signature'])
+        if status == 'outdated':
+            return jsonify(outdated_template_body('match'))
         
-        return jsonify({
-            'success': True,
-            'user_id': user_id,
-            'hash_match': hash_match,
-            'similarity': float(similarity),
-            'input_hash': input_face['hash'][:16] + '...',
-            'stored_hash': stored_hash[:16] + '...' if stored_hash else 'None',
-            'match': similarity >= 0.85 or hash_match,
-            'threshold': 0.85
-        })
+        return jsonify(test_against(user_id, input_face, stored_face))
         
+    except PipelineBusy:
+        return pipeline_busy_response()
+    except PayloadTooLarge:
+        return payload_too_large_response()
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
+def identify_top_k(data):
     try:
-        connection = get_db_connection()
-        db_connected = False
-        db_version = "unknown"
-        
-        if connection and connection.is_connected():
-            cursor = connection.cursor()
-            cursor.execute("SELECT VERSION()")
-            db_version = cursor.fetchone()[0]
-            cursor.close()
-            connection.close()
-            db_connected = True
-        
-        # Count registered faces
-        if db_connected:
-            connection = get_db_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT COUNT(*) as count FROM users WHERE face_registered = 1")
-            face_count = cursor.fetchone()[0]
-            cursor.close()
-            connection.close()
-        else:
-            face_count = 0
-        
+        top_k = int(data.get('top_k', IDENTIFY_TOP_K))
+    except (TypeError, ValueError):
+        top_k = IDENTIFY_TOP_K
+    return max(1, min(top_k, IDENTIFY_MAX_TOP_K))
+
+def identify_in_gallery(input_face, top_k):
+    """1:N search of the (already synced) gallery; returns the identify response body"""
+    with stage_seconds.time(stage='search'):
+        # The runner-up is needed for the margin even when top_k is 1
+        candidates = face_gallery.search(input_face['features'], input_face['hash'], max(top_k, 2))
+    best = candidates[0] if candidates else None
+    margin = best['similarity'] - candidates[1]['similarity'] if len(candidates) > 1 else 1.0
+    matched = best is not None and (best['hash_match'] or (
+        best['similarity'] >= IDENTIFY_THRESHOLD and margin >= IDENTIFY_MARGIN))
+    candidates = candidates[:top_k]
+    if best is not None:
+        record_decision('identify', matched, best['similarity'])
+
+    log.info("[IDENTIFY] Gallery: %s, best: %s, match: %s", len(face_gallery),
+             (best['user_id'], round(best['similarity'], 3)) if best else None, matched)
+
+    return {
+        'success': True,
+        'match': matched,
+        'user': best['user'] if matched else None,
+        'similarity': best['similarity'] if best else 0.0,
+        'hash_match': bool(best and best['hash_match']),
+        'threshold': IDENTIFY_THRESHOLD,
+        'margin': IDENTIFY_MARGIN,
+        'gallery_size': len(face_gallery),
+        'candidates': [
+            {
+                'user_id': candidate['user_id'],
+                'similarity': candidate['similarity'],
+                'hash_match': candidate['hash_match']
+            }
+            for candidate in candidates
+        ]
+    }
+
+@app.route('/api/face/identify', methods=['POST'])
+@admitted('identify')
+def identify_face():
+    """Find which enrolled user a face belongs to (1:N search in one request)"""
+    try:
+        data, image_bytes = read_face_request()
+
+        if image_bytes == b'':
+            return jsonify({
+                'success': False,
+                'error': 'No image provided'
+            }), 400
+
+        top_k = identify_top_k(data)
+
+        input_face = process_face_image(image_bytes, reduce=DECODE_REDUCED)
+        if input_face['status'] == 'invalid_image':
+            return jsonify({
+                'success': False,
+                'error': input_face.get('message', 'Invalid image format')
+            }), 400
+
+        if input_face['status'] == 'no_face':
+            return jsonify({
+                'success': True,
+                'match': False,
+                'reason': 'No face detected'
+            })
+
+        if input_face['status'] != 'ok':
+            return jsonify({
+                'success': True,
+                'match': False,
+                'reason': 'Failed to extract features'
+            })
+
+        # Make sure the in-memory gallery reflects the database
+        if face_gallery.sync_due():
+            with db_pool.connection() as connection:
+                if not connection:
+                    return jsonify({
+                        'success': False,
+                        'error': 'Database connection failed'
+                    }), 500
+
+                with stage_seconds.time(stage='gallery_sync'):
+                    face_gallery.sync(connection)
+
+        return jsonify(identify_in_gallery(input_face, top_k))
+
+    except PipelineBusy:
+        return pipeline_busy_response()
+    except PayloadTooLarge:
+        return payload_too_large_response()
+    except Exception as e:
+        log.exception("[IDENTIFY ERROR] %s", e)
         return jsonify({
-            'status': 'healthy',
-            'service': 'secure-face-auth-api',
+            'success': False,
+            'error': str(e)
+        }), 500
+
+DB_VERSION_QUERY = "SELECT VERSION()"
+
+class HealthMonitor:
+    """Health snapshot refreshed in the background
+
+    Every HEALTH_REFRESH_INTERVAL seconds one pooled connection runs
+    SELECT VERSION(); the result is stored with the in-process detector,
+    pool, cache and gallery state. /api/health, /api/health/live and
+    /api/health/ready only read the stored snapshot, so monitors and page
+    loads no longer cost database round trips. The registered face count
+    comes from the gallery (None until it has been loaded) instead of a
+    COUNT(*) over users.
+
+    The threaded server probes on its own thread (start()); the async
+    server drives update() from a task with its aiomysql pool.
+    """
+
+    def __init__(self, interval=HEALTH_REFRESH_INTERVAL):
+        self.interval = max(0.1, interval)
+        self.started_at = time.monotonic()
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def update(self, db_connected, db_version, pool_status, error=None, probe_seconds=0.0):
+        """Store a new snapshot from the result of a database probe"""
+        gallery = face_gallery.status()
+        snapshot = {
             'database': {
                 'connected': db_connected,
                 'version': db_version,
-                'registered_faces': face_count
-            },
-            'security': {
-                'mode': 'user-specific',
-                'verification': 'strict',
-                'threshold': '0.85'
+                'registered_faces': gallery['size'] if gallery['loaded'] else None,
+                'pool': pool_status,
+                'probe_ms': round(probe_seconds * 1000, 2),
+                'error': error
             },
-            'timestamp': datetime.now().isoformat()
-        })
+            'cache': template_cache.status(),
+            'probe_cache': probe_cache.status(),
+            'detector': face_detector.status(),
+            'gallery': gallery,
+            'cv_workers': cv_workers.status() if cv_workers else None,
+            'refreshed_at': datetime.now().isoformat(),
+            'refresh_interval_s': self.interval,
+            'refreshed': time.monotonic()
+        }
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def probe(self):
+        """Probe the database through the blocking pool and store the snapshot"""
+        start = time.perf_counter()
+        db_connected, db_version, error = False, 'unknown', None
+        try:
+            with db_pool.connection() as connection:
+                if connection:
+                    cursor = connection.cursor()
+                    cursor.execute(DB_VERSION_QUERY)
+                    db_version = cursor.fetchone()[0]
+                    cursor.close()
+                    db_connected = True
+                else:
+                    error = 'Database connection failed'
+        except Exception as e:
+            error = str(e)
+        return self.update(db_connected, db_version, db_pool.status(), error, time.perf_counter() - start)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.probe()
+
+    def start(self):
+        """Probe once, then keep refreshing on a background thread"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='face-health', daemon=True)
+        self.probe()
+        self._thread.start()
+        atexit.register(self._stop.set)
+
+    def latest(self):
+        """The stored snapshot, or None before the first probe"""
+        with self._lock:
+            return self._snapshot
+
+    def snapshot(self):
+        """The latest snapshot, starting the threaded monitor if it never ran"""
+        snapshot = self.latest()
+        if snapshot is None:
+            self.start()
+            snapshot = self.latest()
+        return snapshot
+
+    def readiness(self, snapshot):
+        """(ready, reasons) for a snapshot"""
+        reasons = []
+        if not snapshot['database']['connected']:
+            reasons.append('database unavailable')
+        if not snapshot['detector']['loaded']:
+            reasons.append('face detector not loaded')
+        age = time.monotonic() - snapshot['refreshed']
+        if age > 3 * self.interval:
+            reasons.append(f'health snapshot is {age:.0f}s old')
+        return not reasons, reasons
+
+    def status(self):
+        snapshot = self.latest()
+        return {
+            'refresh_interval_s': self.interval,
+            'age_s': round(time.monotonic() - snapshot['refreshed'], 2) if snapshot else -1,
+            'db_connected': int(bool(snapshot and snapshot['database']['connected']))
+        }
+
+health_monitor = HealthMonitor()
+
+def public_snapshot(snapshot):
+    return {key: value for key, value in snapshot.items() if key != 'refreshed'}
+
+def health_status(snapshot):
+    """/api/health body (the same shape as before it was served from a snapshot)"""
+    body = public_snapshot(snapshot)
+    body.update({
+        'status': 'healthy',
+        'service': 'secure-face-auth-api',
+        'security': {
+            'mode': 'user-specific',
+            'verification': 'strict',
+            'threshold': '0.85'
+        },
+        'timestamp': datetime.now().isoformat()
+    })
+    return body
+
+def liveness_status():
+    return {
+        'status': 'alive',
+        'service': 'secure-face-auth-api',
+        'uptime_s': round(time.monotonic() - health_monitor.started_at, 1)
+    }
+
+def readiness_status(snapshot):
+    """(/api/health/ready body, HTTP status)"""
+    ready, reasons = health_monitor.readiness(snapshot)
+    body = public_snapshot(snapshot)
+    body.update({'status': 'ready' if ready else 'not_ready', 'reasons': reasons})
+    return body, 200 if ready else 503
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Health check endpoint (served from the HealthMonitor snapshot)"""
+    try:
+        return jsonify(health_status(health_monitor.snapshot()))
         
     except Exception as e:
         return jsonify({
@@ -726,6 +3707,44 @@ def health_check():
             'error': str(e)
         }), 503
 
+@app.route('/api/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the process is up and serving requests"""
+    return jsonify(liveness_status())
+
+@app.route('/api/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: database reachable, detector loaded, snapshot fresh"""
+    body, status = readiness_status(health_monitor.snapshot())
+    return jsonify(body), status
+
+def render_metrics():
+    """Refresh the component gauges and render every metric"""
+    components = {
+        'db_pool': db_pool.status(),
+        'template_cache': template_cache.status(),
+        'probe_cache': probe_cache.status(),
+        'detector': face_detector.status(),
+        'pipeline_contexts': pipeline_contexts.status(),
+        'admission': admission_control.status(),
+        'gallery': face_gallery.status(),
+        'verify_streams': stream_sessions.status(),
+        'login_writer': login_writer.status(),
+        'health': health_monitor.status()
+    }
+    if cv_workers:
+        components['cv_workers'] = cv_workers.status()
+    for component, status in components.items():
+        for field, value in status.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                component_state.set(value, component=component, field=field)
+    return metrics.render()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return app.response_class(render_metrics(), content_type=face_metrics.CONTENT_TYPE)
+
 @app.route('/')
 def index():
     return """
@@ -763,4 +3782,12 @@ if __name__ == '__main__':
     print("⚡ Other faces will be rejected")
     print("=" * 70)
     
+    start_cv_workers()
+    check_template_column()
+    load_gallery_snapshot()
+    start_shared_gallery()
+    gallery_syncer.start()
+    health_monitor.start()
+    # Exit through atexit on SIGTERM too, so pending last_face_login updates are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host='127.0.0.1', port=5001, debug=True, threaded=True, use_reloader=False)
\ No newline at end of file
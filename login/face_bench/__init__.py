@@ -0,0 +1,14 @@
+"""
+Offline benchmarks for the face recognition API (face_auth_secure.py)
+
+Run from the login/ folder, e.g.:
+
+    python -m face_bench.signature    # extractor equivalence + speed
+    python -m face_bench.detection    # detect_face at camera resolutions
+    python -m face_bench.detectors    # detector backends: latency vs detection rate
+    python -m face_bench.service      # per-stage and end-to-end API latency
+    python -m face_bench.ann          # identification index recall vs exact search
+
+face_bench.synthetic renders the synthetic faces and galleries the service
+benchmark runs on, backed by the sqlite stand-in in face_standin_db.py.
+"""
@@ -0,0 +1,144 @@
+"""
+Recall and latency of the IVF identification index (face_index.py)
+
+Fills a FaceGallery with --users synthetic templates, trains the index and
+compares FaceGallery.search at each --nprobe against the exhaustive search
+of the same gallery. Reports, per nprobe:
+
+- recall@1 / recall@k: share of the exact top-1 / top-k found by the index
+- p50/p99 search latency, next to the exhaustive search
+- churn: recall after --churn re-registrations and removals applied
+  incrementally (no retraining), to show the index stays usable
+
+Probes are enrolled templates with fresh capture noise, so every probe has a
+true nearest neighbour in the gallery:
+
+    python -m face_bench.ann --users 20000,100000 --nprobe 4,8,16,32
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+from face_bench import synthetic
+from face_bench.service import git_commit, percentiles
+
+def fill_gallery(templates, users):
+    """A fresh FaceGallery with the first `users` templates, index included"""
+    gallery = api.FaceGallery()
+    gallery.ann_min_gallery = 1
+    rows = [{
+        'id': user_id,
+        'email': f'user{user_id}@example.com',
+        'first_name': 'Bench',
+        'last_name': str(user_id),
+        'face_template': api.pack_face_template(features, face_hash),
+        'face_encoding': None,
+        'face_hash': face_hash
+    } for user_id, features, face_hash in templates[:users]]
+    start = time.perf_counter()
+    gallery.load_rows(rows)
+    return gallery, time.perf_counter() - start
+
+def make_probes(templates, users, count, rng):
+    weights = api.similarity_weights(api.FEATURE_DIM)
+    picks = rng.integers(users, size=count)
+    return [templates[i][1] + rng.normal(0, 0.02, api.FEATURE_DIM).astype(np.float32) / weights
+            for i in picks]
+
+def search_all(gallery, probes, top_k, nprobe):
+    results, timings = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        candidates = gallery.search(probe, None, top_k, nprobe=nprobe)
+        timings.append((time.perf_counter() - start) * 1000)
+        results.append([candidate['user_id'] for candidate in candidates])
+    return results, timings
+
+def recall(found, exact, top_k):
+    at_1 = np.mean([bool(f) and f[0] == e[0] for f, e in zip(found, exact)])
+    at_k = np.mean([len(set(f) & set(e)) / max(1, len(e)) for f, e in zip(found, exact)])
+    return {'recall@1': round(float(at_1), 4), f'recall@{top_k}': round(float(at_k), 4)}
+
+def churn(gallery, templates, users, count, rng):
+    """Re-register `count` users with new noise and remove `count` others"""
+    weights = api.similarity_weights(api.FEATURE_DIM)
+    for i in rng.choice(users, size=2 * count, replace=False)[:count]:
+        user_id, features, face_hash = templates[i]
+        features = features + rng.normal(0, 0.02, features.shape).astype(np.float32) / weights
+        gallery.upsert(user_id, features, face_hash, {'id': user_id})
+    for i in rng.choice(users, size=count, replace=False):
+        gallery.remove(templates[i][0])
+
+def run_size(templates, users, args, rng):
+    gallery, load_s = fill_gallery(templates, users)
+    probes = make_probes(templates, users, args.probes, rng)
+    exact, exact_ms = search_all(gallery, probes, args.top_k, nprobe=gallery.status()['nlist'])
+
+    report = {
+        'users': users,
+        'load_and_train_s': round(load_s, 2),
+        'index': gallery.status(),
+        'exact': percentiles(exact_ms),
+        'nprobe': []
+    }
+    for nprobe in args.nprobe:
+        found, timings = search_all(gallery, probes, args.top_k, nprobe)
+        entry = {'nprobe': nprobe, **recall(found, exact, args.top_k), **percentiles(timings)}
+        report['nprobe'].append(entry)
+
+    if args.churn:
+        churn(gallery, templates, users, min(args.churn, users // 4), rng)
+        exact, _ = search_all(gallery, probes, args.top_k, nprobe=gallery.status()['nlist'])
+        report['churn'] = {'operations': 2 * min(args.churn, users // 4), 'nprobe': []}
+        for nprobe in args.nprobe:
+            found, _ = search_all(gallery, probes, args.top_k, nprobe)
+            report['churn']['nprobe'].append({'nprobe': nprobe, **recall(found, exact, args.top_k)})
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='20000,100000', help='comma-separated gallery sizes')
+    parser.add_argument('--rendered', type=int, default=100, help='users enrolled from a rendered image')
+    parser.add_argument('--nprobe', default='1,4,8,16,32', help='comma-separated lists searched per probe')
+    parser.add_argument('--probes', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=api.IDENTIFY_TOP_K)
+    parser.add_argument('--churn', type=int, default=1000, help='upserts and removes applied after training')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args(argv)
+    args.nprobe = [int(n) for n in args.nprobe.split(',') if n.strip()]
+    sizes = [int(n) for n in args.users.split(',') if n.strip()]
+
+    # Keep the API's log lines out of the report
+    api.log.setLevel('WARNING')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        templates = [(user_id, features, face_hash) for user_id, features, face_hash, _ in
+                     synthetic.gallery_templates(max(sizes), args.rendered, args.seed)]
+        rng = np.random.default_rng(args.seed)
+
+        report = {
+            'benchmark': 'face_ann',
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': {'numpy': np.__version__, 'cpus': os.cpu_count()},
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'sizes': [run_size(templates, users, args, rng) for users in sizes]
+        }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
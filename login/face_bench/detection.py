@@ -0,0 +1,126 @@
+"""
+Detection latency at common camera resolutions, full frame vs downscaled
+
+Every source image is letterboxed onto frames of each resolution and run
+through detect_face twice: on the full frame (max_dim=0) and with the
+configured working resolution. Reports median/p95 latency, how often a
+single face was found, and the IoU between the two rects when both found one.
+Without --images, synthetic frames (no real faces) are used, which still
+measures the cost of scanning the pyramid.
+
+    python -m face_bench.detection --images ../uploads/volunteer_id_photos
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+
+RESOLUTIONS = {
+    '480p': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+}
+
+def load_sources(directory, limit):
+    sources = []
+    if directory:
+        for path in sorted(glob.glob(os.path.join(directory, '**', '*'), recursive=True)):
+            img = cv2.imread(path)
+            if img is not None:
+                sources.append(img)
+            if len(sources) >= limit:
+                break
+    if not sources:
+        rng = np.random.default_rng(0)
+        for _ in range(limit):
+            img = cv2.GaussianBlur(rng.integers(0, 256, (720, 720, 3), dtype=np.uint8), (9, 9), 0)
+            cv2.ellipse(img, (360, 330), (150, 190), 0, 0, 360, (170, 190, 220), -1)
+            sources.append(img)
+    return sources
+
+def letterbox(img, size):
+    """Scale img to fit inside size=(w, h) and centre it on a grey frame"""
+    width, height = size
+    scale = min(width / img.shape[1], height / img.shape[0])
+    resized = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)))
+    frame = np.full((height, width, 3), 127, dtype=np.uint8)
+    y = (height - resized.shape[0]) // 2
+    x = (width - resized.shape[1]) // 2
+    frame[y:y + resized.shape[0], x:x + resized.shape[1]] = resized
+    return frame
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    return inter / float(aw * ah + bw * bh - inter)
+
+def timed_detect(frame, max_dim, repeat):
+    timings = []
+    rect = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rect = api.detect_face(frame, max_dim=max_dim)
+        timings.append((time.perf_counter() - start) * 1000)
+    return rect, timings
+
+def summarize(timings):
+    return {
+        'p50_ms': round(float(np.percentile(timings, 50)), 2),
+        'p95_ms': round(float(np.percentile(timings, 95)), 2)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='folder of photos containing faces')
+    parser.add_argument('--limit', type=int, default=10, help='max source images')
+    parser.add_argument('--repeat', type=int, default=3, help='detections per frame and mode')
+    parser.add_argument('--max-dim', type=int, default=api.DETECT_MAX_DIM or 640,
+                        help='working resolution for the downscaled mode')
+    args = parser.parse_args(argv)
+
+    sources = load_sources(args.images, args.limit)
+    report = {'benchmark': 'detect_face', 'max_dim': args.max_dim, 'sources': len(sources), 'resolutions': {}}
+
+    for name, size in RESOLUTIONS.items():
+        full_times, scaled_times, overlaps = [], [], []
+        found = {'full': 0, 'scaled': 0}
+        for source in sources:
+            frame = letterbox(source, size)
+            full_rect, timings = timed_detect(frame, 0, args.repeat)
+            full_times += timings
+            scaled_rect, timings = timed_detect(frame, args.max_dim, args.repeat)
+            scaled_times += timings
+            found['full'] += full_rect is not None
+            found['scaled'] += scaled_rect is not None
+            if full_rect is not None and scaled_rect is not None:
+                overlaps.append(iou(full_rect, scaled_rect))
+
+        full = summarize(full_times)
+        scaled = summarize(scaled_times)
+        report['resolutions'][name] = {
+            'frame': list(size),
+            'full': dict(full, faces_found=found['full']),
+            'downscaled': dict(scaled, faces_found=found['scaled'],
+                               scale=round(api.detection_scale((size[1], size[0]), args.max_dim), 3)),
+            'speedup_p50': round(full['p50_ms'] / scaled['p50_ms'], 2) if scaled['p50_ms'] else None,
+            'mean_iou': round(float(np.mean(overlaps)), 3) if overlaps else None
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
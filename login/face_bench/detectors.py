@@ -0,0 +1,105 @@
+"""
+Speed and accuracy of each face detector backend (DETECTOR_BACKENDS)
+
+Every image of the set goes through detect_face with each backend whose
+cascade is installed. Reports median/p95 latency, how often exactly one
+face was found, how often that face also passes validate_face_quality,
+and the mean IoU against the reference backend's rect. The recommendation
+is the fastest backend whose quality pass rate is within --tolerance of
+the best one; set it with FACE_DETECTOR.
+
+Without --images, synthetic faces (face_bench.synthetic) are used; they
+are drawn to be found by the Haar cascades and only show relative speed,
+so choose a backend on a folder of real enrollment photos.
+
+    python -m face_bench.detectors --images ../uploads/volunteer_id_photos
+    python -m face_bench.detectors --backends haar_default,haar_alt2 --scale-factor 1.2
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+from face_bench import synthetic
+from face_bench.detection import iou, load_sources, summarize
+
+def synthetic_sources(count):
+    return [synthetic.synthetic_probe(seed, 1) for seed in range(count)]
+
+def run_backend(detector, sources, repeat):
+    """(timings, rects, quality) of one detector over the sources"""
+    timings, rects, quality = [], [], []
+    for img in sources:
+        rect = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rect = api.detect_face(img, detector=detector)
+            timings.append((time.perf_counter() - start) * 1000)
+        rects.append(rect)
+        quality.append(rect is not None and api.validate_face_quality(img, rect)[0])
+    return timings, rects, quality
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='folder of photos with one face each')
+    parser.add_argument('--limit', type=int, default=50, help='max source images')
+    parser.add_argument('--repeat', type=int, default=3, help='detections per image and backend')
+    parser.add_argument('--backends', default=','.join(api.DETECTOR_BACKENDS),
+                        help='comma-separated DETECTOR_BACKENDS names')
+    parser.add_argument('--reference', default=api.DETECTOR_BACKEND, help='backend the IoU is measured against')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='quality pass rate a recommended backend may lose against the best')
+    parser.add_argument('--scale-factor', type=float, help='override scale_factor for every backend')
+    parser.add_argument('--min-neighbors', type=int, help='override min_neighbors for every backend')
+    parser.add_argument('--min-size', type=int, help='override min_size for every backend')
+    args = parser.parse_args(argv)
+
+    overrides = {key: value for key, value in (('scale_factor', args.scale_factor),
+                                                ('min_neighbors', args.min_neighbors),
+                                                ('min_size', args.min_size)) if value is not None}
+    sources = load_sources(args.images, args.limit) if args.images else synthetic_sources(args.limit)
+    names = [name.strip() for name in args.backends.split(',') if name.strip()]
+    if args.reference in names:
+        names.remove(args.reference)
+        names.insert(0, args.reference)
+
+    report = {'benchmark': 'detector_backends', 'images': args.images or 'synthetic',
+              'sources': len(sources), 'max_dim': api.DETECT_MAX_DIM, 'backends': {}}
+    reference_rects = None
+    for name in names:
+        backend = api.detector_backend(name, **overrides)
+        params = {key: backend[key] for key in ('cascade', 'scale_factor', 'min_neighbors', 'min_size')}
+        detector = api.CascadePool(backend, 1)
+        if not detector.load():
+            report['backends'][name] = dict(params, available=False, error=detector.error)
+            continue
+
+        timings, rects, quality = run_backend(detector, sources, args.repeat)
+        if name == args.reference:
+            reference_rects = rects
+        overlaps = [iou(a, b) for a, b in zip(rects, reference_rects or [])
+                    if a is not None and b is not None]
+        report['backends'][name] = dict(
+            params, available=True, load_ms=detector.load_ms, **summarize(timings),
+            single_face_rate=round(sum(rect is not None for rect in rects) / len(sources), 3),
+            quality_pass_rate=round(sum(quality) / len(sources), 3),
+            mean_iou=round(float(np.mean(overlaps)), 3) if overlaps else None)
+
+    measured = {name: result for name, result in report['backends'].items() if result['available']}
+    if measured:
+        best = max(result['quality_pass_rate'] for result in measured.values())
+        eligible = [name for name, result in measured.items()
+                    if result['quality_pass_rate'] >= best - args.tolerance]
+        report['recommended'] = min(eligible, key=lambda name: measured[name]['p50_ms'])
+
+    print(json.dumps(report, indent=2))
+    return 0 if measured else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
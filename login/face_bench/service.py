@@ -0,0 +1,252 @@
+"""
+End-to-end latency of the face API on a synthetic gallery
+
+Builds (or reuses) a stand-in users table with --users enrolled synthetic
+faces, points face_auth_secure at it and drives the Flask app in-process,
+so it runs offline without MySQL or a web server. Reports:
+
+- stages: per-stage latency of one request on a single thread (decode,
+  detect, extract, DB fetch of a stored template, cached template lookup,
+  1:1 compare and 1:N gallery search)
+- endpoints: p50/p95/p99 latency and throughput of /api/face/verify,
+  /api/face/test/<id> and /api/face/identify at each --concurrency level
+- login_loop: the pre-identify login flow, which posted the image to
+  /api/face/test/<id> once per enrolled user (capped at --loop-users)
+
+The JSON report includes the git commit and library versions so runs can
+be compared across commits:
+
+    python -m face_bench.service --users 10000 --concurrency 1,4,16 --output bench.json
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+from face_bench import synthetic
+
+RESOLUTIONS = {
+    '480p': (480, 640),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+}
+
+def percentiles(timings_ms):
+    if not timings_ms:
+        return {'count': 0}
+    values = np.asarray(timings_ms, dtype=np.float64)
+    return {
+        'count': len(values),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3)
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def make_probes(count, rendered, size, seed):
+    """[(user_id, jpeg_bytes)] - fresh captures of enrolled, rendered users"""
+    rng = np.random.default_rng(seed)
+    probes = []
+    for capture in range(count):
+        user_id = int(rng.integers(1, rendered + 1))
+        probes.append((user_id, synthetic.encode_jpeg(synthetic.synthetic_probe(seed + user_id, capture, size))))
+    return probes
+
+def measure_stages(probes):
+    """Time each pipeline stage separately on the calling thread"""
+    stages = {name: [] for name in ('decode', 'detect', 'extract', 'db', 'cache', 'compare', 'search')}
+    with api.db_pool.connection() as connection:
+        api.face_gallery.sync(connection, force=True)
+
+    for user_id, image_bytes in probes:
+        img, elapsed = timed(api.bytes_to_image, image_bytes)
+        stages['decode'].append(elapsed)
+        rect, elapsed = timed(api.detect_face, img)
+        stages['detect'].append(elapsed)
+        if rect is None:
+            continue
+        face, elapsed = timed(api.extract_face_signature, img, rect)
+        stages['extract'].append(elapsed)
+        if face is None:
+            continue
+
+        api.template_cache.evict(user_id)
+        (stored, status), elapsed = timed(api.load_stored_face, user_id)
+        stages['db'].append(elapsed)
+        if status != 'ok':
+            continue
+        _, elapsed = timed(api.load_stored_face, user_id)
+        stages['cache'].append(elapsed)
+
+        _, elapsed = timed(api.calculate_similarity, face['features'], stored['features'])
+        stages['compare'].append(elapsed)
+        _, elapsed = timed(api.face_gallery.search, face['features'], face['hash'])
+        stages['search'].append(elapsed)
+
+    return {name: percentiles(timings) for name, timings in stages.items()}
+
+class Client:
+    """One Flask test client per thread, posting the probe in the chosen encoding"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._local = threading.local()
+
+    def post(self, path, image_bytes, fields=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = api.app.test_client()
+        fields = dict(fields or {})
+        if self.encoding == 'json':
+            fields['image'] = base64.b64encode(image_bytes).decode()
+            return client.post(path, json=fields)
+        return client.post(path, query_string=fields, data=image_bytes, content_type='image/jpeg')
+
+def run_endpoint(client, scenario, probes, requests, concurrency):
+    """Fire `requests` calls of one scenario with `concurrency` threads"""
+    def call(i):
+        user_id, image_bytes = probes[i % len(probes)]
+        if scenario == 'verify':
+            response, elapsed = timed(client.post, '/api/face/verify', image_bytes, {'user_id': user_id})
+        elif scenario == 'test':
+            response, elapsed = timed(client.post, f'/api/face/test/{user_id}', image_bytes)
+        else:
+            response, elapsed = timed(client.post, '/api/face/identify', image_bytes)
+        body = response.get_json(silent=True) or {}
+        matched = bool(body.get('match') or body.get('authenticated')) and (scenario != 'identify' or (body.get('user') or {}).get('id') == user_id)
+        return elapsed, response.status_code, matched
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(requests)))
+    wall = time.perf_counter() - start
+
+    timings = [elapsed for elapsed, status, _ in results if status == 200]
+    report = percentiles(timings)
+    report.update({
+        'concurrency': concurrency,
+        'errors': sum(status != 200 for _, status, _ in results),
+        'match_rate': round(sum(matched for _, _, matched in results) / len(results), 3),
+        'throughput_rps': round(len(results) / wall, 1)
+    })
+    return report
+
+def run_login_loop(client, probes, loop_users, logins):
+    """The old login flow: /api/face/test/<id> for every enrolled user, keep the best"""
+    # Only probe users the loop will reach, so correct_user_rate means something
+    probes = [probe for probe in probes if probe[0] <= loop_users] or probes
+    timings, found = [], 0
+    for i in range(logins):
+        user_id, image_bytes = probes[i % len(probes)]
+        start = time.perf_counter()
+        best_user, best_similarity = None, 0.0
+        for candidate in range(1, loop_users + 1):
+            body = client.post(f'/api/face/test/{candidate}', image_bytes).get_json(silent=True) or {}
+            if body.get('match') and body.get('similarity', 0) > best_similarity:
+                best_user, best_similarity = candidate, body['similarity']
+        timings.append((time.perf_counter() - start) * 1000)
+        found += best_user == user_id
+    report = percentiles(timings)
+    report.update({'users_tested': loop_users, 'correct_user_rate': round(found / max(1, logins), 3)})
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'frsm_bench.sqlite3'),
+                        help='stand-in sqlite file for the gallery')
+    parser.add_argument('--users', type=int, default=1000, help='gallery size (10 to 100000)')
+    parser.add_argument('--rendered', type=int, default=100, help='users enrolled from a rendered image')
+    parser.add_argument('--reuse', action='store_true', help='reuse --db instead of rebuilding it')
+    parser.add_argument('--resolution', choices=sorted(RESOLUTIONS), default='480p', help='probe frame size')
+    parser.add_argument('--probes', type=int, default=50, help='distinct probe images')
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and concurrency level')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated thread counts')
+    parser.add_argument('--encoding', choices=['raw', 'json'], default='raw',
+                        help='raw JPEG bodies or base64 JSON bodies')
+    parser.add_argument('--loop-users', type=int, default=50, help='users tested per login-loop login')
+    parser.add_argument('--logins', type=int, default=5, help='login-loop logins to time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    size = RESOLUTIONS[args.resolution]
+
+    # Keep the API's per-request log lines out of the report
+    api.log.setLevel('WARNING')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if args.reuse and os.path.exists(args.db):
+            gallery = {'path': args.db, 'reused': True}
+        else:
+            gallery = synthetic.build_gallery(args.db, args.users, args.rendered, args.seed)
+        api.DB_STANDIN_PATH = args.db
+        api.db_pool.close_all()
+
+        probes = make_probes(args.probes, min(args.rendered, args.users), size, args.seed)
+        client = Client(args.encoding)
+
+        report = {
+            'benchmark': 'face_api',
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'cpus': os.cpu_count(),
+                'cv_workers': api.CV_WORKERS,
+                'db_pool_size': api.DB_POOL_SIZE,
+                'detect_max_dim': api.DETECT_MAX_DIM
+            },
+            'config': {key: value for key, value in vars(args).items() if key not in ('db', 'output')},
+            'gallery': gallery,
+            'probe_bytes': int(np.mean([len(image_bytes) for _, image_bytes in probes])),
+            'stages': measure_stages(probes),
+            'endpoints': {}
+        }
+
+        for scenario in ('verify', 'test', 'identify'):
+            report['endpoints'][scenario] = [
+                run_endpoint(client, scenario, probes, args.requests, level) for level in levels
+            ]
+        if args.logins and args.loop_users:
+            report['login_loop'] = run_login_loop(client, probes, min(args.loop_users, args.users), args.logins)
+
+        report['pool'] = api.db_pool.status()
+        report['cache'] = api.template_cache.status()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Equivalence check and microbenchmark for extract_face_signature
+
+Compares the vectorized extractor (single and batch) against the original
+per-cell loop on synthetic face crops, plus any images in --images, and
+fails if a single feature differs. Then times all three variants.
+
+    python -m face_bench.signature --faces 500 --repeat 5
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+
+def reference_extract_face_signature(img, face_rect):
+    """The original nested-loop extractor, kept as the equivalence oracle"""
+    x, y, w, h = face_rect
+    face_region = img[y:y+h, x:x+w]
+    if face_region.size == 0 or w < 50 or h < 50:
+        return None
+    face_resized = cv2.resize(face_region, (128, 128))
+    if len(face_resized.shape) == 3:
+        face_gray = cv2.cvtColor(face_resized, cv2.COLOR_BGR2GRAY)
+    else:
+        face_gray = face_resized
+    face_eq = cv2.equalizeHist(face_gray)
+    face_normalized = face_eq.astype(np.float32) / 255.0
+
+    features = []
+    grid_size = 8
+    cell_h = face_normalized.shape[0] // grid_size
+    cell_w = face_normalized.shape[1] // grid_size
+    for i in range(grid_size):
+        for j in range(grid_size):
+            cell = face_normalized[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w]
+            if cell.size > 0:
+                features.append(float(cell.mean()))
+                features.append(float(cell.std()))
+                features.append(float(np.median(cell)))
+
+    img_h, img_w = img.shape[:2]
+    features.append(float(x / img_w))
+    features.append(float(y / img_h))
+    features.append(float((x + w/2) / img_w))
+    features.append(float((y + h/2) / img_h))
+    features.append(float(w / img_w))
+    features.append(float(h / img_h))
+    features.append(float(w / h))
+
+    return {
+        'features': features,
+        'hash': hashlib.sha256(face_normalized.tobytes()).hexdigest()
+    }
+
+def synthetic_samples(count, seed=0):
+    """Random frames with a random face rect: noise, gradients and blobs"""
+    rng = np.random.default_rng(seed)
+    samples = []
+    for i in range(count):
+        height, width = [(480, 640), (720, 1280), (300, 300)][i % 3]
+        kind = (i // 3) % 3
+        if kind == 0:
+            img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        elif kind == 1:
+            ramp = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+            img = np.broadcast_to(ramp, (height, width, 3)).astype(np.uint8).copy()
+            img = cv2.GaussianBlur(img + rng.integers(0, 20, img.shape, dtype=np.uint8), (5, 5), 0)
+        else:
+            img = np.full((height, width, 3), rng.integers(60, 200), dtype=np.uint8)
+            for _ in range(8):
+                center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+                cv2.circle(img, center, int(rng.integers(5, 60)), [int(c) for c in rng.integers(0, 256, 3)], -1)
+        size = int(rng.integers(60, min(height, width)))
+        x = int(rng.integers(0, width - size + 1))
+        y = int(rng.integers(0, height - size + 1))
+        samples.append((img, (x, y, size, int(min(height - y, size * rng.uniform(0.9, 1.2))))))
+    return samples
+
+def image_samples(directory):
+    """Real images with a detected face (skips images without exactly one face)"""
+    samples = []
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*'), recursive=True)):
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        rect = api.detect_face(img)
+        if rect is not None:
+            samples.append((img, tuple(int(v) for v in rect)))
+    return samples
+
+def check_equivalence(samples):
+    """Return the number of samples whose features or hash differ from the reference"""
+    mismatches = 0
+    batch_features, batch_hashes = api.extract_face_signatures(
+        [img for img, _ in samples], [rect for _, rect in samples])
+    context = api.PipelineContext()
+    for i, (img, rect) in enumerate(samples):
+        expected = reference_extract_face_signature(img, rect)
+        actual = api.extract_face_signature(img, rect)
+        # The pipeline writes into reused buffers and must produce the same signature
+        pooled = api.extract_face_signature(img, rect, context=context)
+        if expected is None or actual is None or pooled is None:
+            mismatches += (expected is None) != (actual is None) or (expected is None) != (pooled is None)
+            continue
+        if actual['features'] != expected['features'] or actual['hash'] != expected['hash'] or \
+                pooled['features'] != expected['features'] or pooled['hash'] != expected['hash']:
+            mismatches += 1
+            continue
+        # The batch API returns float32, so compare at float32 precision
+        if (batch_hashes[i] != expected['hash'] or
+                not np.array_equal(batch_features[i], np.float32(expected['features']))):
+            mismatches += 1
+    return mismatches
+
+def time_it(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', type=int, default=300, help='number of synthetic face crops')
+    parser.add_argument('--images', help='optional folder of real photos to include')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions (best is reported)')
+    args = parser.parse_args(argv)
+
+    samples = synthetic_samples(args.faces)
+    if args.images:
+        samples += image_samples(args.images)
+
+    mismatches = check_equivalence(samples)
+    images = [img for img, _ in samples]
+    rects = [rect for _, rect in samples]
+
+    loop_s = time_it(lambda: [reference_extract_face_signature(img, rect) for img, rect in samples], args.repeat)
+    vector_s = time_it(lambda: [api.extract_face_signature(img, rect) for img, rect in samples], args.repeat)
+    batch_s = time_it(lambda: api.extract_face_signatures(images, rects), args.repeat)
+
+    result = {
+        'benchmark': 'extract_face_signature',
+        'faces': len(samples),
+        'mismatches': mismatches,
+        'per_face_us': {
+            'loop': round(loop_s / len(samples) * 1e6, 1),
+            'vectorized': round(vector_s / len(samples) * 1e6, 1),
+            'batch': round(batch_s / len(samples) * 1e6, 1)
+        },
+        'speedup': {
+            'vectorized': round(loop_s / vector_s, 2),
+            'batch': round(loop_s / batch_s, 2)
+        }
+    }
+    print(json.dumps(result, indent=2))
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Synthetic faces and galleries for the face API benchmarks
+
+synthetic_face renders a shaded, face-like frame (skin ellipse, dark eye
+sockets and brows, bright nose bridge, mouth shadow) that the Haar cascade
+detects and that passes validate_face_quality. Every seed is a different
+"person"; synthetic_probe re-renders a seed with a small shift, exposure
+change and sensor noise, standing in for a fresh webcam capture.
+
+build_gallery fills a stand-in users table (face_standin_db) with enrolled
+faces. Rendering and extracting 100k frames would take far longer than the
+benchmark itself, so only the first `rendered` users get a template from a
+real pipeline run; the rest reuse one of those templates with per-user
+feature noise, which keeps the feature distribution realistic for the
+similarity search.
+
+    python -m face_bench.synthetic --db /tmp/frsm_bench.sqlite3 --users 10000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import face_auth_secure as api
+import face_standin_db
+
+def _blob(canvas, cx, cy, sx, sy, amplitude):
+    """Add a Gaussian bump (or dip, for negative amplitude) to a float image in place"""
+    h, w = canvas.shape
+    x0, x1 = max(0, int(cx - 3 * sx)), min(w, int(cx + 3 * sx) + 1)
+    y0, y1 = max(0, int(cy - 3 * sy)), min(h, int(cy + 3 * sy) + 1)
+    if x0 >= x1 or y0 >= y1:
+        return
+    y, x = np.mgrid[y0:y1, x0:x1].astype(np.float32)
+    canvas[y0:y1, x0:x1] += amplitude * np.exp(-(((x - cx) / sx) ** 2 + ((y - cy) / sy) ** 2) / 2)
+
+def synthetic_face(seed, size=(480, 640), shift=(0.0, 0.0), noise_seed=None):
+    """Render the face-like BGR frame for person `seed` at size=(h, w)"""
+    rng = np.random.default_rng(seed)
+    h, w = size
+    # Face size follows the frame so every resolution passes the quality check
+    unit = min(h, w) / 480.0
+
+    canvas = np.full((h, w), rng.uniform(60, 120), dtype=np.float32)
+    cx = w / 2 + rng.uniform(-30, 30) * unit + shift[0]
+    cy = h / 2 + rng.uniform(-20, 20) * unit + shift[1]
+    fw = rng.uniform(85, 110) * unit
+    fh = fw * rng.uniform(1.25, 1.4)
+
+    mask = np.zeros((h, w), dtype=np.float32)
+    cv2.ellipse(mask, (int(cx), int(cy)), (int(fw), int(fh)), 0, 0, 360, 1, -1)
+    mask = cv2.GaussianBlur(mask, (0, 0), 6 * unit)
+    canvas = canvas * (1 - mask) + rng.uniform(150, 200) * mask
+
+    eye_x = fw * rng.uniform(0.38, 0.45)
+    eye_y = cy - fh * rng.uniform(0.12, 0.2)
+    for side in (-1, 1):
+        _blob(canvas, cx + side * eye_x, eye_y, fw * 0.17, fh * 0.07, -rng.uniform(70, 100))
+        _blob(canvas, cx + side * eye_x, eye_y - fh * 0.17, fw * 0.2, fh * 0.035, -rng.uniform(50, 80))
+    _blob(canvas, cx, eye_y + fh * 0.15, fw * 0.08, fh * 0.2, rng.uniform(15, 30))
+    _blob(canvas, cx, cy + fh * 0.22, fw * 0.17, fh * 0.04, -40)
+    _blob(canvas, cx, cy + fh * 0.5, fw * 0.3, fh * 0.05, -rng.uniform(50, 80))
+
+    tint = rng.uniform(0.8, 1.1, 3).astype(np.float32)
+    noise = np.random.default_rng(seed if noise_seed is None else noise_seed)
+    canvas += noise.normal(0, 4, canvas.shape).astype(np.float32)
+    return np.clip(canvas[..., None] * tint, 0, 255).astype(np.uint8)
+
+def synthetic_probe(seed, capture, size=(480, 640)):
+    """A new capture of person `seed`: shifted, re-exposed and re-noised"""
+    rng = np.random.default_rng([seed, capture])
+    img = synthetic_face(seed, size, shift=tuple(rng.uniform(-4, 4, 2)), noise_seed=[seed, capture, 1])
+    gain = rng.uniform(0.9, 1.1)
+    return np.clip(img.astype(np.float32) * gain, 0, 255).astype(np.uint8)
+
+def encode_jpeg(img, quality=85):
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError('JPEG encoding failed')
+    return encoded.tobytes()
+
+def enroll_template(seed, size=(480, 640)):
+    """Run the real pipeline on person `seed`; returns (features, hash) or None"""
+    result = api.run_face_pipeline(encode_jpeg(synthetic_face(seed, size)), check_quality=True)
+    if result['status'] != 'ok':
+        return None
+    return np.asarray(result['features'], dtype=np.float32), result['hash']
+
+def gallery_templates(users, rendered=200, seed=0):
+    """Yield (user_id, features, face_hash, rendered) for user ids 1..`users`
+
+    The first `rendered` users get a template from a real pipeline run on
+    their synthetic face; every other user is a rendered template plus
+    per-user feature noise.
+    """
+    rendered = min(rendered, users)
+    base = {}
+    for user_id in range(1, rendered + 1):
+        template = enroll_template(seed + user_id)
+        if template is not None:
+            base[user_id] = template
+    if not base:
+        raise RuntimeError('No synthetic face could be enrolled')
+
+    rng = np.random.default_rng(seed)
+    base_ids = list(base)
+    weights = api.similarity_weights(api.FEATURE_DIM)
+    for user_id in range(1, users + 1):
+        if user_id in base:
+            features, face_hash = base[user_id]
+        else:
+            features, _ = base[base_ids[int(rng.integers(len(base_ids)))]]
+            features = features + rng.normal(0, 0.02, features.shape).astype(np.float32) / weights
+            face_hash = rng.bytes(32).hex()
+        yield user_id, features, face_hash, user_id in base
+
+def build_gallery(path, users, rendered=200, seed=0, batch_size=1000):
+    """Create a stand-in users table with `users` enrolled faces
+
+    User ids run from 1 to `users`; user i is rendered from seed + i. Only
+    the first `rendered` users can be probed with a matching image.
+    Returns a summary dict.
+    """
+    start = time.perf_counter()
+    if os.path.exists(path):
+        os.remove(path)
+    face_standin_db.seed_users(path, users)
+
+    connection = face_standin_db.connect(path)
+    cursor = connection.cursor()
+    rows = []
+    enrolled = 0
+    for user_id, features, face_hash, synthetic in gallery_templates(users, rendered, seed):
+        enrolled += synthetic
+        metadata = {
+            'hash': face_hash,
+            'registered_at': '2024-01-01T00:00:00',
+            'feature_count': len(features),
+            'template_version': api.TEMPLATE_FORMAT_VERSION,
+            'feature_schema': api.FEATURE_SCHEMA_VERSION,
+            'synthetic': synthetic
+        }
+        rows.append((api.pack_face_template(features, face_hash), json.dumps(metadata), face_hash, user_id))
+        if len(rows) >= batch_size or user_id == users:
+            cursor.executemany("""
+                UPDATE users
+                SET face_template = %s, face_encoding = %s, face_registered = 1, face_hash = %s
+                WHERE id = %s
+            """, rows)
+            connection.commit()
+            rows = []
+    cursor.close()
+    connection.close()
+
+    rendered = min(rendered, users)
+    return {
+        'path': path,
+        'users': users,
+        'rendered': enrolled,
+        'render_failures': rendered - enrolled,
+        'seed': seed,
+        'build_s': round(time.perf_counter() - start, 2)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', required=True, help='stand-in sqlite file to (re)create')
+    parser.add_argument('--users', type=int, default=1000, help='gallery size')
+    parser.add_argument('--rendered', type=int, default=200, help='users enrolled from a rendered image')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(json.dumps(build_gallery(args.db, args.users, args.rendered, args.seed), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
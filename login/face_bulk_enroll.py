@@ -0,0 +1,260 @@
+"""
+Bulk face enrollment from a directory of photos
+
+    python face_bulk_enroll.py units.csv [--image-dir photos/] [--workers 8]
+                               [--batch-size 200] [--report report.csv] [--dry-run]
+
+The CSV maps photos to accounts with a header row and two columns:
+
+    user_id,image
+    1042,alpha/1042.jpg
+    1043,alpha/1043.png
+
+Relative image paths are resolved against --image-dir (default: the CSV's
+folder). Every photo goes through the same detect_face /
+validate_face_quality / extract_face_signature pipeline as
+/api/face/register, on a pool of worker processes. Users that already have
+a face registered, unknown user ids and faces already enrolled on another
+account (including another row of the same import) are skipped; near
+matches are only skipped when FACE_DUPLICATE_THRESHOLD is set. Accepted
+faces are written one transaction per --batch-size batch and added to the
+in-memory gallery a batch at a time, so the import can be stopped and
+re-run: finished users are skipped on the next run. A user who registers
+through the API while the import runs keeps that registration and is
+reported as already_registered.
+
+Every row ends up in the per-file report (--report, CSV) with its status:
+enrolled, already_registered, unknown_user, duplicate_row, missing_file,
+invalid_image, no_face, low_quality, extract_failed, duplicate_exact,
+duplicate_near or would_enroll (--dry-run).
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import face_auth_secure as api
+
+REPORT_FIELDS = ['row', 'user_id', 'image', 'status', 'message']
+
+USERS_QUERY = "SELECT id, email, first_name, last_name, face_registered FROM users WHERE id IN ({})"
+
+HASHES_QUERY = "SELECT id, face_hash FROM users WHERE id IN ({})"
+
+def _worker_init():
+    """Each worker process loads one cascade of its own"""
+    if not api.face_detector.loaded:
+        api.face_detector.size = 1
+        api.face_detector.load()
+
+def _process_file(path):
+    """Read one photo and run the registration pipeline on it"""
+    try:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+    except OSError as e:
+        return {'status': 'missing_file', 'message': str(e)}
+    result = api.run_face_pipeline(image_bytes, check_quality=True)
+    result.pop('timings', None)
+    return result
+
+def read_manifest(csv_path, image_dir=None):
+    """[(row_number, user_id, image_path)] from the CSV; raises ValueError on a bad header"""
+    image_dir = image_dir or os.path.dirname(os.path.abspath(csv_path))
+    entries = []
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or not {'user_id', 'image'} <= set(reader.fieldnames):
+            raise ValueError('CSV needs a header with user_id and image columns')
+        for row_number, row in enumerate(reader, start=2):
+            image = (row['image'] or '').strip()
+            entries.append((row_number, (row['user_id'] or '').strip(), os.path.join(image_dir, image)))
+    return entries
+
+def load_users(connection, user_ids, chunk_size=1000):
+    """{user_id: REGISTER_USER_QUERY-shaped row} for the ids that exist"""
+    users = {}
+    ids = sorted(user_ids)
+    cursor = connection.cursor(dictionary=True)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        cursor.execute(USERS_QUERY.format(', '.join(['%s'] * len(chunk))), tuple(chunk))
+        for user in cursor.fetchall():
+            users[int(user['id'])] = user
+    cursor.close()
+    return users
+
+def write_batch(connection, batch, dry_run=False):
+    """Store a batch of (user, face_data) registrations in one transaction
+
+    Returns {user_id: (status, message)} for the rows that were not
+    written: users who registered a face (e.g. through the API) since their
+    row was read keep that registration (already_registered), and a face
+    that another account registered meanwhile is refused by the UNIQUE
+    idx_users_face_hash (duplicate_exact).
+    """
+    if not batch or dry_run:
+        return {}
+    # Same statement as /api/face/register, but never over a registration made meanwhile
+    query = api.REGISTER_FACE_QUERY.rstrip() + " AND face_registered = 0"
+    params = [api.registration_params(user['id'], face_data) for user, face_data in batch]
+    not_written = {}
+    cursor = connection.cursor()
+    try:
+        cursor.executemany(query, params)
+        written = cursor.rowcount
+    except Exception as e:
+        if not api.face_hash_conflict(e):
+            raise
+        # Rare: find the conflicting rows one by one, and write the others
+        connection.rollback()
+        written = 0
+        for (user, _), row_params in zip(batch, params):
+            try:
+                cursor.execute(query, row_params)
+                written += cursor.rowcount
+            except Exception as e:
+                if not api.face_hash_conflict(e):
+                    raise
+                not_written[user['id']] = ('duplicate_exact', 'registered on another account during the import')
+    connection.commit()
+
+    # executemany only reports a total; read back which rows kept another registration
+    if written < len(batch) - len(not_written):
+        ids = [user['id'] for user, _ in batch]
+        cursor.execute(HASHES_QUERY.format(', '.join(['%s'] * len(ids))), tuple(ids))
+        stored = dict(cursor.fetchall())
+        for user, face_data in batch:
+            if user['id'] not in not_written and stored.get(user['id']) != face_data['hash']:
+                not_written[user['id']] = ('already_registered', 'registered while the import was running')
+    cursor.close()
+    return not_written
+
+def write_report(path, report):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(report, key=lambda entry: entry['row']))
+
+def bulk_enroll(entries, workers=None, batch_size=200, check_duplicates=True, dry_run=False):
+    """Enroll the manifest entries; returns (summary, per-file report)"""
+    start = time.perf_counter()
+    report = []
+    summary = {}
+
+    def record(row_number, user_id, image, status, message=''):
+        report.append({'row': row_number, 'user_id': user_id, 'image': image,
+                       'status': status, 'message': message})
+        summary[status] = summary.get(status, 0) + 1
+
+    with api.db_pool.connection() as connection:
+        if not connection:
+            raise RuntimeError('Database connection failed')
+
+        wanted = {int(user_id) for _, user_id, _ in entries if user_id.isdigit()}
+        users = load_users(connection, wanted)
+        if check_duplicates:
+            api.face_gallery.sync(connection, force=True)
+
+        # Only photos of unregistered, known users are worth a pipeline run
+        todo, seen = [], set()
+        for row_number, user_id, image in entries:
+            user = users.get(int(user_id)) if user_id.isdigit() else None
+            if user is None:
+                record(row_number, user_id, image, 'unknown_user')
+            elif user['id'] in seen:
+                record(row_number, user_id, image, 'duplicate_row', 'user appears earlier in the CSV')
+            elif user['face_registered']:
+                record(row_number, user_id, image, 'already_registered')
+            else:
+                seen.add(user['id'])
+                todo.append((row_number, user, image))
+        print(f"[BULK] {len(todo)} of {len(entries)} photos to process")
+
+        workers = workers or os.cpu_count() or 1
+        # Accepted rows not written yet; `pending` lets later rows of the batch see their faces
+        batch, pending = [], api.FaceGallery()
+
+        def flush():
+            not_written = write_batch(connection, [(user, face_data) for _, user, _, face_data in batch], dry_run)
+            enrolled = []
+            for row_number, user, image, face_data in batch:
+                if user['id'] in not_written:
+                    record(row_number, user['id'], image, *not_written[user['id']])
+                    continue
+                record(row_number, user['id'], image, 'would_enroll' if dry_run else 'enrolled')
+                profile = {key: user[key] for key in ('email', 'first_name', 'last_name')}
+                profile['id'] = int(user['id'])
+                enrolled.append((user['id'], face_data['features'], face_data['hash'], profile))
+            # Later batches must see these faces as enrolled
+            api.face_gallery.upsert_many(enrolled)
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_worker_init) as executor:
+            results = executor.map(_process_file, [image for _, _, image in todo], chunksize=4)
+            for done, ((row_number, user, image), face_data) in enumerate(zip(todo, results), start=1):
+                if face_data['status'] != 'ok':
+                    record(row_number, user['id'], image, face_data['status'], face_data.get('message', ''))
+                    continue
+
+                duplicate = None
+                if check_duplicates:
+                    duplicate = api.find_duplicate_face(user['id'], face_data) or \
+                        api.find_duplicate_face(user['id'], face_data, pending)
+                if duplicate is not None:
+                    owner, kind, similarity = duplicate
+                    record(row_number, user['id'], image, f'duplicate_{kind}',
+                           f'matches user {owner} (similarity {similarity:.3f})')
+                    continue
+
+                if check_duplicates:
+                    pending.upsert(user['id'], face_data['features'], face_data['hash'], {'id': int(user['id'])})
+                batch.append((row_number, user, image, face_data))
+
+                if len(batch) >= batch_size:
+                    flush()
+                    batch, pending = [], api.FaceGallery()
+                if done % 500 == 0:
+                    print(f"[BULK] {done}/{len(todo)} photos, {time.perf_counter() - start:.1f}s")
+            flush()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'rows': len(entries),
+        'processed': len(todo),
+        'workers': workers,
+        'elapsed_s': round(elapsed, 2),
+        'photos_per_s': round(len(todo) / elapsed, 1) if elapsed else None,
+        'statuses': dict(sorted(summary.items()))
+    }
+    return summary, report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv', help='CSV with user_id and image columns')
+    parser.add_argument('--image-dir', help='folder relative image paths are resolved against')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='pipeline processes')
+    parser.add_argument('--batch-size', type=int, default=200, help='registrations per transaction')
+    parser.add_argument('--report', help='write the per-file report to this CSV')
+    parser.add_argument('--allow-duplicates', action='store_true',
+                        help='skip the check for faces enrolled on other accounts')
+    parser.add_argument('--dry-run', action='store_true', help='process the photos without writing')
+    args = parser.parse_args(argv)
+
+    entries = read_manifest(args.csv, args.image_dir)
+    api.check_template_column()
+    summary, report = bulk_enroll(entries, args.workers, args.batch_size,
+                                  not args.allow_duplicates, args.dry_run)
+    if args.report:
+        write_report(args.report, report)
+
+    print(json.dumps(summary, indent=2))
+    return 0 if summary['processed'] == summary['statuses'].get('enrolled', 0) + \
+        summary['statuses'].get('would_enroll', 0) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Approximate nearest-neighbour (IVF) index for face signatures
+
+Signatures are compared with calculate_similarity's weighted Euclidean
+distance (geometry features count double). Scaling every vector by those
+weights turns that into plain Euclidean distance, so the index clusters the
+scaled vectors with k-means and keeps one inverted list of gallery rows per
+cluster. A search scores only the rows in the `nprobe` clusters whose
+centroids are closest to the probe: more probes means higher recall and
+more work, nprobe == nlist is an exact search.
+
+IVFIndex is immutable; add() and remove() return a new index that shares
+every untouched inverted list with the old one, which fits FaceGallery's
+copy-on-write snapshots.
+"""
+import math
+
+import numpy as np
+
+def default_nlist(count):
+    """About 2 * sqrt(N) clusters: lists of ~sqrt(N) / 2 rows each"""
+    return max(1, min(count, int(round(2 * math.sqrt(count)))))
+
+def _sq_distances(vectors, centroids, centroid_norms):
+    """(N, K) squared Euclidean distances, via |x|^2 - 2 x.c + |c|^2"""
+    distances = centroid_norms[None, :] - 2.0 * (vectors @ centroids.T)
+    distances += np.einsum('ij,ij->i', vectors, vectors)[:, None]
+    return distances
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    """Lloyd's k-means seeded with k distinct random rows; returns (k, D) float32 centroids"""
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    k = min(k, count)
+    centroids = vectors[rng.choice(count, k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        norms = np.einsum('ij,ij->i', centroids, centroids)
+        labels = np.argmin(_sq_distances(vectors, centroids, norms), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        # Sum each cluster's members in one pass over the label-sorted vectors
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        sums = np.add.reduceat(vectors[order], starts, axis=0, dtype=np.float64)
+        centroids[filled] = (sums / counts[filled, None]).astype(np.float32)
+        # Re-seed empty clusters on random points so every list stays useful
+        if not filled.all():
+            centroids[~filled] = vectors[rng.integers(count, size=int((~filled).sum()))]
+    return centroids
+
+class IVFIndex:
+    """Inverted-file index over the rows of a gallery matrix"""
+
+    def __init__(self, weights, centroids, lists, assignments, trained_on):
+        self.weights = weights
+        self.centroids = centroids
+        self.centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self.lists = lists                  # tuple of int32 row arrays, one per centroid
+        self.assignments = assignments      # row -> list number
+        self.trained_on = trained_on        # gallery size at training time
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.assignments)
+
+    @classmethod
+    def train(cls, matrix, weights, nlist=None, iterations=10, sample=None, seed=0):
+        """Cluster `matrix` (N, D) and index all of its rows
+
+        k-means runs on at most `sample` rows (default 64 per list); every
+        row is then assigned to its nearest centroid.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        count = len(matrix)
+        nlist = min(nlist or default_nlist(count), count)
+        scaled = np.asarray(matrix, dtype=np.float32) * weights
+
+        rng = np.random.default_rng(seed)
+        sample = sample or 64 * nlist
+        training = scaled if count <= sample else scaled[rng.choice(count, sample, replace=False)]
+        centroids = kmeans(training, nlist, iterations, seed)
+
+        assignments = cls._assign(scaled, centroids)
+        return cls(weights, centroids, cls._lists(assignments, len(centroids)), assignments, count)
+
+    def reindex(self, matrix):
+        """A new index over `matrix` that keeps these centroids (no k-means run)"""
+        scaled = np.asarray(matrix, dtype=np.float32) * self.weights
+        assignments = self._assign(scaled, self.centroids)
+        return IVFIndex(self.weights, self.centroids, self._lists(assignments, self.nlist),
+                        assignments, self.trained_on)
+
+    @staticmethod
+    def _lists(assignments, nlist):
+        order = np.argsort(assignments, kind='stable').astype(np.int32)
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        return tuple(order[bounds[i]:bounds[i + 1]] for i in range(nlist))
+
+    @staticmethod
+    def _assign(scaled, centroids):
+        norms = np.einsum('ij,ij->i', centroids, centroids)
+        assignments = np.empty(len(scaled), dtype=np.int32)
+        # Chunked so a 100k-row gallery does not need a 100k x nlist temporary at once
+        for start in range(0, len(scaled), 8192):
+            chunk = scaled[start:start + 8192]
+            assignments[start:start + len(chunk)] = np.argmin(_sq_distances(chunk, centroids, norms), axis=1)
+        return assignments
+
+    def _replace(self, changes, assignments):
+        lists = list(self.lists)
+        for number, rows in changes.items():
+            lists[number] = rows
+        return IVFIndex(self.weights, self.centroids, tuple(lists), assignments, self.trained_on)
+
+    def add(self, row, vector):
+        """Index `vector`, stored at gallery row `row` (must be the next row)"""
+        return self.add_many(row, np.asarray(vector, dtype=np.float32)[None, :])
+
+    def add_many(self, row, vectors):
+        """Index `vectors`, stored at gallery rows row, row + 1, ... (must be the next rows)"""
+        if row != len(self.assignments):
+            raise ValueError('Rows must be added in order')
+        numbers = self._assign(np.asarray(vectors, dtype=np.float32) * self.weights, self.centroids)
+        added = np.arange(row, row + len(numbers), dtype=np.int32)
+        changes = {int(number): np.concatenate([self.lists[number], added[numbers == number]]).astype(np.int32)
+                   for number in np.unique(numbers)}
+        return self._replace(changes, np.concatenate([self.assignments, numbers]))
+
+    def remove(self, row):
+        """Drop gallery row `row`; the last row moves into its place (swap-remove)"""
+        last = len(self.assignments) - 1
+        number = int(self.assignments[row])
+        changes = {number: self.lists[number][self.lists[number] != row]}
+        assignments = self.assignments[:last].copy()
+        if row != last:
+            moved = int(self.assignments[last])
+            rows = changes.get(moved, self.lists[moved]).copy()
+            rows[rows == last] = row
+            changes[moved] = rows
+            assignments[row] = moved
+        return self._replace(changes, assignments)
+
+    def candidates(self, probe, nprobe):
+        """Gallery rows in the `nprobe` lists nearest to the (unweighted) probe"""
+        scaled = np.asarray(probe, dtype=np.float32) * self.weights
+        distances = self.centroid_norms - 2.0 * (self.centroids @ scaled)
+        nprobe = min(max(1, nprobe), self.nlist)
+        nearest = np.argpartition(distances, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+        return np.concatenate([self.lists[number] for number in nearest])
+
+    def status(self):
+        sizes = np.array([len(rows) for rows in self.lists])
+        return {
+            'nlist': self.nlist,
+            'rows': len(self),
+            'trained_on': self.trained_on,
+            'largest_list': int(sizes.max()) if len(sizes) else 0,
+            'empty_lists': int((sizes == 0).sum())
+        }
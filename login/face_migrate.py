@@ -0,0 +1,458 @@
+"""
+Schema and data migrations for the face recognition tables
+
+    python face_migrate.py templates [--batch-size 500] [--keep-json] [--dry-run]
+    python face_migrate.py hash-index [--dry-run]
+    python face_migrate.py schema [--photos ids.csv] [--rate 100] [--checkpoint FILE]
+                                  [--restart] [--reset-stale] [--report FILE] [--dry-run]
+
+templates
+    Adds the users.face_template BLOB column if it is missing and converts
+    every registered face that still stores its signature as a JSON list in
+    users.face_encoding into the binary template format. The JSON column is
+    reduced to registration metadata unless --keep-json is given. Rows are
+    processed in id order in batches, so the command can be stopped and
+    re-run safely.
+
+    Deploy order: run this before starting a face_auth_secure.py that
+    reads face_template. A server started without the column falls back
+    to JSON signatures in face_encoding and cannot read rows converted
+    without --keep-json, so if servers are already running, migrate with
+    --keep-json and restart them afterwards.
+
+hash-index
+    Creates the UNIQUE index idx_users_face_hash on users.face_hash, so the
+    duplicate-face check at registration (HASH_OWNER_QUERY) is an index
+    lookup instead of a full table scan, and two registrations of the same
+    face racing past that check cannot both be written. A plain index of
+    that name from an earlier run is replaced. Refuses (and lists them) if
+    registered faces already share a hash; remove one registration of each
+    first.
+
+schema
+    Brings every registered template to the current FEATURE_SCHEMA_VERSION.
+    A template of an older schema is rewritten with FEATURE_MIGRATIONS when
+    its features can be converted, re-extracted from the user's photo when
+    --photos (a face_bulk_enroll.py style user_id,image CSV) has one, and
+    otherwise reported as needing re-enrollment (--reset-stale clears those
+    registrations so the users are asked to register again). Until then
+    verify/test refuse to compare them.
+
+    Users are read in id order, one --chunk-size chunk per short query, and
+    each chunk is committed before the next. The last committed id is saved
+    in --checkpoint, so an interrupted run resumes where it stopped
+    (--restart starts over). --rate caps rows per second and the job lowers
+    its own CPU priority, so live logins keep the database and the CPU.
+    --report rows are appended after each chunk is committed, and a
+    resumed run appends to the report of the run it continues.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import face_auth_secure as api
+
+def column_exists(connection, column):
+    """Check for a users column in a way that works on MySQL and the stand-in"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT {column} FROM users LIMIT 1")
+        cursor.fetchall()
+        return True
+    except Exception:
+        connection.rollback()
+        return False
+    finally:
+        cursor.close()
+
+def ensure_template_column(connection, dry_run=False):
+    if column_exists(connection, 'face_template'):
+        return False
+    print("[MIGRATE] Adding users.face_template column")
+    if not dry_run:
+        cursor = connection.cursor()
+        cursor.execute("ALTER TABLE users ADD COLUMN face_template BLOB NULL")
+        connection.commit()
+        cursor.close()
+    return True
+
+HASH_INDEX = 'idx_users_face_hash'
+
+DUPLICATE_HASHES_QUERY = """
+    SELECT face_hash, COUNT(*) FROM users
+    WHERE face_hash IS NOT NULL
+    GROUP BY face_hash
+    HAVING COUNT(*) > 1
+"""
+
+def index_state(connection, name):
+    """None when the users index is missing, else whether it is UNIQUE"""
+    cursor = connection.cursor()
+    if api.DB_STANDIN_PATH:
+        cursor.execute('SELECT "unique" FROM pragma_index_list(\'users\') WHERE name = %s', (name,))
+    else:
+        cursor.execute("""
+            SELECT non_unique = 0 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'users' AND index_name = %s
+        """, (name,))
+    row = cursor.fetchone()
+    cursor.fetchall()
+    cursor.close()
+    return None if row is None else bool(row[0])
+
+def create_hash_index(dry_run=False):
+    """UNIQUE index on users.face_hash; returns a summary dict"""
+    with api.db_pool.connection() as connection:
+        if not connection:
+            raise RuntimeError('Database connection failed')
+
+        unique = index_state(connection, HASH_INDEX)
+        if unique:
+            print(f"[MIGRATE] {HASH_INDEX} already exists")
+            return {'created': False}
+
+        cursor = connection.cursor()
+        cursor.execute(DUPLICATE_HASHES_QUERY)
+        duplicates = cursor.fetchall()
+        cursor.close()
+        if duplicates:
+            for face_hash, count in duplicates:
+                print(f"[MIGRATE] Face hash {face_hash[:16]}... is registered on {count} users")
+            print(f"[MIGRATE] Not creating {HASH_INDEX} while registered faces share a hash")
+            return {'created': False, 'failed': len(duplicates)}
+
+        print(f"[MIGRATE] {'Replacing' if unique is False else 'Creating'} {HASH_INDEX} (UNIQUE)")
+        if not dry_run:
+            # face_hash is a 64-character hex digest; the prefix also covers TEXT columns
+            column = 'face_hash' if api.DB_STANDIN_PATH else 'face_hash(64)'
+            cursor = connection.cursor()
+            if unique is False:
+                cursor.execute(f"DROP INDEX {HASH_INDEX}" if api.DB_STANDIN_PATH
+                               else f"DROP INDEX {HASH_INDEX} ON users")
+            cursor.execute(f"CREATE UNIQUE INDEX {HASH_INDEX} ON users ({column})")
+            connection.commit()
+            cursor.close()
+        return {'created': not dry_run}
+
+def convert_row(row, keep_json):
+    """Return (face_template, face_encoding) for one legacy JSON row"""
+    stored_data = json.loads(row['face_encoding'])
+    face_hash = stored_data.get('hash') or row['face_hash'] or ''
+    # Keep the schema the signature was extracted with, so outdated rows stay flagged
+    face_template = api.pack_face_template(stored_data['signature'], face_hash,
+                                           schema=stored_data.get('feature_schema', api.LEGACY_FEATURE_SCHEMA))
+
+    if keep_json:
+        return face_template, row['face_encoding']
+
+    metadata = {key: value for key, value in stored_data.items() if key != 'signature'}
+    metadata['template_version'] = api.TEMPLATE_FORMAT_VERSION
+    return face_template, json.dumps(metadata)
+
+def migrate_templates(batch_size=500, keep_json=False, dry_run=False):
+    """Convert JSON signatures to binary templates; returns a summary dict"""
+    summary = {'converted': 0, 'failed': 0, 'json_bytes': 0, 'template_bytes': 0}
+
+    with api.db_pool.connection() as connection:
+        if not connection:
+            raise RuntimeError('Database connection failed')
+
+        column_added = ensure_template_column(connection, dry_run)
+        if dry_run and column_added:
+            print("[MIGRATE] Dry run: column missing, nothing to convert yet")
+            return summary
+
+        last_id = 0
+        while True:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT id, face_encoding, face_hash
+                FROM users
+                WHERE face_registered = 1 AND face_template IS NULL
+                  AND face_encoding IS NOT NULL AND id > %s
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            cursor.close()
+            if not rows:
+                break
+
+            updates = []
+            for row in rows:
+                last_id = row['id']
+                try:
+                    face_template, face_encoding = convert_row(row, keep_json)
+                except Exception as e:
+                    summary['failed'] += 1
+                    print(f"[MIGRATE] User {row['id']}: cannot convert ({e})")
+                    continue
+                summary['json_bytes'] += len(row['face_encoding'])
+                summary['template_bytes'] += len(face_template)
+                updates.append((face_template, face_encoding, row['id']))
+
+            if updates and not dry_run:
+                cursor = connection.cursor()
+                cursor.executemany("""
+                    UPDATE users
+                    SET face_template = %s, face_encoding = %s
+                    WHERE id = %s AND face_template IS NULL
+                """, updates)
+                connection.commit()
+                cursor.close()
+
+            summary['converted'] += len(updates)
+            print(f"[MIGRATE] Converted {summary['converted']} faces (last id {last_id})")
+
+    return summary
+
+SCHEMA_CHUNK_QUERY = """
+    SELECT id, face_template, face_encoding, face_hash
+    FROM users
+    WHERE face_registered = 1 AND id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+SCHEMA_REMAINING_QUERY = "SELECT COUNT(*) FROM users WHERE face_registered = 1 AND id > %s"
+
+# The face_hash condition skips users who re-registered while the job was running
+SCHEMA_UPDATE_QUERY = """
+    UPDATE users
+    SET face_template = %s, face_encoding = %s, face_hash = %s
+    WHERE id = %s AND face_registered = 1 AND COALESCE(face_hash, '') = %s
+"""
+
+SCHEMA_RESET_QUERY = """
+    UPDATE users
+    SET face_template = NULL, face_encoding = NULL, face_registered = 0, face_hash = NULL
+    WHERE id = %s AND face_registered = 1 AND COALESCE(face_hash, '') = %s
+"""
+
+def load_checkpoint(path, restart=False):
+    """Saved progress of an earlier run for the current schema, or a fresh state"""
+    fresh = {'schema': api.FEATURE_SCHEMA_VERSION, 'last_id': 0, 'done': False, 'summary': {}}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        state = json.load(f)
+    if state.get('schema') != api.FEATURE_SCHEMA_VERSION:
+        print(f"[MIGRATE] Checkpoint is for schema {state.get('schema')}, starting over")
+        return fresh
+    return state
+
+def save_checkpoint(path, state):
+    state['updated_at'] = datetime.now().isoformat()
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporary, path)
+
+SCHEMA_REPORT_FIELDS = ['user_id', 'status', 'message']
+
+@contextmanager
+def schema_report(path, resume=False):
+    """Callable that appends report rows to the --report CSV and flushes them
+
+    A resumed run keeps the rows already in the file; otherwise the file
+    starts over with a header. Without a path the rows are dropped.
+    """
+    if not path:
+        yield lambda rows: None
+        return
+    append = resume and os.path.exists(path) and os.path.getsize(path) > 0
+    with open(path, 'a' if append else 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SCHEMA_REPORT_FIELDS)
+        if not append:
+            writer.writeheader()
+
+        def write(rows):
+            writer.writerows(rows)
+            f.flush()
+        yield write
+
+def template_metadata(face_encoding, face_hash, feature_count):
+    """Registration metadata for a rewritten template, keeping what was stored before"""
+    try:
+        metadata = json.loads(face_encoding) if face_encoding else {}
+    except ValueError:
+        metadata = {}
+    metadata.pop('signature', None)
+    metadata.update({
+        'hash': face_hash,
+        'feature_count': feature_count,
+        'template_version': api.TEMPLATE_FORMAT_VERSION,
+        'feature_schema': api.FEATURE_SCHEMA_VERSION,
+        'migrated_at': datetime.now().isoformat()
+    })
+    return json.dumps(metadata)
+
+def upgrade_row(row, photos):
+    """Decide what to do with one user's template
+
+    Returns (status, (features, face_hash) or None, message); status is
+    current, converted, re_extracted, needs_reenrollment, reextract_failed
+    or invalid.
+    """
+    try:
+        features, face_hash, schema = api.decode_stored_face(
+            row['face_template'], row['face_encoding'], row['face_hash'])
+    except Exception as e:
+        return 'invalid', None, str(e)
+
+    if api.template_compatible(schema, features):
+        return 'current', None, ''
+
+    migrate = api.FEATURE_MIGRATIONS.get(schema)
+    if migrate is not None:
+        converted = migrate(features)
+        if api.template_compatible(api.FEATURE_SCHEMA_VERSION, converted):
+            return 'converted', (converted, face_hash), f'schema {schema}'
+
+    photo = photos.get(int(row['id']))
+    if photo is None:
+        return 'needs_reenrollment', None, f'schema {schema}, {len(features)} features'
+
+    try:
+        with open(photo, 'rb') as f:
+            result = api.run_face_pipeline(f.read(), check_quality=True)
+    except OSError as e:
+        return 'reextract_failed', None, str(e)
+    if result['status'] != 'ok':
+        return 'reextract_failed', None, result.get('message', result['status'])
+    return 're_extracted', (result['features'], result['hash']), os.path.basename(photo)
+
+def read_photos(csv_path):
+    """{user_id: photo path} from a user_id,image CSV (paths relative to the CSV)"""
+    import face_bulk_enroll
+    return {int(user_id): image for _, user_id, image in face_bulk_enroll.read_manifest(csv_path)
+            if user_id.isdigit()}
+
+def migrate_schema(photos=None, chunk_size=200, rate=100.0, checkpoint='face_schema_migration.json',
+                   restart=False, reset_stale=False, report_path=None, dry_run=False, nice=10):
+    """Upgrade stored templates to FEATURE_SCHEMA_VERSION; returns a summary dict"""
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+    photos = photos or {}
+    state = load_checkpoint(checkpoint, restart)
+    summary = state['summary']
+    if state['done']:
+        print(f"[MIGRATE] Schema {api.FEATURE_SCHEMA_VERSION} migration already finished (--restart to rerun)")
+        return summary
+
+    start = time.perf_counter()
+    processed = 0
+
+    with api.db_pool.connection() as connection, \
+            schema_report(report_path, resume=state['last_id'] > 0) as write_report:
+        if not connection:
+            raise RuntimeError('Database connection failed')
+
+        cursor = connection.cursor()
+        cursor.execute(SCHEMA_REMAINING_QUERY, (state['last_id'],))
+        remaining = cursor.fetchone()[0]
+        cursor.close()
+        print(f"[MIGRATE] {remaining} registered faces after id {state['last_id']} "
+              f"to check against schema {api.FEATURE_SCHEMA_VERSION}")
+
+        while True:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute(SCHEMA_CHUNK_QUERY, (state['last_id'], chunk_size))
+            rows = cursor.fetchall()
+            cursor.close()
+            if not rows:
+                break
+
+            updates, resets, report = [], [], []
+            for row in rows:
+                status, upgraded, message = upgrade_row(row, photos)
+                summary[status] = summary.get(status, 0) + 1
+                old_hash = row['face_hash'] or ''
+                if upgraded is not None:
+                    features, face_hash = upgraded
+                    updates.append((
+                        api.pack_face_template(features, face_hash),
+                        template_metadata(row['face_encoding'], face_hash, len(features)),
+                        face_hash, row['id'], old_hash
+                    ))
+                elif status == 'needs_reenrollment' and reset_stale:
+                    resets.append((row['id'], old_hash))
+                if status != 'current':
+                    report.append({'user_id': row['id'], 'status': status, 'message': message})
+
+            if not dry_run and (updates or resets):
+                cursor = connection.cursor()
+                if updates:
+                    cursor.executemany(SCHEMA_UPDATE_QUERY, updates)
+                if resets:
+                    cursor.executemany(SCHEMA_RESET_QUERY, resets)
+                connection.commit()
+                cursor.close()
+
+            # Before the checkpoint: an interrupted chunk is reported twice rather than not at all
+            write_report(report)
+            state['last_id'] = rows[-1]['id']
+            processed += len(rows)
+            if not dry_run:
+                save_checkpoint(checkpoint, state)
+
+            elapsed = time.perf_counter() - start
+            eta = (remaining - processed) / (processed / elapsed) if processed and elapsed else 0
+            print(f"[MIGRATE] {processed}/{remaining} faces (last id {state['last_id']}), "
+                  f"{processed / elapsed:.0f}/s, about {eta:.0f}s left")
+
+            # Throttle: never run faster than `rate` rows per second
+            if rate:
+                time.sleep(max(0.0, processed / rate - (time.perf_counter() - start)))
+
+    state['done'] = True
+    if not dry_run:
+        save_checkpoint(checkpoint, state)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    templates = commands.add_parser('templates', help='convert JSON signatures to binary templates')
+    templates.add_argument('--batch-size', type=int, default=500)
+    templates.add_argument('--keep-json', action='store_true', help='leave the JSON signature in face_encoding')
+    templates.add_argument('--dry-run', action='store_true', help='report without writing')
+
+    hash_index = commands.add_parser('hash-index', help='unique index on users.face_hash for duplicate checks')
+    hash_index.add_argument('--dry-run', action='store_true', help='report without writing')
+
+    schema = commands.add_parser('schema', help='upgrade templates to the current feature schema')
+    schema.add_argument('--photos', help='user_id,image CSV used to re-extract outdated templates')
+    schema.add_argument('--chunk-size', type=int, default=200, help='users read and committed per chunk')
+    schema.add_argument('--rate', type=float, default=100.0, help='maximum users per second (0 = unthrottled)')
+    schema.add_argument('--checkpoint', default='face_schema_migration.json', help='progress file for resuming')
+    schema.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from the first user')
+    schema.add_argument('--reset-stale', action='store_true',
+                        help='clear registrations that can be neither converted nor re-extracted')
+    schema.add_argument('--report', help='write every non-current user to this CSV (appended to on resume)')
+    schema.add_argument('--nice', type=int, default=10, help='CPU priority decrease for this process')
+    schema.add_argument('--dry-run', action='store_true', help='report without writing')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'templates':
+        summary = migrate_templates(args.batch_size, args.keep_json, args.dry_run)
+    elif args.command == 'hash-index':
+        summary = create_hash_index(args.dry_run)
+    elif args.command == 'schema':
+        photos = read_photos(args.photos) if args.photos else None
+        summary = migrate_schema(photos, args.chunk_size, args.rate, args.checkpoint, args.restart,
+                                 args.reset_stale, args.report, args.dry_run, args.nice)
+
+    print(json.dumps(summary, indent=2))
+    return 1 if summary.get('failed') else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
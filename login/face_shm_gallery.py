@@ -0,0 +1,318 @@
+"""
+Shared-memory copy of the face gallery for multi-process deployments
+
+With FACE_GALLERY_SHM set, every server process (gunicorn/uvicorn worker)
+attaches to one gallery instead of loading its own copy from MySQL. One
+process, the owner (whoever holds the `<name>.lock` file lock), keeps the
+gallery in sync with the database and publishes it; the others only read.
+
+Two kinds of segments are used:
+
+- the control segment `<name>` (one page, never resized) holds the current
+  generation and a ring of user ids that readers changed (register/remove)
+  and the owner still has to pick up
+- one data segment `<name>_<generation>` per published gallery: user ids,
+  the signature matrix, face hashes, profiles, the outdated-template ids
+  and the IVF index assignments, laid out as flat arrays. A data segment
+  is never written after it is published
+
+Readers compare the generation (one aligned 64-bit read, no lock) on every
+access and attach to the new data segment when it moved. The owner unlinks
+the previous segment right after publishing; readers that still map it
+keep a valid mapping until their last in-flight search drops it.
+"""
+import fcntl
+import json
+import os
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from face_index import IVFIndex
+
+CONTROL_MAGIC = 0x46414345474C3031  # 'FACEGL01'
+DATA_MAGIC = 0x46414345474C4431     # 'FACEGLD1'
+RING_SIZE = 1000
+HASH_BYTES = 64                      # sha256 hex digest
+ALIGN = 64
+
+# Control segment words
+_MAGIC, _GENERATION, _OWNER_PID, _RING_HEAD = range(4)
+_RING_START = 8
+
+def _untracked(segment):
+    """Take a segment away from this process's resource tracker
+
+    Segments outlive the process that created or attached them (ownership
+    moves between processes), so no tracker may unlink them at exit; the
+    owner unlinks each one once it is superseded (unlink_segment).
+    """
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+def _attach(name):
+    return _untracked(shared_memory.SharedMemory(name=name))
+
+def _create(name, size):
+    return _untracked(shared_memory.SharedMemory(name=name, create=True, size=size))
+
+def unlink_segment(name):
+    """Remove a segment by name, if it still exists; mappings of it stay valid"""
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    # SharedMemory.unlink() unregisters the name it registered when attaching
+    segment.close()
+    segment.unlink()
+    return True
+
+def _lock_path(name, suffix='lock'):
+    return os.path.join(tempfile.gettempdir(), f'{name.strip("/")}.{suffix}')
+
+class OwnerLock:
+    """Non-blocking exclusive file lock; released when the holding process exits"""
+
+    def __init__(self, name):
+        self.path = _lock_path(name)
+        self._fd = None
+
+    def try_acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+class GalleryControl:
+    """The control segment: current generation plus the ring of changed user ids"""
+
+    def __init__(self, name):
+        self.name = name
+        size = (_RING_START + RING_SIZE) * 8
+        try:
+            # Outlives any single process: a new owner must find the same control segment
+            self._segment = _create(name, size)
+            self._words = np.ndarray((size // 8,), dtype=np.uint64, buffer=self._segment.buf)
+            self._words[:] = 0
+            self._words[_MAGIC] = CONTROL_MAGIC
+        except FileExistsError:
+            self._segment = _attach(name)
+            self._words = np.ndarray((size // 8,), dtype=np.uint64, buffer=self._segment.buf)
+        self._ring_lock = _lock_path(name, 'ring.lock')
+
+    @property
+    def generation(self):
+        return int(self._words[_GENERATION])
+
+    def publish(self, generation, owner_pid):
+        self._words[_OWNER_PID] = owner_pid
+        self._words[_GENERATION] = generation
+
+    @property
+    def ring_head(self):
+        return int(self._words[_RING_HEAD])
+
+    def request_refresh(self, user_id):
+        """Ask the owner to reload one user from the database (any process)"""
+        fd = os.open(self._ring_lock, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            head = int(self._words[_RING_HEAD])
+            self._words[_RING_START + head % RING_SIZE] = int(user_id)
+            self._words[_RING_HEAD] = head + 1
+        finally:
+            os.close(fd)
+
+    def changed_since(self, tail):
+        """(user ids appended after `tail`, new tail); None for the ids if the ring overflowed"""
+        head = self.ring_head
+        if head - tail > RING_SIZE:
+            return None, head
+        return [int(self._words[_RING_START + i % RING_SIZE]) for i in range(tail, head)], head
+
+def array_shapes(count, dim, nlist, stale_count, profile_bytes):
+    """(dtype, shape) of every array a gallery is stored as, in storage order"""
+    return {
+        'user_ids': (np.int64, (count,)),
+        'matrix': (np.float32, (count, dim)),
+        'sorted_ids': (np.int64, (count,)),
+        'id_rows': (np.int32, (count,)),
+        'sorted_hashes': (f'S{HASH_BYTES}', (count,)),
+        'hash_rows': (np.int32, (count,)),
+        'profile_offsets': (np.int64, (count + 1,)),
+        'profiles': (np.uint8, (profile_bytes,)),
+        'stale': (np.int64, (stale_count,)),
+        'centroids': (np.float32, (nlist, dim)),
+        'assignments': (np.int32, (count if nlist else 0,)),
+    }
+
+def gallery_arrays(user_ids, matrix, row_hashes, row_profiles, stale, index):
+    """The flat arrays a gallery is stored as, here and in face_snapshot.py
+
+    row_hashes and row_profiles are aligned with user_ids ('' / dict).
+    Returns (arrays, counts) where counts is what array_shapes() needs
+    plus the index's trained_on.
+    """
+    count, dim = matrix.shape
+    ids = np.asarray(user_ids, dtype=np.int64).reshape(count)
+    profiles = [json.dumps(profile, separators=(',', ':')).encode('utf-8') for profile in row_profiles]
+    profile_offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in profiles], out=profile_offsets[1:])
+    hashes = np.array([(h or '').encode('ascii') for h in row_hashes], dtype=f'S{HASH_BYTES}').reshape(count)
+    id_order = np.argsort(ids, kind='stable').astype(np.int32)
+    hash_order = np.argsort(hashes, kind='stable').astype(np.int32)
+    nlist = index.nlist if index is not None else 0
+
+    arrays = {
+        'user_ids': ids,
+        'matrix': np.asarray(matrix, dtype=np.float32),
+        'sorted_ids': ids[id_order],
+        'id_rows': id_order,
+        'sorted_hashes': hashes[hash_order],
+        'hash_rows': hash_order,
+        'profile_offsets': profile_offsets,
+        'profiles': np.frombuffer(b''.join(profiles), dtype=np.uint8),
+        'stale': np.array(sorted(stale), dtype=np.int64),
+        'centroids': index.centroids if nlist else np.empty((0, dim), dtype=np.float32),
+        'assignments': index.assignments if nlist else np.empty(0, dtype=np.int32),
+    }
+    counts = {
+        'count': count,
+        'dim': dim,
+        'nlist': nlist,
+        'stale_count': len(stale),
+        'profile_bytes': int(profile_offsets[-1]),
+        'trained_on': index.trained_on if nlist else 0
+    }
+    return arrays, counts
+
+def snapshot_fields(arrays, weights, trained_on):
+    """FaceGallery snapshot fields over stored arrays (views are used as they are)"""
+    user_ids = arrays['user_ids']
+    nlist = len(arrays['centroids'])
+    index = None
+    if nlist:
+        index = IVFIndex(np.asarray(weights, dtype=np.float32), arrays['centroids'],
+                         IVFIndex._lists(arrays['assignments'], nlist), arrays['assignments'], trained_on)
+    return {
+        'user_ids': user_ids,
+        'matrix': arrays['matrix'],
+        'hashes': HashLookup(arrays['sorted_hashes'], arrays['hash_rows'], user_ids),
+        'users': ProfileLookup(arrays['sorted_ids'], arrays['id_rows'], arrays['profile_offsets'], arrays['profiles']),
+        'stale': frozenset(int(v) for v in arrays['stale']),
+        'index': index,
+    }
+
+_HEADER_FIELDS = ('count', 'dim', 'nlist', 'stale_count', 'profile_bytes', 'trained_on')
+
+def _layout(shapes):
+    """Byte offset of every array in a data segment (after the header), and the total size"""
+    offsets, position = {}, 16 * 8
+    for key, (dtype, shape) in shapes.items():
+        offsets[key] = position
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        position += -(-size // ALIGN) * ALIGN
+    return offsets, position
+
+def write_segment(name, arrays, counts):
+    """Create and fill one data segment from gallery_arrays(); returns its size in bytes"""
+    shapes = array_shapes(*(counts[field] for field in _HEADER_FIELDS[:5]))
+    offsets, size = _layout(shapes)
+
+    try:
+        segment = _create(name, size)
+    except FileExistsError:
+        # Left over from an owner that died before unlinking it
+        unlink_segment(name)
+        segment = _create(name, size)
+
+    header = np.ndarray((16,), dtype=np.uint64, buffer=segment.buf)
+    header[0] = DATA_MAGIC
+    header[1:1 + len(_HEADER_FIELDS)] = [counts[field] for field in _HEADER_FIELDS]
+    for key, (dtype, shape) in shapes.items():
+        np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offsets[key])[...] = arrays[key]
+    del header
+    segment.close()
+    return size
+
+class HashLookup:
+    """face_hash -> user_id over a sorted hash column (a read-only dict stand-in)"""
+
+    def __init__(self, sorted_hashes, hash_rows, user_ids):
+        self._sorted = sorted_hashes
+        self._rows = hash_rows
+        self._user_ids = user_ids
+
+    def get(self, face_hash, default=None):
+        if not face_hash or not len(self._sorted):
+            return default
+        key = face_hash.encode('ascii')
+        position = int(np.searchsorted(self._sorted, key))
+        if position < len(self._sorted) and self._sorted[position] == key:
+            return int(self._user_ids[self._rows[position]])
+        return default
+
+    def items(self):
+        """Every (face_hash, user_id); used when a writer copies the gallery"""
+        user_ids = self._user_ids.tolist()
+        for face_hash, row in zip(self._sorted.tolist(), self._rows.tolist()):
+            if face_hash:
+                yield face_hash.decode('ascii'), user_ids[row]
+
+class ProfileLookup:
+    """user_id -> public profile, decoded on demand (a read-only dict stand-in)"""
+
+    def __init__(self, sorted_ids, id_rows, offsets, blob):
+        self._sorted = sorted_ids
+        self._rows = id_rows
+        self._offsets = offsets
+        self._blob = blob
+
+    def _profile(self, row):
+        return json.loads(self._blob[self._offsets[row]:self._offsets[row + 1]].tobytes())
+
+    def get(self, user_id, default=None):
+        position = int(np.searchsorted(self._sorted, int(user_id)))
+        if position >= len(self._sorted) or self._sorted[position] != int(user_id):
+            return default
+        return self._profile(self._rows[position])
+
+    def items(self):
+        """Every (user_id, profile); used when a writer copies the gallery"""
+        # One json.loads over the whole blob instead of one per profile
+        blob, offsets = self._blob.tobytes(), self._offsets.tolist()
+        profiles = json.loads(b'[' + b','.join(blob[start:end] for start, end in zip(offsets, offsets[1:])) + b']')
+        for user_id, row in zip(self._sorted.tolist(), self._rows.tolist()):
+            yield user_id, profiles[row]
+
+def read_segment(name, weights):
+    """Attach a data segment; returns FaceGallery snapshot fields backed by it
+
+    The arrays are views into the segment, which stays mapped for as long
+    as any of them is referenced.
+    """
+    segment = _attach(name)
+    header = np.ndarray((16,), dtype=np.uint64, buffer=segment.buf)
+    if int(header[0]) != DATA_MAGIC:
+        raise ValueError(f'{name} is not a gallery segment')
+    counts = dict(zip(_HEADER_FIELDS, (int(v) for v in header[1:1 + len(_HEADER_FIELDS)])))
+    shapes = array_shapes(*(counts[field] for field in _HEADER_FIELDS[:5]))
+    offsets, _ = _layout(shapes)
+
+    arrays = {}
+    for key, (dtype, shape) in shapes.items():
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=offsets[key])
+        arrays[key].flags.writeable = False
+    fields = snapshot_fields(arrays, weights, counts['trained_on'])
+    fields['segment'] = segment
+    return fields
+
+def segment_name(name, generation):
+    return f'{name}_{generation}'
@@ -0,0 +1,155 @@
+"""
+On-disk gallery snapshot for fast cold starts
+
+    python face_snapshot.py export [--dir /var/lib/face-gallery]
+    python face_snapshot.py info [--dir /var/lib/face-gallery]
+
+A worker that has to run LOAD_QUERY and decode every template before it can
+identify anyone starts slower the more faces are enrolled. With
+FACE_GALLERY_SNAPSHOT pointing at a directory, FaceGallery instead maps the
+newest exported snapshot at boot (np.load(mmap_mode='r'): no parsing, the
+pages are shared through the page cache by every worker on the host) and
+then only reads the rows changed since the snapshot's updated_at
+watermark.
+
+Layout of the directory:
+
+    CURRENT                 name of the newest version directory
+    <version>/meta.json     format, feature schema, counts, watermark
+    <version>/<array>.npy   one file per array of face_shm_gallery.array_shapes
+
+Versions are written to a temporary directory and renamed into place, then
+CURRENT is replaced atomically; a worker that still maps an older version
+keeps reading it until it lets go. The service exports after a full reload
+and again once the last export is FACE_GALLERY_SNAPSHOT_MAX_AGE old; the
+`export` command does the same from the command line (e.g. from cron).
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import face_shm_gallery
+
+SNAPSHOT_FORMAT = 1
+
+def _current_version(directory):
+    try:
+        with open(os.path.join(directory, 'CURRENT'), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def export(directory, arrays, counts, schema, watermark=None, invalid=(), keep=2):
+    """Write one snapshot version and make it current; returns its path
+
+    arrays and counts come from face_shm_gallery.gallery_arrays. Returns
+    None when another process is exporting into the same directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    lock = os.open(os.path.join(directory, '.export.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+
+        version = datetime.now().strftime('%Y%m%dT%H%M%S%f') + f'-{os.getpid()}'
+        staging = os.path.join(directory, f'.{version}')
+        os.makedirs(staging)
+        for key, array in arrays.items():
+            np.save(os.path.join(staging, f'{key}.npy'), np.ascontiguousarray(array))
+        meta = dict(counts, format=SNAPSHOT_FORMAT, schema=schema, version=version,
+                    created=time.time(), invalid=sorted(int(user_id) for user_id in invalid),
+                    watermark=watermark.strftime('%Y-%m-%d %H:%M:%S') if watermark else None)
+        with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.rename(staging, os.path.join(directory, version))
+
+        pointer = os.path.join(directory, 'CURRENT.tmp')
+        with open(pointer, 'w', encoding='utf-8') as f:
+            f.write(version + '\n')
+        os.replace(pointer, os.path.join(directory, 'CURRENT'))
+
+        # Versions sort by time; keep the newest few for workers still mapping them
+        versions = sorted(name for name in os.listdir(directory)
+                          if not name.startswith('.') and os.path.isdir(os.path.join(directory, name)))
+        for old in versions[:-keep]:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+        return os.path.join(directory, version)
+    finally:
+        os.close(lock)
+
+def read_meta(directory):
+    version = _current_version(directory)
+    if version is None:
+        return None
+    with open(os.path.join(directory, version, 'meta.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+def _map(path):
+    try:
+        # A plain ndarray view indexes faster than np.memmap and keeps the mapping alive
+        return np.load(path, mmap_mode='r').view(np.ndarray)
+    except ValueError:
+        # Zero-length arrays cannot be mapped
+        return np.load(path)
+
+def load(directory, weights, dim, schema):
+    """(snapshot fields, meta) for the current version, or None if unusable
+
+    None means there is no snapshot yet, or it was written with another
+    format, feature schema or dimension and has to be re-exported.
+    """
+    meta = read_meta(directory)
+    if meta is None or meta.get('format') != SNAPSHOT_FORMAT or meta.get('schema') != schema \
+            or meta.get('dim') != dim:
+        return None
+    path = os.path.join(directory, meta['version'])
+    shapes = face_shm_gallery.array_shapes(meta['count'], meta['dim'], meta['nlist'],
+                                           meta['stale_count'], meta['profile_bytes'])
+    arrays = {}
+    for key, (dtype, shape) in shapes.items():
+        arrays[key] = _map(os.path.join(path, f'{key}.npy'))
+        if arrays[key].dtype != np.dtype(dtype) or arrays[key].shape != shape:
+            return None
+    return face_shm_gallery.snapshot_fields(arrays, weights, meta['trained_on']), meta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['export', 'info'])
+    parser.add_argument('--dir', help='snapshot directory (default: FACE_GALLERY_SNAPSHOT)')
+    args = parser.parse_args(argv)
+
+    import face_auth_secure as api
+    directory = args.dir or api.GALLERY_SNAPSHOT_DIR
+    if not directory:
+        parser.error('no snapshot directory: pass --dir or set FACE_GALLERY_SNAPSHOT')
+
+    if args.command == 'export':
+        # Export once, below, instead of in the background after the load
+        api.face_gallery.snapshot_dir = ''
+        api.check_template_column()
+        with api.db_pool.connection() as connection:
+            if not connection:
+                print('Database connection failed')
+                return 1
+            api.face_gallery.load_all(connection)
+        path = api.face_gallery.export_snapshot(directory)
+        if path is None:
+            print('Another export is running')
+            return 1
+        print(f'Exported {len(api.face_gallery)} faces to {path}')
+
+    meta = read_meta(directory)
+    print(json.dumps(meta, indent=2) if meta else f'No snapshot in {directory}')
+    return 0 if meta else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+Local stand-in for the MySQL `users` table used by face_auth_secure.py
+
+Backed by sqlite3 and shaped like the small part of mysql.connector the face
+API uses (connect, cursor(dictionary=True), %s placeholders, commit, ping,
+is_connected), so the service, its connection pool and the benchmarks can run
+on a box without MySQL:
+
+    FACE_DB_STANDIN=/tmp/frsm_faces.sqlite3 python face_auth_secure.py
+"""
+import re
+import sqlite3
+import threading
+
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT NOT NULL DEFAULT '',
+    last_name TEXT NOT NULL DEFAULT '',
+    email TEXT NOT NULL DEFAULT '',
+    face_template BLOB,
+    face_encoding TEXT,
+    face_registered INTEGER NOT NULL DEFAULT 0,
+    face_hash TEXT,
+    last_face_login TEXT,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TRIGGER IF NOT EXISTS users_touch_updated_at
+AFTER UPDATE ON users
+WHEN NEW.updated_at = OLD.updated_at
+BEGIN
+    UPDATE users SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
+"""
+
+# MySQL spellings the face API uses, rewritten to their sqlite equivalents
+_REWRITES = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bNOW\(\)', re.IGNORECASE), 'CURRENT_TIMESTAMP'),
+    (re.compile(r'\bVERSION\(\)', re.IGNORECASE), 'sqlite_version()'),
+]
+
+_schema_lock = threading.Lock()
+
+class Error(Exception):
+    """Raised for stand-in database failures (mirrors mysql.connector.Error)"""
+
+class IntegrityError(Error):
+    """Raised when a write breaks a UNIQUE index (mirrors mysql.connector.IntegrityError)"""
+
+def translate(query):
+    """Rewrite a MySQL query into sqlite syntax"""
+    for pattern, replacement in _REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+class StandinCursor:
+    def __init__(self, connection, dictionary=False):
+        self._cursor = connection._db.cursor()
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+    def execute(self, query, params=()):
+        try:
+            self._cursor.execute(translate(query), tuple(params))
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        except sqlite3.Error as e:
+            raise Error(str(e)) from e
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, query, seq_params):
+        try:
+            self._cursor.executemany(translate(query), [tuple(p) for p in seq_params])
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+        except sqlite3.Error as e:
+            raise Error(str(e)) from e
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+class StandinConnection:
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._open = True
+
+    def cursor(self, dictionary=False, buffered=None):
+        return StandinCursor(self, dictionary=dictionary)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def is_connected(self):
+        return self._open
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        if not self._open:
+            raise Error('Connection closed')
+
+    def close(self):
+        if self._open:
+            self._db.close()
+            self._open = False
+
+def connect(path):
+    """Open a connection, creating the users table on first use"""
+    try:
+        connection = StandinConnection(path)
+        with _schema_lock:
+            connection._db.executescript(USERS_SCHEMA)
+    except sqlite3.Error as e:
+        raise Error(str(e)) from e
+    return connection
+
+def seed_users(path, count, start_id=1):
+    """Insert `count` placeholder users without faces; returns their ids"""
+    connection = connect(path)
+    cursor = connection.cursor()
+    ids = list(range(start_id, start_id + count))
+    cursor.executemany(
+        "INSERT OR IGNORE INTO users (id, first_name, last_name, email) VALUES (%s, %s, %s, %s)",
+        [(user_id, f'User{user_id}', 'Standin', f'user{user_id}@standin.local') for user_id in ids]
+    )
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return ids
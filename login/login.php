@@ -1939,8 +1939,8 @@ if (isset($_POST['resend_verification'])) {
         faceCanvas.height = faceVideo.videoHeight;
         context.drawImage(faceVideo, 0, 0, faceCanvas.width, faceCanvas.height);
         
-        // Convert canvas to base64
-        const imageBase64 = faceCanvas.toDataURL('image/jpeg', 0.8);
+        // Encode the frame as JPEG and send the bytes as-is (no base64 JSON)
+        const imageBlob = await new Promise(resolve => faceCanvas.toBlob(resolve, 'image/jpeg', 0.8));
         
         // Show loading
         faceLoginLoading.style.display = 'block';
@@ -1950,47 +1950,35 @@ if (isset($_POST['resend_verification'])) {
             // NEW: Search for user by face (no email/username needed)
             showFaceStatus('Searching for matching face...', 'info');
             
-            // First, get ALL users with registered faces
-            const allUsersResponse = await fetch('get_all_face_users.php');
-            const allUsersData = await allUsersResponse.json();
+            // Identify the face against every registered face in one request
+            const identifyResponse = await fetch(`${API_BASE_URL}/api/face/identify`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'image/jpeg' },
+                body: imageBlob
+            });
             
-            if (!allUsersData.success || allUsersData.users.length === 0) {
+            const identifyData = await identifyResponse.json();
+            
+            if (identifyData.success && identifyData.gallery_size === 0) {
                 showFaceStatus('No registered faces found in system.', 'error');
                 faceLoginLoading.style.display = 'none';
                 captureBtn.disabled = false;
                 return;
             }
             
-            console.log(`Found ${allUsersData.users.length} users with registered faces`);
-            
-            // Try to find matching face among all users
             let matchingUser = null;
             let bestSimilarity = 0;
             
-            // Test face against each user
-            for (const user of allUsersData.users) {
-                const testResponse = await fetch(`${API_BASE_URL}/api/face/test/${user.id}`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({
-                        image: imageBase64.split(',')[1]
-                    })
-                });
-                
-                const testData = await testResponse.json();
-                
-                if (testData.success && testData.match) {
-                    if (testData.similarity > bestSimilarity) {
-                        bestSimilarity = testData.similarity;
-                        matchingUser = user;
-                        console.log(`Found potential match: User ${user.id}, similarity: ${testData.similarity}`);
-                    }
-                }
+            if (identifyData.success && identifyData.match) {
+                matchingUser = identifyData.user;
+                bestSimilarity = identifyData.similarity;
+                console.log(`Found match: User ${matchingUser.id}, similarity: ${bestSimilarity}`);
             }
             
             faceLoginLoading.style.display = 'none';
             
-            if (matchingUser && bestSimilarity >= 0.75) {
+            // Same rule as the server: an exact hash match or a score at its threshold
+            if (matchingUser && (identifyData.hash_match || bestSimilarity >= identifyData.threshold)) {
                 // Face recognized! Ask for password for security
                 showFaceStatus(`Face recognized! Welcome ${matchingUser.first_name}.`, 'success');
                 
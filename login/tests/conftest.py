@@ -0,0 +1,35 @@
+"""
+Shared setup for the face API tests
+
+face_auth_secure reads its configuration from the environment at import
+time, so the sqlite stand-in (face_standin_db.py) is selected here, before
+any test module imports it:
+
+    cd login && python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+LOGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, LOGIN_DIR)
+
+STANDIN_PATH = os.path.join(tempfile.mkdtemp(prefix='face_tests_'), 'users.sqlite3')
+os.environ['FACE_DB_STANDIN'] = STANDIN_PATH
+os.environ.setdefault('FACE_LOG_LEVEL', 'WARNING')
+
+import face_standin_db
+
+@pytest.fixture
+def users():
+    """A fresh users table with ten seeded users (ids 1-10), none registered"""
+    connection = face_standin_db.connect(STANDIN_PATH)
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM users")
+    connection.commit()
+    cursor.close()
+    connection.close()
+    face_standin_db.seed_users(STANDIN_PATH, 10)
+    return STANDIN_PATH
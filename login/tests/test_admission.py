@@ -0,0 +1,68 @@
+"""AdmissionControl: bounded concurrency, priorities and 429 shedding"""
+import threading
+
+import pytest
+
+import face_auth_secure as api
+
+def test_admits_up_to_the_limit_then_queues():
+    control = api.AdmissionControl(limit=2, deadline=5, max_queue=4)
+    assert control.enter('verify', lambda: None) is None
+    assert control.enter('verify', lambda: None) is None
+
+    woken = threading.Event()
+    ticket = control.enter('verify', woken.set)
+    assert ticket is not None
+    assert control.status()['waiting'] == 1
+
+    control.release(0.01)
+    assert woken.is_set()
+    assert control.status()['active'] == 2
+
+def test_higher_priority_is_served_first():
+    control = api.AdmissionControl(limit=1, deadline=5, max_queue=4)
+    control.enter('verify', lambda: None)
+    order = []
+    control.enter('test', lambda: order.append('test'))
+    control.enter('register', lambda: order.append('register'))
+    control.enter('identify', lambda: order.append('identify'))
+    for _ in range(3):
+        control.release(0.01)
+    assert order == ['identify', 'register', 'test']
+
+def test_full_queue_is_refused_at_once():
+    control = api.AdmissionControl(limit=1, deadline=5, max_queue=0)
+    control.enter('verify', lambda: None)
+    with pytest.raises(api.Overloaded) as refused:
+        control.enter('verify', lambda: None)
+    assert refused.value.retry_after >= 1
+    assert control.stats['rejected'] == 1
+
+def test_queued_request_gives_up_at_the_deadline():
+    control = api.AdmissionControl(limit=1, deadline=0.05, max_queue=4)
+    control.hold_time = 0.001
+    with control.admit('verify'):
+        with pytest.raises(api.Overloaded):
+            with control.admit('verify'):
+                pass
+    assert control.stats['timed_out'] == 1
+    assert control.status()['active'] == 0
+
+def test_cancel_after_admission_keeps_the_slot():
+    control = api.AdmissionControl(limit=1, deadline=5, max_queue=4)
+    control.enter('verify', lambda: None)
+    ticket = control.enter('verify', lambda: None)
+    control.release(0.01)
+    assert control.cancel('verify', ticket) is None
+    assert control.status()['active'] == 1
+
+def test_overloaded_route_answers_429_with_retry_after(monkeypatch):
+    control = api.AdmissionControl(limit=1, deadline=5, max_queue=0)
+    monkeypatch.setattr(api, 'admission_control', control)
+    client = api.app.test_client()
+    with control.admit('verify'):
+        response = client.post('/api/face/verify', data=b'', content_type='image/jpeg')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['retry_after'] == int(response.headers['Retry-After'])
+    assert control.status()['active'] == 0
@@ -0,0 +1,80 @@
+"""DBConnectionPool: reuse, the size bound, discarding broken connections"""
+import threading
+
+import face_auth_secure as api
+import face_standin_db
+
+def make_pool(path, size=2, timeout=0.1, ping_after=30):
+    return api.DBConnectionPool(lambda: face_standin_db.connect(path), size, timeout, ping_after)
+
+def test_connections_are_reused(users):
+    pool = make_pool(users)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert pool.stats['created'] == 1
+    assert pool.stats['reused'] == 1
+    assert pool.stats['checkouts'] == 2
+    assert pool.stats['in_use'] == 0
+
+def test_exhausted_pool_times_out(users):
+    pool = make_pool(users, size=2)
+    held = [pool.acquire(), pool.acquire()]
+    assert pool.acquire() is None
+    assert pool.stats['timeouts'] == 1
+    assert pool.stats['peak_in_use'] == 2
+
+    pool.release(held.pop())
+    assert pool.acquire() is not None
+
+def test_waiter_gets_a_released_connection(users):
+    pool = make_pool(users, size=1, timeout=5)
+    connection = pool.acquire()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pool.acquire()))
+    waiter.start()
+    pool.release(connection)
+    waiter.join(5)
+    assert result == [connection]
+
+def test_release_rolls_back_uncommitted_writes(users):
+    pool = make_pool(users, size=1)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("UPDATE users SET first_name = 'Changed' WHERE id = 1")
+        cursor.close()
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT first_name FROM users WHERE id = 1")
+        assert cursor.fetchone()[0] == 'User1'
+        cursor.close()
+
+def test_connection_is_discarded_after_an_exception(users):
+    pool = make_pool(users)
+    try:
+        with pool.connection() as broken:
+            raise RuntimeError('query failed')
+    except RuntimeError:
+        pass
+    assert pool.stats['discarded'] == 1
+    assert not broken.is_connected()
+    with pool.connection() as connection:
+        assert connection is not broken
+
+def test_stale_connection_failing_its_ping_is_replaced(users):
+    pool = make_pool(users, ping_after=0)
+    with pool.connection() as stale:
+        pass
+    stale.close()
+    with pool.connection() as connection:
+        assert connection is not stale
+    assert pool.stats['discarded'] == 1
+    assert pool.stats['created'] == 2
+
+def test_connect_failure_frees_the_slot():
+    pool = api.DBConnectionPool(lambda: None, 1, 0.1, 30)
+    assert pool.acquire() is None
+    assert pool.acquire() is None
+    assert pool.stats['connect_failures'] == 2
+    assert pool.stats['timeouts'] == 0
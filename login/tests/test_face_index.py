@@ -0,0 +1,53 @@
+"""IVFIndex: recall against exact search and copy-on-write updates"""
+import numpy as np
+import pytest
+
+import face_auth_secure as api
+from face_index import IVFIndex
+
+def clustered_gallery(count=2000, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.random((clusters, api.FEATURE_DIM), dtype=np.float32)
+    labels = rng.integers(clusters, size=count)
+    return centers[labels] + rng.normal(0, 0.05, (count, api.FEATURE_DIM)).astype(np.float32)
+
+def exact_nearest(matrix, weights, probe):
+    diff = (matrix - probe) * weights
+    return int(np.argmin(np.einsum('ij,ij->i', diff, diff)))
+
+def test_recall_against_exact_search():
+    matrix = clustered_gallery()
+    weights = api.similarity_weights(api.FEATURE_DIM)
+    index = IVFIndex.train(matrix, weights)
+    rng = np.random.default_rng(1)
+
+    rows = rng.choice(len(matrix), 200, replace=False)
+    probes = matrix[rows] + rng.normal(0, 0.02, (len(rows), api.FEATURE_DIM)).astype(np.float32)
+    found = sum(exact_nearest(matrix, weights, probe) in set(index.candidates(probe, max(1, index.nlist // 8)))
+                for probe in probes)
+    assert found / len(probes) >= 0.95
+
+def test_probing_every_list_is_exact():
+    matrix = clustered_gallery(500)
+    index = IVFIndex.train(matrix, api.similarity_weights(api.FEATURE_DIM))
+    assert sorted(index.candidates(matrix[0], index.nlist)) == list(range(len(matrix)))
+
+def test_lists_cover_every_row_once_after_add_and_remove():
+    matrix = clustered_gallery(600)
+    weights = api.similarity_weights(api.FEATURE_DIM)
+    index = IVFIndex.train(matrix[:500], weights)
+    grown = index.add_many(500, matrix[500:])
+    assert len(index) == 500
+    assert len(grown) == 600
+
+    shrunk = grown.remove(10)
+    rows = np.concatenate(shrunk.lists)
+    assert sorted(rows) == list(range(599))
+    # The last row moved into the removed row's place and kept its list
+    assert shrunk.assignments[10] == grown.assignments[599]
+
+def test_rows_must_be_added_in_order():
+    matrix = clustered_gallery(100)
+    index = IVFIndex.train(matrix, api.similarity_weights(api.FEATURE_DIM))
+    with pytest.raises(ValueError):
+        index.add(50, matrix[0])
@@ -0,0 +1,66 @@
+"""LoginWriter: coalescing, flushing and retry of last_face_login updates"""
+import time
+
+import face_auth_secure as api
+import face_standin_db
+
+def last_logins(path):
+    connection = face_standin_db.connect(path)
+    cursor = connection.cursor()
+    cursor.execute("SELECT id, last_face_login FROM users WHERE last_face_login IS NOT NULL ORDER BY id")
+    rows = dict(cursor.fetchall())
+    cursor.close()
+    connection.close()
+    return rows
+
+def test_flush_writes_coalesced_logins(users):
+    # The background thread sleeps through the whole test (60 s interval, batch of 100)
+    writer = api.LoginWriter(batch_size=100, interval=60)
+    try:
+        writer.record(1)
+        writer.record(2)
+        writer.record('1')
+        assert last_logins(users) == {}
+        assert writer.status()['pending'] == 2
+        assert writer.stats['coalesced'] == 1
+
+        assert writer.flush() == 2
+        assert set(last_logins(users)) == {1, 2}
+        assert writer.status()['pending'] == 0
+        assert writer.flush() == 0
+    finally:
+        writer.stop()
+
+def test_failed_flush_keeps_updates_for_the_next_attempt(users, monkeypatch):
+    writer = api.LoginWriter(batch_size=100, interval=60)
+    try:
+        writer.record(3)
+        with monkeypatch.context() as patch:
+            patch.setattr(api, 'db_pool', api.DBConnectionPool(lambda: None, 1, 0.1, 30))
+            assert writer.flush() == 0
+        assert writer.stats['failures'] == 1
+        assert writer.status()['pending'] == 1
+
+        assert writer.flush() == 1
+        assert set(last_logins(users)) == {3}
+    finally:
+        writer.stop()
+
+def test_full_batch_wakes_the_background_thread(users):
+    writer = api.LoginWriter(batch_size=3, interval=60)
+    try:
+        for user_id in (4, 5, 6):
+            writer.record(user_id)
+        deadline = time.monotonic() + 5
+        while writer.stats['written'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert set(last_logins(users)) == {4, 5, 6}
+    finally:
+        writer.stop()
+
+def test_stop_flushes_what_is_left(users):
+    writer = api.LoginWriter(batch_size=100, interval=60)
+    writer.record(7)
+    writer.stop()
+    assert set(last_logins(users)) == {7}
+    assert writer.stats['written'] == 1
@@ -0,0 +1,44 @@
+"""ProbeCache: TTL expiry, LRU eviction and per-option keys"""
+import time
+
+import face_auth_secure as api
+
+def key(data, check_quality=False, reduce=1):
+    return api.ProbeCache.key(data, check_quality, reduce)
+
+def test_hit_returns_a_copy():
+    cache = api.ProbeCache(max_entries=4, ttl=60)
+    cache.put(key(b'a'), {'status': 'ok'})
+    hit = cache.get(key(b'a'))
+    hit['status'] = 'changed'
+    assert cache.get(key(b'a')) == {'status': 'ok'}
+    assert cache.stats['hits'] == 2
+
+def test_entries_expire_after_the_ttl():
+    cache = api.ProbeCache(max_entries=4, ttl=0.05)
+    cache.put(key(b'a'), {'status': 'ok'})
+    time.sleep(0.1)
+    assert cache.get(key(b'a')) is None
+    assert cache.stats['expired'] == 1
+    assert cache.status()['entries'] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = api.ProbeCache(max_entries=2, ttl=60)
+    cache.put(key(b'a'), {'status': 'a'})
+    cache.put(key(b'b'), {'status': 'b'})
+    cache.get(key(b'a'))
+    cache.put(key(b'c'), {'status': 'c'})
+    assert cache.get(key(b'b')) is None
+    assert cache.get(key(b'a')) == {'status': 'a'}
+    assert cache.get(key(b'c')) == {'status': 'c'}
+    assert cache.stats['evictions'] == 1
+
+def test_pipeline_options_are_part_of_the_key():
+    assert key(b'a') != key(b'a', check_quality=True)
+    assert key(b'a') != key(b'a', reduce=2)
+    assert key(b'a') != api.ProbeCache.key(b'a', False, 1, stream=True)
+    assert key(b'a') == key(bytes(b'a'))
+
+def test_disabled_without_size_or_ttl():
+    assert not api.ProbeCache(max_entries=0, ttl=60).enabled
+    assert not api.ProbeCache(max_entries=4, ttl=0).enabled
@@ -0,0 +1,79 @@
+"""Vectorized extract_face_signature / grid_statistics against the original per-cell loop"""
+import numpy as np
+import cv2
+import pytest
+
+import face_auth_secure as api
+from face_bench.signature import reference_extract_face_signature, synthetic_samples
+
+def reference_grid_statistics(face):
+    """Mean, std and median per grid cell, computed one cell at a time"""
+    features = []
+    cell_h = face.shape[0] // api.GRID_SIZE
+    cell_w = face.shape[1] // api.GRID_SIZE
+    for i in range(api.GRID_SIZE):
+        for j in range(api.GRID_SIZE):
+            cell = face[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w]
+            features.extend([float(cell.mean()), float(cell.std()), float(np.median(cell))])
+    return features
+
+def edge_samples():
+    """Rects at the minimum crop size, on the image borders, odd sizes and larger than FACE_SIZE"""
+    rng = np.random.default_rng(7)
+    img = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return [
+        (img, (0, 0, api.MIN_FACE_CROP, api.MIN_FACE_CROP)),
+        (img, (640 - 61, 480 - 97, 61, 97)),
+        (img, (13, 7, 127, 129)),
+        (img, (100, 50, 300, 300)),
+        (img, (0, 0, 640, 480)),
+        (gray, (40, 30, 90, 110)),
+        (np.zeros((200, 200, 3), np.uint8), (20, 20, 150, 150)),
+        (np.full((200, 200, 3), 255, np.uint8), (20, 20, 150, 150)),
+    ]
+
+SAMPLES = synthetic_samples(24) + edge_samples()
+
+@pytest.mark.parametrize('index', range(len(SAMPLES)))
+def test_extractor_matches_reference(index):
+    img, rect = SAMPLES[index]
+    expected = reference_extract_face_signature(img, rect)
+    assert expected is not None
+
+    actual = api.extract_face_signature(img, rect)
+    pooled = api.extract_face_signature(img, rect, context=api.PipelineContext())
+    for result in (actual, pooled):
+        assert result['features'] == expected['features']
+        assert result['hash'] == expected['hash']
+
+def test_batch_extractor_matches_reference():
+    features, hashes = api.extract_face_signatures([img for img, _ in SAMPLES], [rect for _, rect in SAMPLES])
+    for (img, rect), row, face_hash in zip(SAMPLES, features, hashes):
+        expected = reference_extract_face_signature(img, rect)
+        assert face_hash == expected['hash']
+        # The batch API returns float32
+        np.testing.assert_array_equal(row, np.asarray(expected['features'], dtype=np.float32))
+
+def test_too_small_faces_are_rejected_like_the_reference():
+    img = np.random.default_rng(3).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    for rect in [(10, 10, api.MIN_FACE_CROP - 1, 80), (10, 10, 80, api.MIN_FACE_CROP - 1), (400, 300, 60, 60)]:
+        assert reference_extract_face_signature(img, rect) is None
+        assert api.extract_face_signature(img, rect) is None
+
+    features, hashes = api.extract_face_signatures([img], [(10, 10, 20, 20)])
+    assert hashes == [None]
+    assert np.isnan(features).all()
+
+def test_grid_statistics_matches_cell_loop():
+    rng = np.random.default_rng(11)
+    faces = np.stack([
+        rng.random((api.FACE_SIZE, api.FACE_SIZE), dtype=np.float32),
+        np.zeros((api.FACE_SIZE, api.FACE_SIZE), np.float32),
+        np.ones((api.FACE_SIZE, api.FACE_SIZE), np.float32),
+        np.tile(np.linspace(0, 1, api.FACE_SIZE, dtype=np.float32), (api.FACE_SIZE, 1)),
+    ])
+    statistics = api.grid_statistics(faces)
+    assert statistics.shape == (len(faces), api.GRID_SIZE * api.GRID_SIZE * 3)
+    for face, row in zip(faces, statistics):
+        np.testing.assert_allclose(row, reference_grid_statistics(face), rtol=1e-6, atol=1e-7)
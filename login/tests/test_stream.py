@@ -0,0 +1,102 @@
+"""Streaming verification: frame fusion, tracking and session bookkeeping"""
+import pytest
+
+import face_auth_secure as api
+from face_bench import synthetic
+
+USER = {'id': 1, 'email': 'user1@standin.local', 'first_name': 'User1', 'last_name': 'Standin'}
+
+@pytest.fixture(scope='module')
+def stored_face():
+    face = api.run_face_pipeline(synthetic.encode_jpeg(synthetic.synthetic_face(1)), check_quality=True)
+    assert face['status'] == 'ok'
+    return {'hash': face['hash'], 'features': face['features'], 'user': USER}
+
+def frame(seed, capture):
+    return synthetic.encode_jpeg(synthetic.synthetic_probe(seed, capture))
+
+def test_enrolled_frame_is_accepted_by_hash(stored_face):
+    session = api.VerifySession('s', 1, stored_face)
+    body = session.push(synthetic.encode_jpeg(synthetic.synthetic_face(1)))
+    assert body['frame_status'] == 'ok'
+    assert body['authenticated'] and body['decided']
+    assert body['confidence'] == 1.0
+    assert body['user']['id'] == 1
+    assert session.push(frame(1, 1)) is None
+
+def test_frames_between_keyframes_are_tracked(stored_face, monkeypatch):
+    monkeypatch.setattr(api, 'VERIFY_THRESHOLD', 1.01)
+    monkeypatch.setattr(api, 'STREAM_KEYFRAME_INTERVAL', 3)
+    session = api.VerifySession('s', 1, stored_face)
+    bodies = [session.push(frame(1, capture)) for capture in range(10, 14)]
+    assert [body['frame_status'] for body in bodies] == ['ok'] * 4
+    assert [body['tracked'] for body in bodies] == [False, True, True, False]
+    assert bodies[-1]['detections'] == 2
+
+def test_confidence_fuses_the_best_frames(stored_face, monkeypatch):
+    monkeypatch.setattr(api, 'VERIFY_THRESHOLD', 1.01)
+    session = api.VerifySession('s', 1, stored_face)
+    for capture in range(10, 14):
+        session.push(frame(1, capture))
+    best = sorted(session.scores, reverse=True)[:api.STREAM_FUSE_FRAMES]
+    assert session.confidence() == pytest.approx(sum(best) / len(best))
+
+def test_rejects_after_the_frame_limit(stored_face, monkeypatch):
+    monkeypatch.setattr(api, 'VERIFY_THRESHOLD', 1.01)
+    monkeypatch.setattr(api, 'STREAM_MAX_FRAMES', 3)
+    session = api.VerifySession('s', 1, stored_face)
+    bodies = [session.push(frame(2, capture)) for capture in range(1, 4)]
+    assert [body['decided'] for body in bodies] == [False, False, True]
+    assert not bodies[-1]['authenticated']
+    assert bodies[-1]['frames_left'] == 0
+    assert session.push(frame(2, 4)) is None
+
+def test_bad_frames_count_but_do_not_score(stored_face):
+    session = api.VerifySession('s', 1, stored_face)
+    assert session.push(b'not an image')['frame_status'] == 'invalid_image'
+    assert session.push(b'')['frame_status'] == 'invalid_image'
+    assert session.frames == 2
+    assert session.scores == []
+
+def test_busy_pipeline_does_not_count_the_frame(stored_face, monkeypatch):
+    def busy(*args, **kwargs):
+        raise api.PipelineBusy()
+    monkeypatch.setattr(api, 'process_face_image', busy)
+    session = api.VerifySession('s', 1, stored_face)
+    with pytest.raises(api.PipelineBusy):
+        session.push(frame(1, 1))
+    assert session.frames == 0
+
+def test_sessions_are_bounded_and_expire(stored_face):
+    sessions = api.StreamSessions(max_sessions=2, ttl=60)
+    first = sessions.start(1, stored_face)
+    second = sessions.start(1, stored_face)
+    assert sessions.start(1, stored_face) is None
+    assert sessions.status()['refused'] == 1
+    assert sessions.get(first.session_id) is first
+
+    first.expires = 0
+    assert sessions.get(first.session_id) is None
+    assert sessions.status()['expired'] == 1
+
+    second.push(synthetic.encode_jpeg(synthetic.synthetic_face(1)))
+    sessions.finish(second)
+    status = sessions.status()
+    assert status['accepted'] == 1 and status['open'] == 0
+    assert sessions.start(1, stored_face) is not None
+
+def test_stream_routes(users, stored_face):
+    client = api.app.test_client()
+    enrolled = synthetic.encode_jpeg(synthetic.synthetic_face(1))
+    response = client.post('/api/face/register', query_string={'user_id': 1}, data=enrolled,
+                           content_type='image/jpeg')
+    assert response.get_json()['success']
+
+    started = client.post('/api/face/verify/stream', json={'user_id': 1}).get_json()
+    path = f"/api/face/verify/stream/{started['session_id']}"
+    body = client.post(path, data=enrolled, content_type='image/jpeg').get_json()
+    assert body['authenticated']
+    assert client.post(path, data=enrolled, content_type='image/jpeg').status_code == 404
+
+    missing = client.post('/api/face/verify/stream', json={'user_id': 9}).get_json()
+    assert missing['authenticated'] is False and 'session_id' not in missing
@@ -0,0 +1,74 @@
+"""Binary face template format: round trip and header validation"""
+import numpy as np
+import pytest
+
+import face_auth_secure as api
+
+FACE_HASH = 'ab' * 32
+
+def features(count=api.FEATURE_DIM, seed=0):
+    return np.random.default_rng(seed).random(count).tolist()
+
+def test_round_trip():
+    values = features()
+    blob = api.pack_face_template(values, FACE_HASH)
+    assert len(blob) == api.TEMPLATE_HEADER.size + api.FEATURE_DIM * 4
+
+    template = api.unpack_face_template(blob)
+    np.testing.assert_array_equal(template['features'], np.asarray(values, dtype=np.float32))
+    assert template['hash'] == FACE_HASH
+    assert template['schema'] == api.FEATURE_SCHEMA_VERSION
+    assert template['version'] == api.TEMPLATE_FORMAT_VERSION
+
+def test_round_trip_keeps_schema_and_empty_hash():
+    template = api.unpack_face_template(api.pack_face_template(features(), '', schema=0))
+    assert template['hash'] == ''
+    assert template['schema'] == 0
+
+def test_features_are_a_view_into_the_blob():
+    blob = api.pack_face_template(features(), FACE_HASH)
+    assert not api.unpack_face_template(blob)['features'].flags.owndata
+
+@pytest.mark.parametrize('blob, message', [
+    (b'', 'too short'),
+    (b'FRSM\x01', 'too short'),
+    (b'XXXX' + api.pack_face_template(features(), FACE_HASH)[4:], 'Not a face template'),
+])
+def test_rejects_malformed_headers(blob, message):
+    with pytest.raises(ValueError, match=message):
+        api.unpack_face_template(blob)
+
+def test_rejects_unknown_format_version():
+    blob = bytearray(api.pack_face_template(features(), FACE_HASH))
+    blob[4] = api.TEMPLATE_FORMAT_VERSION + 1
+    with pytest.raises(ValueError, match='Unsupported face template version'):
+        api.unpack_face_template(bytes(blob))
+
+@pytest.mark.parametrize('change', [lambda blob: blob[:-4], lambda blob: blob + b'\0\0\0\0'])
+def test_rejects_length_that_does_not_match_the_header(change):
+    blob = change(api.pack_face_template(features(), FACE_HASH))
+    with pytest.raises(ValueError, match='length does not match'):
+        api.unpack_face_template(blob)
+
+def test_dimension_mismatch_is_not_comparable():
+    template = api.unpack_face_template(api.pack_face_template(features(150), FACE_HASH))
+    assert len(template['features']) == 150
+    assert not api.template_compatible(template['schema'], template['features'])
+    assert not api.template_compatible(api.FEATURE_SCHEMA_VERSION + 1, features())
+    assert api.template_compatible(api.FEATURE_SCHEMA_VERSION, features())
+
+def test_stored_faces_of_another_layout_are_outdated():
+    row = {'face_template': api.pack_face_template(features(150), FACE_HASH),
+           'face_encoding': None, 'face_hash': FACE_HASH}
+    assert api.cache_stored_face(1, row) == (None, 'outdated')
+
+    row['face_template'] = b'XXXX' + row['face_template'][4:]
+    assert api.cache_stored_face(1, row) == (None, 'invalid')
+
+def test_json_signatures_decode_with_the_legacy_schema():
+    values = features()
+    encoding = api.json.dumps({'signature': values, 'hash': FACE_HASH})
+    decoded, face_hash, schema = api.decode_stored_face(None, encoding)
+    np.testing.assert_array_equal(decoded, np.asarray(values, dtype=np.float32))
+    assert face_hash == FACE_HASH
+    assert schema == api.LEGACY_FEATURE_SCHEMA